@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""Per-request cost of picking the dataset in `patched_request`.
+
+Compares the old approach (open, flock and read the shared dataset file on
+every request) with the in-process stack and the opt-in shared file.
+
+    $ python benchmarks/bench_dataset_selection.py --iterations=100000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from fcntl import flock, LOCK_EX
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import hulk.monkey
+from hulk.monkey import current_dataset, use_dataset
+
+
+def legacy_dataset(path):
+    dataset = None
+    dataset_file = None
+    try:
+        dataset_file = open(path, "r")
+    except IOError:
+        pass
+    if dataset_file:
+        flock(dataset_file, LOCK_EX)
+        dataset = dataset_file.read().strip()
+        dataset_file.close()
+    return dataset or 'default'
+
+
+def timed(func, iterations, *args):
+    started = time.time()
+    for _ in xrange(iterations):
+        func(*args)
+    return (time.time() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    handle, path = tempfile.mkstemp(prefix='hulk-bench-')
+    os.write(handle, 'bench')
+    os.close(handle)
+    hulk.monkey.CURRENT_DATASET_FILENAME = path
+
+    try:
+        print 'legacy flock per request   {:>8.3f}us'.format(
+            timed(legacy_dataset, args.iterations, path))
+
+        with use_dataset('bench'):
+            print 'in-process stack           {:>8.3f}us'.format(
+                timed(current_dataset, args.iterations))
+
+        hulk.monkey.use_shared_dataset_file(True)
+        print 'shared file, unchanged     {:>8.3f}us'.format(
+            timed(current_dataset, args.iterations))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Startup cost of `hulk.monkey` for test suites.
+
+Times `import hulk.monkey` in fresh interpreters (the best of `--runs`),
+lists the web framework modules it loads, and times decorating a large test
+collection with `with_dataset`, which patches requests every time it's used.
+
+    $ python benchmarks/bench_import.py --runs=20 --decorations=10000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+
+IMPORT_SCRIPT = '''
+import sys, time
+started = time.time()
+import hulk.monkey
+elapsed = time.time() - started
+print elapsed, len(sys.modules), ','.join(sorted(name for name in sys.modules
+    if name.split('.')[0] in ('flask', 'werkzeug', 'jinja2')
+        and '.' not in name))
+'''
+
+
+def time_import(runs):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    results = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c',
+            IMPORT_SCRIPT], env=env)
+        elapsed, modules, frameworks = (output.split() + [''])[:3]
+        results.append((float(elapsed), int(modules), frameworks))
+    return min(results)
+
+
+def time_decorations(count):
+    from hulk.monkey import with_dataset
+
+    def test():
+        pass
+
+    started = time.time()
+    for i in xrange(count):
+        with_dataset('dataset-{}'.format(i % 10), print_on_call=False)(test)
+    return time.time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--decorations', type=int, default=10000)
+    args = parser.parse_args()
+
+    elapsed, modules, frameworks = time_import(args.runs)
+    print 'import hulk.monkey  {:>7.1f}ms   {} modules   web framework: ' \
+        '{}'.format(elapsed * 1000, modules, frameworks or 'none')
+    elapsed = time_decorations(args.decorations)
+    print 'with_dataset x {}  {:>7.1f}ms   {:.2f}us each'.format(
+        args.decorations, elapsed * 1000, elapsed / args.decorations * 1e6)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""Keys per second built by `build_filename`.
+
+Compares the old md5-over-urlencode key with the key engine, cold (every key
+built from scratch) and memoized, with md5 and, if installed, xxh64.
+
+    $ python benchmarks/bench_keys.py --iterations=100000
+"""
+import argparse
+import collections
+import logging
+import md5
+import os
+import sys
+import time
+import urllib
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from hulk.keys import KeyEngine, xxhash
+
+
+logger = logging.getLogger()
+
+PARAMS = {'make': 'honda', 'model': 'civic', 'year': '2014', 'page': '3',
+    'sort': 'price', 'order': 'desc', 'empty': None}
+
+
+def legacy_filename(path, vals):
+    values = {}
+    if vals:
+        values.update((k, v) for k, v in vals.iteritems() if v is not None)
+        values = collections.OrderedDict(sorted(values.items()))
+    logger.debug('Using ordered values: {}'.format(values))
+    query_string_parts = [path]
+    if values:
+        query_string = urllib.urlencode(values)
+        logger.debug(' - mashed all params and data into query string: {}'
+            .format(query_string))
+        query_string_parts.append('?')
+        query_string_parts.append(query_string)
+    name_to_hash = ''.join(query_string_parts)
+    hashed = md5.new(name_to_hash).hexdigest()
+    logger.debug('filename before: {}'.format(name_to_hash))
+    logger.debug('filename after: {}'.format(hashed))
+    return hashed, name_to_hash
+
+
+def keys_per_second(func, iterations, distinct):
+    paths = ['/inventory/{}'.format(i) for i in xrange(distinct)]
+    started = time.time()
+    for i in xrange(iterations):
+        func(paths[i % distinct], PARAMS)
+    return iterations / (time.time() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--distinct', type=int, default=1000,
+        help='distinct paths requested, for the memoized runs')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    runs = [('legacy md5', legacy_filename, args.iterations)]
+    hashes = ['md5'] + (['xxh64'] if xxhash is not None else [])
+    for hash_name in hashes:
+        cold = KeyEngine(hash_name=hash_name)
+        warm = KeyEngine(hash_name=hash_name)
+        runs.append(('{} cold'.format(hash_name), cold.key, args.iterations))
+        runs.append(('{} memoized'.format(hash_name), warm.key,
+            args.distinct))
+
+    for label, func, distinct in runs:
+        print '{:<16} {:>10,.0f} keys/s'.format(label,
+            keys_per_second(func, args.iterations, distinct))
+
+
+if __name__ == '__main__':
+    main()
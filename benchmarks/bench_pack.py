@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Compares the loose-file and packed dataset layouts.
+
+Reports the time to copy the dataset, the cold-start cost (opening the
+dataset and serving the first lookup) and the average per-lookup cost.
+
+    $ python benchmarks/bench_pack.py --fixtures=20000
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from hulk.pack import get_pack, forget_pack, pack_dataset
+from hulk.utils import build_filename
+
+
+HOSTNAMES = ['api.foo.com', 'api.bar.com', 'search.baz.com']
+
+
+def build_dataset(folder, fixtures, size):
+    keys = []
+    body = 'x' * size
+    for i in range(fixtures):
+        hostname = HOSTNAMES[i % len(HOSTNAMES)]
+        hashname, _ = build_filename('/item/{}'.format(i), {})
+        host_folder = os.path.join(folder, hostname)
+        if not os.path.isdir(host_folder):
+            os.makedirs(host_folder)
+        with open(os.path.join(host_folder, hashname), 'w') as fixture:
+            fixture.write(body)
+        keys.append((hostname, hashname))
+    return keys
+
+
+def loose_lookup(folder, hostname, hashname):
+    path = os.path.join(folder, hostname, hashname)
+    if os.path.exists(path):
+        with open(path) as fixture:
+            return fixture.read()
+
+
+def packed_lookup(folder, hostname, hashname):
+    body = get_pack(folder).get(hostname, hashname)
+    if body is not None:
+        return str(body)
+
+
+def timed(func, *args):
+    started = time.time()
+    func(*args)
+    return time.time() - started
+
+
+def report(name, folder, lookup, keys, lookups):
+    copy_folder = folder + '-copy'
+    copy_time = timed(shutil.copytree, folder, copy_folder)
+    shutil.rmtree(copy_folder)
+
+    forget_pack(folder)
+    hostname, hashname = keys[0]
+    cold = timed(lookup, folder, hostname, hashname)
+
+    sample = [random.choice(keys) for _ in range(lookups)]
+    started = time.time()
+    for hostname, hashname in sample:
+        lookup(folder, hostname, hashname)
+    per_lookup = (time.time() - started) / lookups
+
+    print '{:<6} copy {:>9.1f}ms   cold start {:>8.3f}ms   lookup {:>7.2f}us' \
+        .format(name, copy_time * 1000, cold * 1000, per_lookup * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fixtures', type=int, default=5000)
+    parser.add_argument('--size', type=int, default=2048,
+        help='fixture body size in bytes')
+    parser.add_argument('--lookups', type=int, default=20000)
+    args = parser.parse_args()
+
+    base = tempfile.mkdtemp(prefix='hulk-bench-')
+    try:
+        loose = os.path.join(base, 'loose')
+        packed = os.path.join(base, 'packed')
+        keys = build_dataset(loose, args.fixtures, args.size)
+        shutil.copytree(loose, packed)
+        pack_dataset(packed, prune=True)
+
+        report('loose', loose, loose_lookup, keys, args.lookups)
+        report('packed', packed, packed_lookup, keys, args.lookups)
+    finally:
+        forget_pack(os.path.join(base, 'packed'))
+        shutil.rmtree(base)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""Scaling of `hulk --processes=N` across cores.
+
+Builds a synthetic dataset and starts `bin/hulk` with each of the given
+process counts in turn, then drives it with cache hits from several client
+processes (so the clients aren't the ones held back by the GIL) and reports
+the throughput, the latency and the speedup over the first count.
+
+    $ python benchmarks/bench_prefork.py --processes=1,2,4 --requests=20000
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import requests
+
+from bench_server import DATASET, FIXTURE_HOST, build_dataset, free_port, \
+    percentile, wait_for_port
+
+
+def client_process(port, urls, concurrency, results):
+    proxies = {'http': 'http://127.0.0.1:{}'.format(port)}
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    work = list(urls)
+
+    def client():
+        # keep-alive, so the server's time goes into answering requests
+        session = requests.Session()
+        while True:
+            with lock:
+                if not work:
+                    return
+                url = work.pop()
+            started = time.time()
+            try:
+                session.get(url, proxies=proxies, timeout=60).content
+            except Exception as e:
+                errors.append(e)
+                continue
+            latencies.append(time.time() - started)
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    results.put((latencies, len(errors)))
+
+
+def drive(port, urls, client_processes, concurrency):
+    results = multiprocessing.Queue()
+    share = len(urls) // client_processes
+    started = time.time()
+    workers = [multiprocessing.Process(target=client_process, args=(port,
+        urls[i * share:(i + 1) * share], concurrency, results))
+        for i in range(client_processes)]
+    for worker in workers:
+        worker.start()
+    latencies = []
+    errors = 0
+    for _ in workers:
+        worker_latencies, worker_errors = results.get()
+        latencies.extend(worker_latencies)
+        errors += worker_errors
+    for worker in workers:
+        worker.join()
+    return time.time() - started, latencies, errors
+
+
+def run(processes, args, base_folder):
+    port = free_port()
+    env = dict(os.environ, HULK_PORT=str(port),
+        HULK_DATASET_BASE_DIR=base_folder, PYTHONPATH=ROOT)
+    command = [sys.executable, os.path.join(ROOT, 'bin', 'hulk'),
+        '--dataset={}'.format(DATASET), '--server=pooled',
+        '--workers={}'.format(args.workers),
+        '--processes={}'.format(processes)]
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(command, env=env, stdout=devnull,
+            stderr=devnull)
+    try:
+        wait_for_port(port)
+        urls = ['http://{}/item/{}'.format(FIXTURE_HOST, i % args.fixtures)
+            for i in range(args.requests)]
+        # warm every process's hot cache first
+        drive(port, urls[:args.fixtures * processes], args.clients,
+            args.concurrency)
+        elapsed, latencies, errors = drive(port, urls, args.clients,
+            args.concurrency)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return len(latencies) / elapsed, latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', default='1,2,4',
+        help='comma-separated server process counts to compare')
+    parser.add_argument('--fixtures', type=int, default=200)
+    parser.add_argument('--size', type=int, default=4096,
+        help='fixture body size in bytes')
+    parser.add_argument('--requests', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=16,
+        help='worker threads per server process')
+    parser.add_argument('--clients', type=int,
+        default=multiprocessing.cpu_count(), help='client processes')
+    parser.add_argument('--concurrency', type=int, default=8,
+        help='client threads per client process')
+    args = parser.parse_args()
+
+    base_folder = tempfile.mkdtemp(prefix='hulk-bench-')
+    try:
+        build_dataset(base_folder, args.fixtures, args.size)
+        print '{} cores, {} client processes x {} threads'.format(
+            multiprocessing.cpu_count(), args.clients, args.concurrency)
+        baseline = None
+        for processes in [int(n) for n in args.processes.split(',')]:
+            rate, latencies, errors = run(processes, args, base_folder)
+            baseline = baseline or rate
+            print '{:>2} processes {:>8.1f} req/s  {:>5.2f}x   p50 {:>7.1f}ms' \
+                '   p99 {:>7.1f}ms   errors {}'.format(processes, rate,
+                    rate / baseline, percentile(latencies, 50) * 1000,
+                    percentile(latencies, 99) * 1000, errors)
+    finally:
+        shutil.rmtree(base_folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Per-request cost of a dataset's request-matching rules.
+
+Times `RuleSet.apply` for a host without rules, for a host whose rules don't
+match the path and for one whose rules rewrite the params, headers and path,
+against a rules file with `--rules` host-specific rules plus a global one.
+Then times `build_filename` (memoized keys) with and without the rules.
+
+    $ python benchmarks/bench_rules.py --iterations=200000 --rules=50
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from hulk.keys import build_filename
+from hulk.rules import RuleSet
+
+
+PARAMS = [('make', 'honda'), ('model', 'civic'), ('year', '2014'),
+    ('page', '3'), ('_', '1500000000000'), ('utm_source', 'mail'),
+    ('session', 'f00dfeed')]
+HEADERS = {'Accept': 'application/json', 'X-Request-Id': 'abc123'}
+
+
+def build_rules(count):
+    specs = [{'host': '*', 'ignore_params': ['_', 'utm_*']}]
+    for i in range(count):
+        specs.append({'host': 'api{}.example.com'.format(i),
+            'path': '^/inventory/{}'.format(i),
+            'wildcard_params': ['session'], 'drop_headers': ['x-request-id'],
+            'map_path': ['^/inventory/v2/', '/inventory/']})
+    return RuleSet(specs)
+
+
+def microseconds_per_call(func, iterations):
+    started = time.time()
+    for _ in xrange(iterations):
+        func()
+    return (time.time() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--rules', type=int, default=50,
+        help='host-specific rules in the rules file')
+    args = parser.parse_args()
+
+    rules = build_rules(args.rules)
+    host = 'api{}.example.com'.format(args.rules // 2)
+    path = '/inventory/{}'.format(args.rules // 2)
+    runs = [
+        ('apply, other host', lambda: rules.apply('other.com', path, PARAMS,
+            HEADERS)),
+        ('apply, other path', lambda: rules.apply(host, '/elsewhere', PARAMS,
+            HEADERS)),
+        ('apply, matching', lambda: rules.apply(host, path, PARAMS,
+            HEADERS)),
+        ('key, no rules', lambda: build_filename(path, PARAMS,
+            headers=HEADERS)),
+        ('key, rules', lambda: build_filename(path, PARAMS, headers=HEADERS,
+            hostname=host, rules=rules)),
+    ]
+    for label, func in runs:
+        print '{:<20} {:>8.2f}us per request'.format(label,
+            microseconds_per_call(func, args.iterations))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""Throughput/latency benchmark for the dev and pooled hulk servers.
+
+Builds a synthetic dataset, starts `bin/hulk` in load-origin mode against a
+deliberately slow local origin, and drives it with concurrent proxied clients.
+A small share of the requests are misses that hit the slow origin; the rest
+are cache hits, whose latency is reported separately.
+
+    $ python benchmarks/bench_server.py --requests=2000 --concurrency=16
+"""
+import argparse
+import BaseHTTPServer
+import os
+import shutil
+import socket
+import SocketServer
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib2
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from hulk.utils import build_filename
+
+
+FIXTURE_HOST = 'fixtures.local'
+DATASET = 'bench'
+
+
+class SlowOriginHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    delay = 0.2
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = '{"origin": "%s"}' % self.path
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn,
+        BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return
+        except socket.error:
+            time.sleep(0.05)
+    raise RuntimeError('hulk did not start on port {}'.format(port))
+
+
+def build_dataset(base_folder, fixtures, size):
+    folder = os.path.join(base_folder, DATASET, FIXTURE_HOST)
+    os.makedirs(folder)
+    body = 'x' * size
+    for i in range(fixtures):
+        hashname, _ = build_filename('/item/{}'.format(i), {})
+        with open(os.path.join(folder, hashname), 'w') as fixture:
+            fixture.write(body)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+def drive(port, urls, concurrency):
+    opener = urllib2.build_opener(urllib2.ProxyHandler(
+        {'http': 'http://127.0.0.1:{}'.format(port)}))
+    hit_latencies = []
+    errors = []
+    lock = threading.Lock()
+    work = list(urls)
+
+    def client():
+        while True:
+            with lock:
+                if not work:
+                    return
+                url, is_hit = work.pop()
+            started = time.time()
+            try:
+                opener.open(url, timeout=60).read()
+            except Exception as e:
+                errors.append(e)
+                continue
+            if is_hit:
+                hit_latencies.append(time.time() - started)
+
+    started = time.time()
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return time.time() - started, hit_latencies, errors
+
+
+def run(mode, args, base_folder, origin_port):
+    port = free_port()
+    env = dict(os.environ, HULK_PORT=str(port),
+        HULK_DATASET_BASE_DIR=base_folder, PYTHONPATH=ROOT)
+    command = [sys.executable, os.path.join(ROOT, 'bin', 'hulk'),
+        '--dataset={}'.format(DATASET), '--load-origin',
+        '--server={}'.format(mode), '--workers={}'.format(args.workers)]
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(command, env=env, stdout=devnull,
+            stderr=devnull)
+    try:
+        wait_for_port(port)
+        urls = []
+        for i in range(args.requests):
+            if args.miss_every and i % args.miss_every == 0:
+                urls.append(('http://127.0.0.1:{}/miss/{}/{}'.format(
+                    origin_port, mode, i), False))
+            else:
+                urls.append(('http://{}/item/{}'.format(
+                    FIXTURE_HOST, i % args.fixtures), True))
+        elapsed, latencies, errors = drive(port, urls, args.concurrency)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    print '{:<8} {:>8.1f} req/s   hit p50 {:>7.1f}ms   hit p99 {:>7.1f}ms' \
+        '   errors {}'.format(mode, args.requests / elapsed,
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000, len(errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fixtures', type=int, default=200)
+    parser.add_argument('--size', type=int, default=4096,
+        help='fixture body size in bytes')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--miss-every', type=int, default=50,
+        help='every Nth request is an origin miss (0 disables misses)')
+    parser.add_argument('--origin-delay', type=float, default=0.2,
+        help='seconds the stand-in origin takes to respond')
+    parser.add_argument('--servers', default='dev,pooled')
+    args = parser.parse_args()
+
+    base_folder = tempfile.mkdtemp(prefix='hulk-bench-')
+    SlowOriginHandler.delay = args.origin_delay
+    origin = ThreadedHTTPServer(('127.0.0.1', 0), SlowOriginHandler)
+    origin_thread = threading.Thread(target=origin.serve_forever)
+    origin_thread.daemon = True
+    origin_thread.start()
+
+    try:
+        build_dataset(base_folder, args.fixtures, args.size)
+        for mode in args.servers.split(','):
+            run(mode, args, base_folder, origin.server_address[1])
+    finally:
+        origin.shutdown()
+        shutil.rmtree(base_folder)
+
+
+if __name__ == '__main__':
+    main()
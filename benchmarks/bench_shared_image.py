@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""Replays a dataset with `with_dataset` from several worker processes.
+
+Compares every worker reading the loose fixture files with every worker
+mapping one shared image (`HULK_SHARED_IMAGE`). Reports the wall-clock time
+of the whole run, including building the image, and the memory of the
+workers: the sum of their proportional set sizes (shared pages are split
+between the processes mapping them) and of their private memory. The image
+shows up in the Pss of the workers mapping it, once in total; the page cache
+behind loose file reads doesn't show up in any process.
+
+    $ python benchmarks/bench_shared_image.py --workers=8 --fixtures=5000
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import requests
+
+import hulk.image
+import hulk.monkey
+from hulk.monkey import patched_request, use_dataset
+from hulk.utils import build_filename
+
+
+HOSTNAMES = ['api.foo.com', 'api.bar.com', 'search.baz.com']
+
+
+def build_dataset(folder, fixtures, size):
+    urls = []
+    body = ('{"id": %d, "payload": "' + 'x' * size + '"}')
+    for i in range(fixtures):
+        hostname = HOSTNAMES[i % len(HOSTNAMES)]
+        path = '/item/{}'.format(i)
+        hashname, _ = build_filename(path, {})
+        host_folder = os.path.join(folder, hostname)
+        if not os.path.isdir(host_folder):
+            os.makedirs(host_folder)
+        with open(os.path.join(host_folder, hashname), 'w') as fixture:
+            fixture.write(body % i)
+        urls.append('http://{}{}'.format(hostname, path))
+    return urls
+
+
+def memory():
+    """Returns (Pss, private) kB of this process, from /proc.
+    """
+    totals = {'Pss': 0, 'Private_Clean': 0, 'Private_Dirty': 0}
+    with open('/proc/self/smaps') as smaps:
+        for line in smaps:
+            name, _, value = line.partition(':')
+            if name in totals:
+                totals[name] += int(value.split()[0])
+    return totals['Pss'], totals['Private_Clean'] + totals['Private_Dirty']
+
+
+def worker(urls, lookups, seed, results):
+    request = patched_request()
+    session = requests.Session()
+    session.trust_env = False
+    random.seed(seed)
+    held = []
+    with use_dataset('bench'):
+        for _ in xrange(lookups):
+            response = request(session, 'GET', random.choice(urls))
+            # a test keeps a few responses around while it asserts on them
+            held.append(response.content)
+            if len(held) > 100:
+                held.pop(0)
+    results.put(memory())
+
+
+def run(urls, workers, lookups):
+    results = multiprocessing.Queue()
+    started = time.time()
+    processes = [multiprocessing.Process(target=worker,
+        args=(urls, lookups, seed, results)) for seed in range(workers)]
+    for process in processes:
+        process.start()
+    measured = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.time() - started
+    return elapsed, sum(m[0] for m in measured), sum(m[1] for m in measured)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--fixtures', type=int, default=5000)
+    parser.add_argument('--size', type=int, default=4096,
+        help='fixture body size in bytes')
+    parser.add_argument('--lookups', type=int, default=5000,
+        help='lookups per worker')
+    args = parser.parse_args()
+
+    base = tempfile.mkdtemp(prefix='hulk-bench-')
+    try:
+        urls = build_dataset(os.path.join(base, 'bench'), args.fixtures,
+            args.size)
+        hulk.monkey.dataset_folder = base
+        hulk.image.image_folder = os.path.join(base, 'images')
+
+        print '{} workers, {} lookups each, {} fixtures of {} bytes'.format(
+            args.workers, args.lookups, args.fixtures, args.size)
+        for name, shared in [('loose files', False), ('shared image', True)]:
+            hulk.monkey.use_shared_image(shared)
+            elapsed, pss, private = run(urls, args.workers, args.lookups)
+            print '{:<13} {:>7.2f}s   pss {:>8} kB   private {:>8} kB'.format(
+                name, elapsed, pss, private)
+    finally:
+        shutil.rmtree(base)
+
+
+if __name__ == '__main__':
+    main()
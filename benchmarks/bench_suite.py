@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+"""Load-test suite for hulk's replay and record paths, with JSON results.
+
+Generates a synthetic dataset, then runs each scenario at a fixed concurrency:
+
+* `proxy-replay`: `bin/hulk` serving the dataset to proxied clients
+* `proxy-record`: `bin/hulk --load-origin` recording new responses from a
+  local stand-in origin
+* `monkey-replay`: `patched_request` replaying the dataset in a test process
+
+Keys are picked uniformly or with a zipf distribution (a few hot fixtures,
+a long tail), from a seeded generator so runs are repeatable. Every scenario
+reports requests per second, p50/p99 latency, the resident memory of the
+process doing the work (the hulk server, or the worker for `monkey-replay`)
+and its read/write syscalls per request (`syscr` + `syscw` from
+/proc/<pid>/io, so Linux only). Results are printed and written as JSON, and
+`--compare` prints the change from an earlier run's JSON.
+
+    $ python benchmarks/bench_suite.py --output=before.json
+    $ python benchmarks/bench_suite.py --compare=before.json
+"""
+import argparse
+import bisect
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib2
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import requests
+
+import hulk.monkey
+from bench_server import SlowOriginHandler, ThreadedHTTPServer, free_port, \
+    percentile, wait_for_port
+from hulk.envelope import pack_head
+from hulk.monkey import patched_request, use_dataset
+from hulk.pack import pack_dataset
+from hulk.utils import build_filename
+from hulk.version import __version__
+
+
+DATASET = 'bench'
+HOSTNAMES = ['api.foo.local', 'api.bar.local', 'search.baz.local']
+SCENARIOS = ['proxy-replay', 'proxy-record', 'monkey-replay']
+
+
+def fixture_sizes(count, size, spread, rng):
+    """Body sizes around `size`: all equal, or log-normally spread with a
+    sigma of `spread`.
+    """
+    if not spread:
+        return [size] * count
+    return [max(1, int(rng.lognormvariate(0, spread) * size))
+        for _ in range(count)]
+
+
+def build_dataset(folder, sizes):
+    """Writes one JSON fixture per size and returns their urls.
+    """
+    urls = []
+    head = pack_head(200, [('Content-Type', 'application/json')])
+    for i, size in enumerate(sizes):
+        hostname = HOSTNAMES[i % len(HOSTNAMES)]
+        path = '/item/{}'.format(i)
+        hashname, _ = build_filename(path, {})
+        host_folder = os.path.join(folder, hostname)
+        if not os.path.isdir(host_folder):
+            os.makedirs(host_folder)
+        with open(os.path.join(host_folder, hashname), 'w') as fixture:
+            fixture.write(head + '{"id": %d, "payload": "%s"}' % (
+                i, 'x' * size))
+        urls.append('http://{}{}'.format(hostname, path))
+    return urls
+
+
+def pick_urls(urls, count, distribution, zipf_s, rng):
+    """Draws `count` urls, uniformly or with zipf weights by rank.
+    """
+    if distribution == 'uniform':
+        return [rng.choice(urls) for _ in xrange(count)]
+
+    cumulative = []
+    total = 0.0
+    for rank in range(1, len(urls) + 1):
+        total += 1.0 / rank ** zipf_s
+        cumulative.append(total)
+    ranked = list(urls)
+    rng.shuffle(ranked)
+    return [ranked[min(len(ranked) - 1, bisect.bisect_left(cumulative,
+        rng.random() * total))] for _ in xrange(count)]
+
+
+def process_stats(pid):
+    """Returns (rss kB, peak rss kB, read/write syscalls) of a process.
+    """
+    stats = {}
+    with open('/proc/{}/status'.format(pid)) as status:
+        for line in status:
+            name, _, value = line.partition(':')
+            if name in ('VmRSS', 'VmHWM'):
+                stats[name] = int(value.split()[0])
+    with open('/proc/{}/io'.format(pid)) as io:
+        for line in io:
+            name, _, value = line.partition(':')
+            if name in ('syscr', 'syscw'):
+                stats[name] = int(value)
+    return stats['VmRSS'], stats['VmHWM'], stats['syscr'] + stats['syscw']
+
+
+def drive(call, urls, concurrency):
+    """Calls `call(url)` for every url from `concurrency` threads. Returns
+    (elapsed, latencies, errors).
+    """
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    work = list(reversed(urls))
+
+    def client():
+        while True:
+            with lock:
+                if not work:
+                    return
+                url = work.pop()
+            started = time.time()
+            try:
+                call(url)
+            except Exception as e:
+                errors.append(e)
+                continue
+            latencies.append(time.time() - started)
+
+    started = time.time()
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return time.time() - started, latencies, errors
+
+
+def measure(pid, call, warmup, urls, concurrency):
+    """Drives `urls` after a warmup, and measures the process `pid` doing
+    the work.
+    """
+    drive(call, warmup, concurrency)
+    _, _, syscalls_before = process_stats(pid)
+    elapsed, latencies, errors = drive(call, urls, concurrency)
+    rss, peak_rss, syscalls_after = process_stats(pid)
+    return {
+        'requests': len(urls),
+        'errors': len(errors),
+        'seconds': round(elapsed, 3),
+        'rps': round(len(urls) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'rss_kb': rss,
+        'peak_rss_kb': peak_rss,
+        'syscalls_per_request': round(
+            float(syscalls_after - syscalls_before) / len(urls), 1),
+    }
+
+
+def run_proxy(args, base_folder, warmup, urls, load_origin=False):
+    port = free_port()
+    env = dict(os.environ, HULK_PORT=str(port),
+        HULK_DATASET_BASE_DIR=base_folder, PYTHONPATH=ROOT)
+    command = [sys.executable, os.path.join(ROOT, 'bin', 'hulk'),
+        '--dataset={}'.format(DATASET), '--server={}'.format(args.server),
+        '--workers={}'.format(args.concurrency)]
+    if load_origin:
+        command.append('--load-origin')
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(command, env=env, stdout=devnull,
+            stderr=devnull)
+    try:
+        wait_for_port(port)
+        opener = urllib2.build_opener(urllib2.ProxyHandler(
+            {'http': 'http://127.0.0.1:{}'.format(port)}))
+        return measure(proc.pid, lambda url: opener.open(url, timeout=60)
+            .read(), warmup, urls, args.concurrency)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def monkey_worker(base_folder, warmup, urls, concurrency, results):
+    hulk.monkey.dataset_folder = base_folder
+    request = patched_request()
+    session = requests.Session()
+    session.trust_env = False
+
+    def call(url):
+        with use_dataset(DATASET):
+            request(session, 'GET', url).content
+
+    results.put(measure(os.getpid(), call, warmup, urls, concurrency))
+
+
+def run_monkey(args, base_folder, warmup, urls):
+    # a fresh process, so its memory is the replay's and not the suite's
+    results = multiprocessing.Queue()
+    worker = multiprocessing.Process(target=monkey_worker,
+        args=(base_folder, warmup, urls, args.concurrency, results))
+    worker.start()
+    result = results.get()
+    worker.join()
+    return result
+
+
+def run_scenario(scenario, args, base_folder, urls, rng, origin_port):
+    if scenario == 'proxy-record':
+        # every request is a new key the stand-in origin has to answer
+        record_urls = ['http://127.0.0.1:{}/record/{}'.format(origin_port, i)
+            for i in xrange(args.warmup + args.requests)]
+        return run_proxy(args, base_folder, record_urls[:args.warmup],
+            record_urls[args.warmup:], load_origin=True)
+
+    warmup = pick_urls(urls, args.warmup, args.distribution, args.zipf_s, rng)
+    picked = pick_urls(urls, args.requests, args.distribution, args.zipf_s,
+        rng)
+    if scenario == 'proxy-replay':
+        return run_proxy(args, base_folder, warmup, picked)
+    return run_monkey(args, base_folder, warmup, picked)
+
+
+def compare(results, previous):
+    """Prints the change of every scenario from an earlier run.
+    """
+    print 'compared to hulk {} ({}):'.format(previous['hulk'],
+        previous['started'])
+    for scenario, result in sorted(results.items()):
+        before = previous['results'].get(scenario)
+        if before is None:
+            continue
+        changes = []
+        for key in ('rps', 'p50_ms', 'p99_ms', 'rss_kb',
+                'syscalls_per_request'):
+            if before.get(key):
+                changes.append('{} {:+.1%}'.format(key,
+                    float(result[key]) / before[key] - 1))
+        print '{:<14} {}'.format(scenario, '   '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--fixtures', type=int, default=2000)
+    parser.add_argument('--size', type=int, default=4096,
+        help='median fixture body size in bytes')
+    parser.add_argument('--size-spread', type=float, default=1.0,
+        help='sigma of the log-normal body sizes (0 for equal sizes)')
+    parser.add_argument('--distribution', choices=['uniform', 'zipf'],
+        default='zipf')
+    parser.add_argument('--zipf-s', type=float, default=1.1,
+        help='zipf exponent, higher is more skewed to the hot fixtures')
+    parser.add_argument('--pack', action='store_true',
+        help='pack the dataset before replaying it')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--warmup', type=int, default=200,
+        help='requests made before measuring')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--server', default='pooled',
+        help='`dev` or `pooled` hulk server')
+    parser.add_argument('--origin-delay', type=float, default=0.0,
+        help='seconds the stand-in origin takes to respond')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--compare', help='results of an earlier run')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    base_folder = tempfile.mkdtemp(prefix='hulk-bench-')
+    SlowOriginHandler.delay = args.origin_delay
+    origin = ThreadedHTTPServer(('127.0.0.1', 0), SlowOriginHandler)
+    origin_thread = threading.Thread(target=origin.serve_forever)
+    origin_thread.daemon = True
+    origin_thread.start()
+
+    report = {
+        'hulk': __version__,
+        'python': platform.python_version(),
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'params': vars(args),
+        'results': {},
+    }
+    try:
+        folder = os.path.join(base_folder, DATASET)
+        urls = build_dataset(folder, fixture_sizes(args.fixtures, args.size,
+            args.size_spread, rng))
+        if args.pack:
+            pack_dataset(folder, prune=True)
+
+        print '{} fixtures, {} distribution, {} requests at concurrency ' \
+            '{}'.format(args.fixtures, args.distribution, args.requests,
+                args.concurrency)
+        for scenario in args.scenarios.split(','):
+            result = run_scenario(scenario, args, base_folder, urls, rng,
+                origin.server_address[1])
+            report['results'][scenario] = result
+            print '{:<14} {:>8.1f} req/s   p50 {:>7.2f}ms   p99 {:>7.2f}ms' \
+                '   rss {:>7} kB   {:>6.1f} syscalls/req   errors {}'.format(
+                    scenario, result['rps'], result['p50_ms'],
+                    result['p99_ms'], result['rss_kb'],
+                    result['syscalls_per_request'], result['errors'])
+    finally:
+        origin.shutdown()
+        shutil.rmtree(base_folder)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(report['results'], json.load(previous))
+
+
+if __name__ == '__main__':
+    main()
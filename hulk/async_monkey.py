@@ -0,0 +1,143 @@
+"""Serves datasets to tornado's `AsyncHTTPClient`, the way `hulk.monkey`
+serves them to `requests`.
+
+`patch_tornado()` makes `DatasetHTTPClient` the `AsyncHTTPClient`
+implementation. Requests are keyed exactly as `patched_request` keys them
+(the url's query string, form bodies and, with the key engine configured for
+them, JSON bodies and headers) and answered from the dataset selected with
+`with_dataset`/`use_dataset`, without going through the proxy:
+
+* responses in the dataset's pack or shared image are mapped in memory and
+  answered on the IOLoop straight away
+* loose files, and responses from the dataset's parent layers (see
+  `hulk.layers`), are read on a small thread pool, so concurrent fetches
+  don't block the IOLoop or each other
+
+Missing fixtures are answered with a 417, which `fetch` raises as an
+`HTTPError` unless `raise_error=False`.
+"""
+import logging
+import os
+from io import BytesIO
+from urlparse import urlparse, parse_qsl
+
+from concurrent.futures import ThreadPoolExecutor
+from tornado.httpclient import AsyncHTTPClient, HTTPResponse
+from tornado.httputil import HTTPHeaders
+from tornado.ioloop import IOLoop
+
+from hulk import monkey
+from hulk.codec import decode
+from hulk.envelope import read_envelope
+from hulk.keys import build_filename, is_json
+from hulk.layers import get_stack
+from hulk.rules import get_rules
+
+
+logger = logging.getLogger()
+
+FORM_MIMETYPE = 'application/x-www-form-urlencoded'
+DEFAULT_READ_THREADS = 4
+
+# reads loose fixture files off the IOLoop
+read_pool = ThreadPoolExecutor(DEFAULT_READ_THREADS)
+
+
+def set_read_threads(count):
+    """Sets the number of threads reading loose fixture files.
+    """
+    global read_pool
+    read_pool = ThreadPoolExecutor(count)
+
+
+def request_key(request, rules=None):
+    """Returns the (hostname, hash) a tornado HTTPRequest is stored under,
+    with the dataset's request-matching `rules` (see `hulk.rules`) applied.
+    """
+    parsed_url = urlparse(request.url)
+    values = parse_qsl(parsed_url.query, keep_blank_values=True)
+    body = request.body or None
+    # tornado sends POST bodies without a Content-Type as forms
+    content_type = request.headers.get('Content-Type',
+        FORM_MIMETYPE if request.method == 'POST' else '')
+    if body is not None and content_type.startswith(FORM_MIMETYPE):
+        values.extend(parse_qsl(body, keep_blank_values=True))
+        body = None
+    elif not is_json(content_type):
+        # the proxy only keys JSON bodies
+        body = None
+
+    hashname, _ = build_filename(parsed_url.path, values, body=body,
+        headers=request.headers, hostname=parsed_url.hostname, rules=rules)
+    return parsed_url.hostname, hashname
+
+
+def build_response(request, folder, full_path, content, start_time):
+    """Builds the HTTPResponse for a stored response, or a 417 for None.
+    """
+    headers = HTTPHeaders()
+    if content is None:
+        code = 417
+        body = 'The dataset {} could not be found.'.format(full_path)
+    else:
+        envelope = read_envelope(content)
+        code = 200
+        if envelope is not None:
+            code = envelope.status
+            for name, value in envelope.headers:
+                headers.add(name, value)
+            content = buffer(content, envelope.offset)
+        body = decode(content, folder)
+
+    return HTTPResponse(request, code, headers=headers,
+        buffer=BytesIO(body), effective_url=request.url,
+        request_time=IOLoop.current().time() - start_time)
+
+
+class DatasetHTTPClient(AsyncHTTPClient):
+    """AsyncHTTPClient that answers every fetch from the current dataset.
+    """
+
+    def fetch_impl(self, request, callback):
+        start_time = self.io_loop.time()
+
+        # the dataset is picked here, on the thread that made the request
+        dataset = monkey.current_dataset()
+        folder = os.path.join(monkey.dataset_folder, dataset)
+        stack = get_stack(monkey.dataset_folder, dataset)
+        hostname, hashname = request_key(request, get_rules(folder))
+        full_path = os.path.join(folder, hostname, hashname)
+        logger.info('Attempting to load dataset: %s', full_path)
+
+        content = monkey.find_stored(folder, hostname, hashname)
+        if content is not None:
+            callback(build_response(request, folder, full_path, content,
+                start_time))
+            return
+
+        def read():
+            content = monkey.read_stored(folder, hostname, hashname)
+            if content is None:
+                # from a parent layer, if the dataset has any
+                return monkey.read_layered(stack, hostname, hashname)
+            return folder, content
+
+        def done(future):
+            try:
+                stored_folder, content = future.result()
+                response = build_response(request, stored_folder or folder,
+                    full_path, content, start_time)
+            except Exception as e:
+                response = HTTPResponse(request, 599, error=e,
+                    request_time=self.io_loop.time() - start_time)
+            callback(response)
+
+        self.io_loop.add_future(read_pool.submit(read), done)
+
+
+def patch_tornado():
+    """Makes new AsyncHTTPClients answer from hulk datasets. Clients that
+    already exist (there's one per IOLoop by default) keep their old
+    implementation.
+    """
+    AsyncHTTPClient.configure(DatasetHTTPClient)
@@ -0,0 +1,380 @@
+"""Content-addressed storage of response bodies.
+
+Different requests (pagination cursors, timestamps, tracking params) often
+get byte-identical bodies back. With blob storage on (`hulk --dedupe`,
+`hulk record --dedupe`), each distinct body is stored once per dataset, under
+the sha1 digest of the uncompressed body, in `.blobs/<aa>/<digest>`. The
+response file saved under the request's key keeps its envelope (status and
+headers, see `hulk.envelope`), followed by a reference to the blob instead of
+the body:
+
+    HULKREF1<sha1 digest, 40 hex digits>
+
+Blobs hold the body as it would otherwise have been stored, compressed if a
+storage codec is set (see `hulk.codec`). References are resolved through a
+`BlobStore` per dataset, which keeps recently read blobs in memory, so the
+responses sharing a body share one copy of it. The manifest records the
+digest, status and headers of every deduplicated recording, and the proxy
+loads them into a `BlobRefs` table the first time a dataset is used, so
+those responses are served from their blob without reading the response
+file. Responses without a manifest record (eg converted by `hulk dedupe`, or
+recorded by another process since) are resolved from their file.
+
+References aren't counted as responses are saved, since recorders in
+several processes would have to share the counts. `count_references` counts
+them with one pass over the dataset's loose and packed responses and
+`collect_garbage` (`hulk gc`) removes the blobs nothing refers to anymore,
+eg after re-recording with `--overwrite`. `dedupe_dataset` (`hulk dedupe`)
+moves the bodies of an existing dataset into its blob store.
+"""
+import errno
+import hashlib
+import itertools
+import logging
+import os
+import threading
+import time
+
+from hulk.cache import HotCache
+from hulk.envelope import split_envelope
+from hulk.manifest import load_manifest
+from hulk.pack import INDEX_FILENAME, PackedDataset, iter_loose_files, \
+    rewrite_pack
+
+
+logger = logging.getLogger()
+
+REF_MAGIC = 'HULKREF1'
+DIGEST_SIZE = 40
+REF_SIZE = len(REF_MAGIC) + DIGEST_SIZE
+BLOBS_DIRNAME = '.blobs'
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+# how long (seconds) a new blob is kept before anything refers to it, as
+# the response referring to it may still be being saved
+DEFAULT_GRACE = 60.0
+
+# whether new recordings store their bodies as blobs
+blob_storage = False
+
+_temp_names = itertools.count()
+
+
+def set_blob_storage(enabled):
+    """Turns storing the bodies of new recordings as blobs on or off.
+    """
+    global blob_storage
+    blob_storage = enabled
+
+
+def make_ref(digest):
+    return REF_MAGIC + digest
+
+
+def read_ref(body):
+    """Returns the digest a stored body refers to, or None if it isn't a
+    reference.
+    """
+    if len(body) != REF_SIZE or body[:len(REF_MAGIC)] != REF_MAGIC:
+        return None
+    return str(body[len(REF_MAGIC):])
+
+
+class BlobStore(object):
+    """The blobs of a dataset folder, with the recently read ones kept in
+    memory.
+    """
+
+    def __init__(self, folder, cache_bytes=DEFAULT_CACHE_BYTES):
+        self.folder = folder
+        self.root = os.path.join(folder, BLOBS_DIRNAME)
+        # blobs never change, so there's no need to recheck them
+        self.cache = HotCache(max_bytes=cache_bytes, revalidate_after=1e9)
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def temp_path(self):
+        """Returns a new temp file name in the store.
+        """
+        if not os.path.isdir(self.root):
+            try:
+                os.makedirs(self.root)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        return os.path.join(self.root, '{}-{}.tmp'.format(os.getpid(),
+            next(_temp_names)))
+
+    def add(self, temp_path, digest):
+        """Moves a finished temp file into the store as the blob `digest`,
+        unless the store has that blob already. Returns whether it was new.
+        """
+        path = self.path(digest)
+        if os.path.exists(path):
+            os.unlink(temp_path)
+            # so garbage collection leaves it be while it's being referred to
+            os.utime(path, None)
+            return False
+
+        try:
+            os.mkdir(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        os.rename(temp_path, path)
+        return True
+
+    def put(self, stored, digest):
+        """Stores a body (as it's stored, eg compressed) as the blob `digest`.
+        """
+        temp_path = self.temp_path()
+        with open(temp_path, 'wb') as blob:
+            blob.write(stored)
+        return self.add(temp_path, digest)
+
+    def get(self, digest):
+        """Returns a blob from memory or disk, or None if it's too big to
+        keep in memory; those should be streamed with `open`.
+        """
+        entry = self.cache.get(digest)
+        if entry is None:
+            entry = self.cache.load(digest, self.path(digest))
+        return entry.body if entry is not None else None
+
+    def open(self, digest):
+        return open(self.path(digest), 'rb')
+
+    def read(self, digest):
+        body = self.get(digest)
+        if body is None:
+            with self.open(digest) as blob:
+                body = blob.read()
+        return body
+
+    def blobs(self):
+        """Yields (digest, path) for every blob in the store.
+        """
+        if not os.path.isdir(self.root):
+            return
+        for prefix in sorted(os.listdir(self.root)):
+            prefix_folder = os.path.join(self.root, prefix)
+            if not os.path.isdir(prefix_folder):
+                continue
+            for digest in sorted(os.listdir(prefix_folder)):
+                yield digest, os.path.join(prefix_folder, digest)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_blob_store(folder):
+    """Returns the BlobStore of a dataset folder.
+    """
+    try:
+        return _stores[folder]
+    except KeyError:
+        pass
+
+    with _stores_lock:
+        if folder not in _stores:
+            _stores[folder] = BlobStore(folder)
+        return _stores[folder]
+
+
+def forget_blob_store(folder):
+    """Drops the BlobStore of `folder`, and the blobs it holds in memory.
+    """
+    with _stores_lock:
+        _stores.pop(folder, None)
+
+
+class BlobRefs(object):
+    """The deduplicated responses of a dataset folder, as (hostname, hash) ->
+    (digest, status, headers), loaded from its manifest.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.refs = {}
+        self.load()
+
+    def __len__(self):
+        return len(self.refs)
+
+    def load(self):
+        refs = {}
+        for hashname, record in load_manifest(self.folder).iteritems():
+            # records of older recordings lack the status and headers
+            if record.get('digest') is None or record.get('status') is None:
+                continue
+            hostname = record['url'].split('/', 1)[0]
+            refs[(hostname, hashname)] = (record['digest'], record['status'],
+                [tuple(pair) for pair in record.get('headers') or []])
+        self.refs = refs
+        logger.debug('loaded {} blob references of {}'.format(len(refs),
+            self.folder))
+
+    def get(self, hostname, hashname):
+        return self.refs.get((hostname, hashname))
+
+    def add(self, hostname, hashname, digest, status, headers):
+        self.refs[(hostname, hashname)] = (digest, status, list(headers))
+
+    def discard(self, hostname, hashname):
+        self.refs.pop((hostname, hashname), None)
+
+
+_refs = {}
+_refs_lock = threading.Lock()
+
+
+def get_blob_refs(folder):
+    """Returns the BlobRefs of a dataset folder, loading them from its
+    manifest the first time they are asked for.
+    """
+    try:
+        return _refs[folder]
+    except KeyError:
+        pass
+
+    with _refs_lock:
+        if folder not in _refs:
+            _refs[folder] = BlobRefs(folder)
+        return _refs[folder]
+
+
+def forget_blob_refs(folder):
+    """Drops the BlobRefs of `folder`, eg after re-recording it elsewhere.
+    """
+    with _refs_lock:
+        _refs.pop(folder, None)
+
+
+def recording_blobs(folder):
+    """Returns the BlobStore new recordings in `folder` store their bodies
+    in, or None to store them in the response files.
+    """
+    return get_blob_store(folder) if blob_storage else None
+
+
+def resolve(body, folder):
+    """Returns a stored body, with a reference replaced by the blob it refers
+    to.
+    """
+    digest = read_ref(body)
+    if digest is None:
+        return body
+    return get_blob_store(folder).read(digest)
+
+
+def iter_stored(folder):
+    """Yields (hostname, hashname, stored response) for every response in a
+    dataset folder, loose and packed.
+    """
+    for hostname, hashname, path in iter_loose_files(folder):
+        with open(path, 'rb') as loose:
+            yield hostname, hashname, loose.read()
+
+    if os.path.exists(os.path.join(folder, INDEX_FILENAME)):
+        pack = PackedDataset(folder)
+        for hostname, hashname, stored in pack.records():
+            yield hostname, hashname, stored
+        pack.close()
+
+
+def count_references(folder):
+    """Returns {digest: responses referring to it} for a dataset folder.
+    """
+    counts = {}
+    for _, _, stored in iter_stored(folder):
+        digest = read_ref(split_envelope(stored)[1])
+        if digest is not None:
+            counts[digest] = counts.get(digest, 0) + 1
+    return counts
+
+
+def dedupe_stats(folder):
+    """Returns the deduplication stats of a dataset folder: the responses
+    referring to blobs, the blobs, the bytes the referring responses' bodies
+    would take without deduplication and the bytes the blobs take.
+    """
+    counts = count_references(folder)
+    store = get_blob_store(folder)
+    stats = {'references': sum(counts.values()), 'blobs': 0,
+        'logical_bytes': 0, 'stored_bytes': 0}
+    for digest, path in store.blobs():
+        size = os.path.getsize(path)
+        stats['blobs'] += 1
+        stats['stored_bytes'] += size
+        stats['logical_bytes'] += size * counts.get(digest, 0)
+    stats['ratio'] = float(stats['logical_bytes']) / stats['stored_bytes'] \
+        if stats['stored_bytes'] else 1.0
+    return stats
+
+
+def collect_garbage(folder, grace=DEFAULT_GRACE):
+    """Removes the blobs of a dataset folder that no response refers to and
+    that are older than `grace` seconds. Returns (blobs removed, bytes
+    freed).
+    """
+    counts = count_references(folder)
+    store = get_blob_store(folder)
+    removed = freed = 0
+    now = time.time()
+    for digest, path in list(store.blobs()):
+        if digest in counts:
+            continue
+        stat = os.stat(path)
+        if now - stat.st_mtime < grace:
+            continue
+        os.unlink(path)
+        removed += 1
+        freed += stat.st_size
+    forget_blob_store(folder)
+    logger.info('removed {} unreferenced blobs ({} bytes) from {}'.format(
+        removed, freed, folder))
+    return removed, freed
+
+
+def dedupe_dataset(folder):
+    """Moves the body of every response in a dataset folder, loose and
+    packed, into its blob store, in place. Returns (responses rewritten,
+    bytes before, bytes after).
+    """
+    # decoding needs the codecs, which need this module
+    from hulk.codec import decode
+
+    store = get_blob_store(folder)
+    totals = {'rewritten': 0, 'before': 0}
+
+    def convert(stored_response):
+        head, body = split_envelope(stored_response)
+        if read_ref(body) is not None:
+            return None
+        totals['before'] += len(body)
+        digest = hashlib.sha1(decode(body, folder)).hexdigest()
+        store.put(str(body), digest)
+        totals['rewritten'] += 1
+        return head + make_ref(digest)
+
+    for _, _, path in iter_loose_files(folder):
+        with open(path, 'rb') as loose:
+            converted = convert(loose.read())
+        if converted is None:
+            continue
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as loose:
+            loose.write(converted)
+        os.rename(temp_path, path)
+
+    if os.path.exists(os.path.join(folder, INDEX_FILENAME)):
+        def transform(hostname, hashname, body):
+            converted = convert(body)
+            return body if converted is None else converted
+        rewrite_pack(folder, transform)
+
+    after = sum(os.path.getsize(path) for _, path in store.blobs())
+    logger.info('deduplicated {}: {} bytes of bodies -> {} bytes of '
+        'blobs'.format(folder, totals['before'], after))
+    return totals['rewritten'], totals['before'], after
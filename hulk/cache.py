@@ -0,0 +1,153 @@
+import collections
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger()
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 10000
+# files bigger than this are streamed from disk rather than cached
+DEFAULT_MAX_ENTRY_BYTES = 1024 * 1024
+# how long (seconds) a warm entry is trusted before its mtime is re-checked
+DEFAULT_REVALIDATE_AFTER = 1.0
+
+
+class CacheEntry(object):
+    """A cached response body plus the file stats it was read with.
+    """
+    __slots__ = ('body', 'headers', 'mtime', 'size', 'checked')
+
+    def __init__(self, body, headers, mtime, size):
+        self.body = body
+        self.headers = headers
+        self.mtime = mtime
+        self.size = size
+        self.checked = time.time()
+
+
+class HotCache(object):
+    """Byte-budgeted LRU cache of response bodies, keyed by
+    (dataset, hostname, hash).
+
+    Warm entries are served straight from memory. The backing file is only
+    stat'd again once `revalidate_after` seconds have passed since the last
+    check, and the entry is dropped if its mtime or size changed.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES,
+            max_entries=DEFAULT_MAX_ENTRIES,
+            revalidate_after=DEFAULT_REVALIDATE_AFTER,
+            max_entry_bytes=DEFAULT_MAX_ENTRY_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.revalidate_after = revalidate_after
+        self.entries = collections.OrderedDict()
+        self.paths = {}
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Returns the warm entry for `key`, or None.
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries[key] = entry   # most recently used goes to the end
+
+        if time.time() - entry.checked > self.revalidate_after:
+            if not self._revalidate(key, entry):
+                return None
+
+        with self.lock:
+            self.hits += 1
+        return entry
+
+    def load(self, key, path, headers=None):
+        """Reads `path` from disk, caches it under `key` and returns the entry.
+
+        Returns None, without reading the file, if it is bigger than
+        `max_entry_bytes`; those should be streamed instead.
+        """
+        with open(path, 'rb') as cached_file:
+            stat = os.fstat(cached_file.fileno())
+            if stat.st_size > self.max_entry_bytes:
+                return None
+            body = cached_file.read()
+        entry = CacheEntry(body, headers or [], stat.st_mtime, stat.st_size)
+        self.put(key, path, entry)
+        return entry
+
+    def put(self, key, path, entry):
+        size = len(entry.body)
+        if size > self.max_entry_bytes or self.max_entries <= 0:
+            return
+
+        with self.lock:
+            self._discard(key)
+            self.entries[key] = entry
+            self.paths[key] = path
+            self.current_bytes += size
+            while (self.current_bytes > self.max_bytes or
+                    len(self.entries) > self.max_entries):
+                oldest = next(iter(self.entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            if self._discard(key):
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.paths.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'entries': len(self.entries),
+            'bytes': self.current_bytes,
+        }
+
+    def _revalidate(self, key, entry):
+        try:
+            stat = os.stat(self.paths[key])
+        except (KeyError, OSError):
+            stat = None
+
+        if stat is None or stat.st_mtime != entry.mtime or \
+                stat.st_size != entry.size:
+            logger.debug('hot cache entry changed on disk: {}'.format(key))
+            self.invalidate(key)
+            with self.lock:
+                self.misses += 1
+            return False
+
+        entry.checked = time.time()
+        return True
+
+    def _discard(self, key):
+        entry = self.entries.pop(key, None)
+        self.paths.pop(key, None)
+        if entry is None:
+            return False
+        self.current_bytes -= len(entry.body)
+        return True
@@ -0,0 +1,324 @@
+"""Compressed storage of recorded responses.
+
+With a storage codec set (`hulk --codec=gzip`), responses are compressed as
+they are recorded. A compressed body starts with an 8 byte magic naming its
+codec, followed by the compressed stream:
+
+* `HULKGZ01` and a gzip stream
+* `HULKZS01` and a zstd frame, compressed with the dataset's dictionary
+  (`dataset.zdict`) if it has one. zstd needs the `zstandard` package.
+
+Anything else is a plain body, as hulk has always stored them, so plain and
+compressed responses can live side by side in a dataset and in its pack.
+`compact_dataset` converts an existing dataset in place. Only the body of a
+response is compressed; its envelope (see `hulk.envelope`) stays in front of
+the magic.
+"""
+import logging
+import os
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from hulk.blobs import forget_blob_store, get_blob_store, read_ref, \
+    resolve
+from hulk.envelope import split_envelope
+from hulk.pack import INDEX_FILENAME, PackedDataset, iter_loose_files, \
+    rewrite_pack
+
+
+logger = logging.getLogger()
+
+MAGIC_SIZE = 8
+DICTIONARY_FILENAME = 'dataset.zdict'
+DEFAULT_DICTIONARY_SIZE = 112640
+# bodies sampled when training a dictionary
+MAX_SAMPLES = 10000
+
+
+class GzipCodec(object):
+    name = 'gzip'
+    encoding = 'gzip'
+    magic = 'HULKGZ01'
+
+    def __init__(self, dictionary=None, level=6):
+        self.level = level
+
+    def compressor(self):
+        return zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def decompressor(self):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+
+class ZstdCodec(object):
+    name = 'zstd'
+    encoding = 'zstd'
+    magic = 'HULKZS01'
+
+    def __init__(self, dictionary=None, level=3):
+        if zstandard is None:
+            raise ValueError('The zstd codec needs the zstandard package')
+        self.level = level
+        self.dictionary = zstandard.ZstdCompressionDict(dictionary) \
+            if dictionary else None
+
+    # zstandard (de)compressors can't be shared between threads
+    def compressor(self):
+        if self.dictionary is None:
+            return zstandard.ZstdCompressor(level=self.level).compressobj()
+        return zstandard.ZstdCompressor(level=self.level,
+            dict_data=self.dictionary).compressobj()
+
+    def decompressor(self):
+        if self.dictionary is None:
+            return zstandard.ZstdDecompressor().decompressobj()
+        return zstandard.ZstdDecompressor(
+            dict_data=self.dictionary).decompressobj()
+
+
+CODECS = {
+    'gzip': GzipCodec,
+    'zstd': ZstdCodec,
+}
+
+MAGICS = dict((codec.magic, name) for name, codec in CODECS.items())
+
+# codec new recordings are stored with, or None to store them as they are
+storage_codec = None
+
+_codecs = {}
+_codecs_lock = threading.Lock()
+
+
+def set_storage_codec(name):
+    """Sets the codec new recordings are compressed with; `none` or None
+    stores them uncompressed.
+    """
+    global storage_codec
+    if name in (None, 'none'):
+        storage_codec = None
+        return
+    if name not in CODECS:
+        raise ValueError('Unknown codec "{}", use one of: none, {}'.format(
+            name, ', '.join(sorted(CODECS))))
+    if name == 'zstd' and zstandard is None:
+        raise ValueError('The zstd codec needs the zstandard package')
+    storage_codec = name
+
+
+def read_dictionary(folder):
+    try:
+        with open(os.path.join(folder, DICTIONARY_FILENAME), 'rb') as data:
+            return data.read()
+    except IOError:
+        return None
+
+
+def get_codec(name, folder):
+    """Returns the codec `name` for a dataset folder, with the dataset's
+    dictionary loaded. Codecs are set up once per process and then reused.
+    """
+    key = (name, folder)
+    try:
+        return _codecs[key]
+    except KeyError:
+        pass
+
+    with _codecs_lock:
+        if key not in _codecs:
+            dictionary = read_dictionary(folder) if name == 'zstd' else None
+            _codecs[key] = CODECS[name](dictionary)
+        return _codecs[key]
+
+
+def forget_codecs(folder):
+    """Drops the codecs set up for `folder`, eg after retraining its
+    dictionary.
+    """
+    with _codecs_lock:
+        for key in [key for key in _codecs if key[1] == folder]:
+            del _codecs[key]
+
+
+def recording_codec(folder):
+    """Returns the codec to store new recordings in `folder` with, or None.
+    """
+    if storage_codec is None:
+        return None
+    return get_codec(storage_codec, folder)
+
+
+def detect(body):
+    """Returns the name of the codec a stored body was compressed with, or
+    None for a plain body.
+    """
+    return MAGICS.get(str(body[:MAGIC_SIZE]))
+
+
+def iter_decoded(chunks, codec):
+    """Decompresses a stream of compressed chunks, without the magic.
+    """
+    decompressor = codec.decompressor()
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def encode(body, codec):
+    compressor = codec.compressor()
+    return ''.join([codec.magic, compressor.compress(body),
+        compressor.flush()])
+
+
+def decode(body, folder):
+    """Returns a stored body uncompressed, read from the dataset's blob store
+    if it's a reference to a blob (see `hulk.blobs`).
+    """
+    body = resolve(body, folder)
+    name = detect(body)
+    if name is None:
+        return str(body)
+    return ''.join(iter_decoded([buffer(body, MAGIC_SIZE)],
+        get_codec(name, folder)))
+
+
+def iter_bodies(folder):
+    """Yields every stored body in a dataset folder, loose, packed and in
+    its blob store, without its envelope. References to blobs are skipped,
+    the blobs are yielded once each instead.
+    """
+    for _, _, path in iter_loose_files(folder):
+        with open(path, 'rb') as loose:
+            body = split_envelope(loose.read())[1]
+        if read_ref(body) is None:
+            yield body
+
+    if os.path.exists(os.path.join(folder, INDEX_FILENAME)):
+        pack = PackedDataset(folder)
+        for _, _, body in pack.records():
+            body = split_envelope(body)[1]
+            if read_ref(body) is None:
+                yield str(body)
+        pack.close()
+
+    for _, path in get_blob_store(folder).blobs():
+        with open(path, 'rb') as blob:
+            yield blob.read()
+
+
+def train_dictionary(folder, size=DEFAULT_DICTIONARY_SIZE):
+    """Trains a zstd dictionary on (up to MAX_SAMPLES of) the bodies of a
+    dataset and returns it. Doesn't save it.
+    """
+    if zstandard is None:
+        raise ValueError('Training a dictionary needs the zstandard package')
+
+    samples = []
+    for body in iter_bodies(folder):
+        samples.append(decode(body, folder))
+        if len(samples) >= MAX_SAMPLES:
+            break
+
+    try:
+        return zstandard.train_dictionary(size, samples).as_bytes()
+    except zstandard.ZstdError as e:
+        raise ValueError('Couldn\'t train a dictionary on {} responses: '
+            '{}'.format(len(samples), e))
+
+
+def compact_dataset(folder, name='gzip', train=False,
+        dictionary_size=DEFAULT_DICTIONARY_SIZE):
+    """Re-stores every response in a dataset folder, loose and packed, with
+    the codec `name`, in place; `none` decompresses them all again. Bodies
+    that don't get any smaller are stored plain. With `train` (zstd only) a
+    new dictionary is trained first and every response is recompressed with
+    it.
+
+    Returns (responses rewritten, bytes before, bytes after).
+    """
+    if name == 'none':
+        name = None
+    if name is not None and name not in CODECS:
+        raise ValueError('Unknown codec "{}", use one of: none, {}'.format(
+            name, ', '.join(sorted(CODECS))))
+
+    # decode with the dictionary the bodies were compressed with
+    decoders = {}
+    for each in CODECS:
+        if each != 'zstd' or zstandard is not None:
+            decoders[each] = get_codec(each, folder)
+
+    if train:
+        if name != 'zstd':
+            raise ValueError('Only the zstd codec uses a dictionary')
+        dictionary = train_dictionary(folder, dictionary_size)
+        target = ZstdCodec(dictionary)
+    else:
+        target = get_codec(name, folder) if name else None
+
+    totals = {'rewritten': 0, 'before': 0, 'after': 0}
+
+    def convert(stored_response):
+        head, body = split_envelope(stored_response)
+        if read_ref(body) is not None:
+            # compacted with the blob store, below
+            return None
+        stored = detect(body)
+        totals['before'] += len(body)
+        if stored == name and not train:
+            totals['after'] += len(body)
+            return None
+
+        plain = str(body) if stored is None else ''.join(iter_decoded(
+            [buffer(body, MAGIC_SIZE)], decoders[stored]))
+        converted = plain
+        if target is not None:
+            compressed = encode(plain, target)
+            if len(compressed) < len(plain):
+                converted = compressed
+        totals['after'] += len(converted)
+        if len(converted) == len(body) and converted == str(body):
+            return None
+        totals['rewritten'] += 1
+        return head + converted
+
+    # blobs are named after their uncompressed body, so they keep their name
+    blob_paths = [path for _, path in get_blob_store(folder).blobs()]
+    for path in [path for _, _, path in iter_loose_files(folder)] + \
+            blob_paths:
+        with open(path, 'rb') as loose:
+            converted = convert(loose.read())
+        if converted is None:
+            continue
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as loose:
+            loose.write(converted)
+        os.rename(temp_path, path)
+
+    if os.path.exists(os.path.join(folder, INDEX_FILENAME)):
+        def transform(hostname, hashname, body):
+            converted = convert(body)
+            return body if converted is None else converted
+        rewrite_pack(folder, transform)
+
+    if train:
+        path = os.path.join(folder, DICTIONARY_FILENAME)
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as data:
+            data.write(dictionary)
+        os.rename(temp_path, path)
+    forget_codecs(folder)
+    forget_blob_store(folder)
+
+    logger.info('compacted {}: {} bytes -> {} bytes'.format(
+        folder, totals['before'], totals['after']))
+    return totals['rewritten'], totals['before'], totals['after']
@@ -0,0 +1,200 @@
+"""Stored response envelopes.
+
+Responses are stored with their status and headers ahead of the body:
+
+    "HULKENV1" | status (2 bytes) | header block length (4 bytes) |
+    header block, one "Name: value\r\n" per header | body
+
+The body is stored as it was received (and possibly compressed, see
+`hulk.codec`). The header block is only parsed when the headers are asked
+for, so replaying a response costs one small struct unpack until then.
+
+Stored responses without the magic are body-only recordings made by older
+versions of hulk. They still replay as a 200 with the request's mimetype, and
+`migrate_dataset` converts them.
+"""
+import json
+import logging
+import os
+import struct
+
+from hulk.pack import INDEX_FILENAME, iter_loose_files, rewrite_pack
+
+
+logger = logging.getLogger()
+
+MAGIC = 'HULKENV1'
+PREFIX = struct.Struct('>8sHI')
+
+# describe the original connection or transfer rather than the stored body,
+# so they aren't stored
+SKIPPED_HEADERS = frozenset([
+    'connection',
+    'content-encoding',
+    'content-length',
+    'keep-alive',
+    'proxy-authenticate',
+    'proxy-connection',
+    'te',
+    'trailer',
+    'transfer-encoding',
+    'upgrade',
+])
+
+
+class Envelope(object):
+    """The status and headers of a stored response. Its body starts at
+    `offset` in the stored bytes.
+    """
+
+    def __init__(self, status, block, offset):
+        self.status = status
+        self.block = block
+        self.offset = offset
+        self._headers = None
+
+    @property
+    def headers(self):
+        """The stored [(name, value)] headers, parsed on first use.
+        """
+        if self._headers is None:
+            self._headers = parse_headers(self.block)
+        return self._headers
+
+    def header(self, name):
+        """Returns the first value of a header, or None.
+        """
+        name = name.lower()
+        for each, value in self.headers:
+            if each.lower() == name:
+                return value
+        return None
+
+
+def storable_headers(headers):
+    """Filters [(name, value)] headers down to the ones worth replaying.
+    """
+    return [(name, value) for name, value in headers
+        if name.lower() not in SKIPPED_HEADERS]
+
+
+def response_headers(response):
+    """Returns the headers of a `requests` response as [(name, value)],
+    keeping repeated headers (eg Set-Cookie) apart.
+    """
+    raw = getattr(getattr(response, 'raw', None), 'headers', None)
+    if raw is not None and hasattr(raw, 'iteritems'):
+        return list(raw.iteritems())
+    return list(response.headers.items())
+
+
+def pack_head(status, headers):
+    """Builds the envelope that goes in front of a stored body.
+    """
+    block = ''.join(['{}: {}\r\n'.format(name, value)
+        for name, value in headers])
+    return PREFIX.pack(MAGIC, status, len(block)) + block
+
+
+def head_for(response):
+    """Builds the envelope for a `requests` response from an origin.
+    """
+    return pack_head(response.status_code,
+        storable_headers(response_headers(response)))
+
+
+def parse_headers(block):
+    headers = []
+    for line in block.split('\r\n'):
+        if line:
+            name, _, value = line.partition(': ')
+            headers.append((name, value))
+    return headers
+
+
+def read_envelope(stored):
+    """Returns the Envelope of a stored response (a string or a buffer), or
+    None if it's a body-only recording.
+    """
+    if len(stored) < PREFIX.size or str(stored[:len(MAGIC)]) != MAGIC:
+        return None
+    _, status, length = PREFIX.unpack_from(stored, 0)
+    offset = PREFIX.size + length
+    return Envelope(status, str(stored[PREFIX.size:offset]), offset)
+
+
+def read_envelope_file(stored):
+    """Same as `read_envelope` for an open file, which is left positioned at
+    the start of the body.
+    """
+    prefix = stored.read(PREFIX.size)
+    if len(prefix) < PREFIX.size or prefix[:len(MAGIC)] != MAGIC:
+        stored.seek(0)
+        return None
+    _, status, length = PREFIX.unpack(prefix)
+    return Envelope(status, stored.read(length), PREFIX.size + length)
+
+
+def split_envelope(stored):
+    """Splits a stored response into its envelope (empty for body-only
+    recordings) and its body.
+    """
+    envelope = read_envelope(stored)
+    if envelope is None:
+        return '', stored
+    return str(stored[:envelope.offset]), buffer(stored, envelope.offset)
+
+
+def guess_content_type(body):
+    """Guesses the content type of a body-only recording, or None.
+    """
+    start = body[:64].lstrip()
+    if start.startswith('<?xml'):
+        return 'application/xml'
+    if start[:15].lower() in ('<!doctype html>', '<html>') or \
+            start[:5].lower() == '<html':
+        return 'text/html'
+    if start[:1] in ('{', '['):
+        try:
+            json.loads(body)
+        except ValueError:
+            return None
+        return 'application/json'
+    return None
+
+
+def migrate_dataset(folder):
+    """Converts the body-only recordings in a dataset folder, loose and
+    packed, to envelopes in place: a 200 with the Content-Type guessed from
+    the body. Returns the number of responses converted.
+    """
+    from hulk.codec import decode
+
+    converted = [0]
+
+    def migrate(body):
+        if read_envelope(body) is not None:
+            return None
+        content_type = guess_content_type(decode(body, folder))
+        headers = [('Content-Type', content_type)] if content_type else []
+        converted[0] += 1
+        return pack_head(200, headers) + str(body)
+
+    for _, _, path in iter_loose_files(folder):
+        with open(path, 'rb') as loose:
+            migrated = migrate(loose.read())
+        if migrated is None:
+            continue
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'wb') as loose:
+            loose.write(migrated)
+        os.rename(temp_path, path)
+
+    if os.path.exists(os.path.join(folder, INDEX_FILENAME)):
+        def transform(hostname, hashname, body):
+            migrated = migrate(body)
+            return body if migrated is None else migrated
+        rewrite_pack(folder, transform)
+
+    logger.info('migrated {} responses in {}'.format(converted[0], folder))
+    return converted[0]
@@ -1,61 +1,411 @@
+import errno
 import logging
+import threading
 import time
 import os
 
 from urlparse import urlparse
+from hulk import keys
 from hulk.application import app
-from hulk.utils import create_dataset_folder, build_filename, serve_file, \
-    load_original, save_original, make_response, dataset_folder, record_file
+from hulk.blobs import get_blob_refs, get_blob_store, recording_blobs
+from hulk.cache import HotCache
+from hulk.index import get_index
+from hulk.layers import get_stack
+from hulk.locks import KeyLock
+from hulk.metrics import current_timing, disk_seconds, instrument, \
+    origin_seconds, registry
+from hulk.misses import MissCache, get_missing_log
+from hulk.pack import get_pack
+from hulk.rules import get_rules
+from hulk.singleflight import SingleFlight
+from hulk.codec import recording_codec
+from hulk.envelope import pack_head, response_headers, storable_headers
+from hulk.stream import RecordingStream, serve_stored
+from hulk.utils import apply_headers, create_dataset_folder, \
+    build_filename, stream_original, dataset_folder, record_file
 
 
 logger = logging.getLogger()
 
+DEFAULT_ORIGIN_WORKERS = 4
+
+# bounds the number of origin fetches in flight at once, so a burst of misses
+# can't starve the workers serving cache hits
+origin_slots = threading.BoundedSemaphore(DEFAULT_ORIGIN_WORKERS)
+
+# in-memory copies of recently served files
+hot_cache = HotCache()
+
+# concurrent misses for the same key share a single origin fetch
+origin_flights = SingleFlight()
+
+# recent misses, so polling a missing response doesn't look for it every time
+miss_cache = MissCache()
+
+
+def collect_cache_metrics():
+    stats = hot_cache.stats()
+    yield ('hulk_hot_cache_lookups_total', 'counter',
+        'Hot cache lookups by result',
+        [({'result': 'hit'}, stats['hits']),
+            ({'result': 'miss'}, stats['misses'])])
+    yield ('hulk_hot_cache_bytes', 'gauge', 'Bytes held in the hot cache',
+        [({}, stats['bytes'])])
+    yield ('hulk_hot_cache_entries', 'gauge', 'Responses held in the hot cache',
+        [({}, stats['entries'])])
+    yield ('hulk_hot_cache_evictions_total', 'counter',
+        'Responses evicted from the hot cache', [({}, stats['evictions'])])
+    yield ('hulk_miss_cache_hits_total', 'counter',
+        'Misses answered from the miss cache', [({}, miss_cache.hits)])
+    yield ('hulk_origin_fetches_coalesced_total', 'counter',
+        'Misses that waited on a fetch already in flight',
+        [({}, origin_flights.coalesced)])
+
+
+registry.add_collector(collect_cache_metrics)
+
+
+def set_origin_workers(count):
+    """Sets the maximum number of concurrent origin fetches.
+    """
+    global origin_slots
+    origin_slots = threading.BoundedSemaphore(count)
+
+
+def set_hot_cache(max_bytes, max_entries):
+    """Replaces the hot cache with an empty one of the given size.
+    """
+    global hot_cache
+    hot_cache = HotCache(max_bytes=max_bytes, max_entries=max_entries)
+
+
+def warm_dataset(dataset):
+    """Builds the in-memory index, the pack mapping, the merged parent
+    layers, the request-matching rules and the blob references of a dataset
+    up front, eg in `hulk --processes=N` before forking, so the server
+    processes share them rather than each building its own. Returns the
+    number of loose responses indexed.
+    """
+    folder = os.path.join(dataset_folder, dataset)
+    index = get_index(folder)
+    get_pack(folder)
+    get_stack(dataset_folder, dataset).merged_index()
+    get_rules(folder)
+    get_blob_refs(folder)
+    return len(index)
+
+
+def record_original(request, cache_key, file_path, full_query_name):
+    """Streams the original from the origin to the client, saving it to the
+    dataset as it goes.
+
+    Concurrent requests for the same key (see `origin_flights`), in this
+    process or another (see `hulk.locks`), wait for that recording to finish
+    and are then served the saved file.
+    """
+    dataset, hostname, hashname = cache_key
+    # the body outlives the request context, so don't touch `request` later
+    mimetype = request.mimetype
+    method = request.method
+
+    timing = current_timing()
+    flight, leader = origin_flights.begin(cache_key)
+    if not leader:
+        logging.info('Waiting on in-flight recording...')
+        timing.source = 'in_flight'
+        waited = time.time()
+        flight.wait()
+        timing.add('wait', time.time() - waited)
+        return serve_saved(request, cache_key, file_path)
+
+    folder = os.path.join(dataset_folder, dataset)
+    index = get_index(folder)
+
+    def on_complete(error=None):
+        slots.release()
+        timer_done = int(time.time() * 1000)
+        logger.info('load time: {}ms'.format((timer_done - timer_now)))
+        origin_seconds.observe((timer_done - timer_now) / 1000.0, hostname)
+        if error is None:
+            index.add(hostname, hashname)
+            refs = get_blob_refs(folder)
+            if stream.blob_digest is not None:
+                refs.add(hostname, hashname, stream.blob_digest,
+                    upstream.status_code, headers)
+            else:
+                refs.discard(hostname, hashname)
+            # create a record of this file for later
+            record_file(dataset, hashname, mimetype, ''.join(
+                [hostname, full_query_name]), digest=stream.blob_digest,
+                status=upstream.status_code, headers=headers, method=method)
+        lock.release()
+        origin_flights.finish(cache_key, flight, error=error)
+
+    try:
+        # a flight for this key may have finished since we checked for the file
+        if (hostname, hashname) in index:
+            origin_flights.finish(cache_key, flight)
+            return serve_saved(request, cache_key, file_path)
+
+        # make sure the hostname folder exists
+        if not index.has_host(hostname):
+            create_dataset_folder(dataset_folder,
+                '/'.join([dataset, hostname]))
+            index.add_host(hostname)
+
+        # another process may be recording it, or have just recorded it
+        lock = KeyLock(folder, hostname, hashname)
+        if not lock.acquire(blocking=False):
+            logging.info('Waiting on a recording in another process...')
+            timing.source = 'in_flight'
+            waited = time.time()
+            lock.acquire()
+            timing.add('wait', time.time() - waited)
+        if os.path.exists(file_path):
+            lock.release()
+            index.add(hostname, hashname)
+            origin_flights.finish(cache_key, flight)
+            return serve_saved(request, cache_key, file_path)
+
+        timing.source = 'origin'
+        timer_now = int(time.time() * 1000)
+        slots = origin_slots
+        slots.acquire()
+        upstream = None
+        try:
+            upstream = stream_original(request)
+            # the body is still to come, so this is the time to headers
+            timing.add('origin', time.time() - timer_now / 1000.0)
+            headers = storable_headers(response_headers(upstream))
+            stream = RecordingStream(upstream, file_path, on_complete,
+                codec=recording_codec(folder),
+                head=pack_head(upstream.status_code, headers),
+                blobs=recording_blobs(folder))
+        except Exception:
+            slots.release()
+            if upstream is not None:
+                upstream.close()
+            lock.release()
+            raise
+    except Exception as e:
+        origin_flights.finish(cache_key, flight, error=e)
+        raise
+
+    # TODO: maintain line-in-file <hash> <original-url>
+    # TODO: prompt when overwriting files?
+    response = app.response_class(stream, status=upstream.status_code)
+    apply_headers(response, request, headers)
+    return response
+
+
+def make_etag(hashname, version):
+    """Builds an etag from the stored hash and the version (eg mtime) of the
+    copy being served.
+    """
+    return '{}-{:x}'.format(hashname, int(version * 1000))
+
+
+def read_disk(started):
+    elapsed = time.time() - started
+    disk_seconds.observe(elapsed)
+    current_timing().add('disk', elapsed)
+
+
+def serve_saved(request, cache_key, file_path):
+    """Serves a saved file, through the hot cache if it's small enough or
+    streamed from disk otherwise.
+    """
+    dataset, _, hashname = cache_key
+    folder = os.path.join(dataset_folder, dataset)
+    started = time.time()
+    cached = hot_cache.load(cache_key, file_path)
+    if cached is not None:
+        read_disk(started)
+        return serve_stored(request, cached.body,
+            make_etag(hashname, cached.mtime), folder, cached.headers)
+
+    logging.info('Streaming large file...')
+    saved = open(file_path, 'rb')
+    stat = os.fstat(saved.fileno())
+    read_disk(started)
+    return serve_stored(request, saved, make_etag(hashname, stat.st_mtime),
+        folder)
+
+
+def answer_miss(request, cache_key, body):
+    """Counts a miss in the dataset's missing-request log (see
+    `hulk.misses`) and answers it.
+    """
+    dataset, hostname, hashname = cache_key
+    current_timing().source = 'miss'
+    get_missing_log(os.path.join(dataset_folder, dataset)).add(hostname,
+        hashname, request.method, request.url, request.mimetype,
+        request.form.items(multi=True), body,
+        keys.key_engine.extras(None, request.headers)[1] or ())
+    return "nothing here", 404
+
+
+def serve_packed(request, pack, hashname, packed):
+    """Serves a response from a dataset's pack.
+    """
+    current_timing().source = 'pack'
+    etag = make_etag(hashname, pack.version)
+    if len(packed) <= hot_cache.max_entry_bytes:
+        packed = str(packed)
+    return serve_stored(request, packed, etag, pack.folder)
+
+
+def serve_blob(request, folder, hashname, ref):
+    """Serves a deduplicated response straight from its blob, with the status
+    and headers from its manifest record (see `hulk.blobs.BlobRefs`), or
+    returns None if the blob is gone.
+    """
+    digest, status, headers = ref
+    store = get_blob_store(folder)
+    started = time.time()
+    try:
+        blob = store.get(digest)
+        if blob is None:
+            blob = store.open(digest)
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    read_disk(started)
+    current_timing().source = 'blob'
+    # blobs never change, so the digest identifies the body
+    return serve_stored(request, blob, '{}-{}'.format(hashname, digest[:16]),
+        folder, headers, status)
+
+
+def serve_layer(request, layer, hostname, hashname):
+    """Serves a response from a parent layer of the dataset (see
+    `hulk.layers`), or returns None if it turned out to be gone.
+    """
+    if layer.packed:
+        pack = get_pack(layer.folder)
+        packed = pack.get(hostname, hashname) if pack is not None else None
+        if packed is None:
+            return None
+        return serve_packed(request, pack, hashname, packed)
+
+    cache_key = (layer.dataset, hostname, hashname)
+    cached = hot_cache.get(cache_key)
+    if cached is not None:
+        current_timing().source = 'hot_cache'
+        return serve_stored(request, cached.body,
+            make_etag(hashname, cached.mtime), layer.folder, cached.headers)
+
+    current_timing().source = 'disk'
+    try:
+        return serve_saved(request, cache_key,
+            os.path.join(layer.folder, hostname, hashname))
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        logging.info('Layer file was removed...')
+        get_index(layer.folder).discard(hostname, hashname)
+        return None
+
 
 def handle_request(request, path):
-    """Handles the incoming request.
+    """Handles the incoming request, and records its metrics (see
+    `hulk.metrics`).
+    """
+    response = app.make_response(answer_request(request, path))
+    return instrument(response, urlparse(request.url).netloc,
+        app.config.get('server_timing'))
+
+
+def answer_request(request, path):
+    """Answers the incoming request from the dataset or the origin.
     """
     url = urlparse(request.url)
     original = request.url
     hostname = url.netloc
     dataset = app.config.get('dataset')
-    logging.debug('URL requested {}'.format(url))
+    logging.debug('URL requested %s', original)
     # fix the path for consistency
     path = '/' + path
 
-    # make sure the hostname folder exists
-    create_dataset_folder(dataset_folder, '/'.join([dataset, hostname]))
     # create file name for http verbs
-    hashname, full_query_name = build_filename(path, request.values)
-    # check for file
+    timing = current_timing()
+    folder = os.path.join(dataset_folder, dataset)
+    body = request.get_data(cache=True) \
+        if keys.is_json(request.mimetype) else None
+    rules = get_rules(folder)
+    hashname, full_query_name = build_filename(path, request.values,
+        body=body, headers=request.headers, hostname=hostname, rules=rules)
+    timing.add('key', time.time() - timing.started)
+
+    # warm fixtures are served from memory without touching the disk
+    cache_key = (dataset, hostname, hashname)
+    load_origin = app.config.get('load_origin')
+    index = get_index(folder)
+    stack = get_stack(dataset_folder, dataset)
+    # taken before looking, so a response saved meanwhile isn't missed later
+    version = (index.version, stack.versions())
+    if not load_origin and miss_cache.get(cache_key, version):
+        logging.info('Serving from miss cache...')
+        return answer_miss(request, cache_key, body)
+
+    cached = hot_cache.get(cache_key)
+    if cached is not None:
+        logging.info('Serving from hot cache...')
+        timing.source = 'hot_cache'
+        return serve_stored(request, cached.body,
+            make_etag(hashname, cached.mtime), folder, cached.headers)
+
+    # packed datasets are mmap'd once, so lookups don't touch the disk either
+    pack = get_pack(folder)
+    if pack is not None:
+        packed = pack.get(hostname, hashname)
+        if packed is not None:
+            logging.info('Serving from pack...')
+            return serve_packed(request, pack, hashname, packed)
+
+    # check for file, in the index rather than on disk
     file_path = os.path.join(dataset_folder, dataset, hostname, hashname)
-    logger.info('File path: {}'.format(file_path))
+    logger.debug('File path: %s', file_path)
 
     # load file
-    if os.path.exists(file_path):
+    if (hostname, hashname) in index:
+        ref = get_blob_refs(folder).get(hostname, hashname)
+        if ref is not None:
+            logging.info('Serving from blob...')
+            response = serve_blob(request, folder, hashname, ref)
+            if response is not None:
+                return response
         logging.info('File exists...')
-        return serve_file(request, file_path)
-    else:
-        logging.info('File doesn\'t exist...')
-
-        if app.config.get('load_origin'):
-            logging.info('load_origin is set, loading original...')
-            timer_now = int(time.time() * 1000)
-            content = load_original(request)
-            timer_done = int(time.time() * 1000)
-            logger.info('load time: {}ms'.format((timer_done - timer_now)))
-            # TODO: maintain line-in-file <hash> <original-url>
-            # TODO: prompt when overwriting files?
-            save_original(file_path, content)
+        timing.source = 'disk'
+        try:
+            return serve_saved(request, cache_key, file_path)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            logging.info('File was removed...')
+            index.discard(hostname, hashname)
 
-            # create a record of this file for later
-            record_file(dataset, hashname, request.mimetype, ''.join(
-                [hostname, full_query_name]))
+    logging.info('File doesn\'t exist...')
 
-            response = make_response(content)
-            response.headers["Content-type"] = request.mimetype
+    # responses the dataset doesn't override come from its parent layers
+    layer = stack.locate(hostname, hashname)
+    if layer is not None:
+        logging.info('Serving from layer %s...', layer.dataset)
+        response = serve_layer(request, layer, hostname, hashname)
+        if response is not None:
             return response
-        else:
-            logging.info('load_origin NOT set, ignoring...')
-            # TODO: write to 'missing.txt'
 
-    return "nothing here", 404
\ No newline at end of file
+    if load_origin:
+        logging.info('load_origin is set, loading original...')
+        if rules is not None:
+            # the manifest keeps the request as it was made, the rules only
+            # shape the key it's saved under
+            full_query_name = build_filename(path, request.values,
+                body=body, headers=request.headers)[1]
+        return record_original(request, cache_key, file_path,
+            full_query_name)
+
+    logging.info('load_origin NOT set, ignoring...')
+    miss_cache.add(cache_key, version)
+    return answer_miss(request, cache_key, body)
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""Shared, read-only dataset images for `hulk.monkey`.
+
+An image is a pack (see `hulk.pack`) of everything in a dataset, loose files
+and pack alike, written once to a folder outside the dataset and mapped
+read-only by every process that uses the dataset. Test runners that fork
+workers (nose's multiprocess plugin, pytest-xdist) then share one copy of the
+fixtures in the page cache, and a lookup is a bisection over the mapped index
+instead of an `open` and a `read` per request.
+
+Images are named after the dataset folder and a signature of its contents
+(the mtimes of the dataset and hostname folders, which change whenever a
+response is added, replaced or removed, and of its pack). The first process
+to need a missing image builds it under an exclusive lock; the others wait
+for it and map the same files. Images for older signatures are removed when a
+new one is built.
+"""
+import errno
+import logging
+import md5
+import os
+import shutil
+import tempfile
+import threading
+from fcntl import flock, LOCK_EX, LOCK_UN
+
+from hulk.pack import INDEX_FILENAME, PACK_FILENAME, PACK_MAGIC, \
+    RECORD_HEADER, PackedDataset, iter_loose_files, pack_key, write_index
+
+
+logger = logging.getLogger()
+
+image_folder = os.environ.get(
+    "HULK_IMAGE_DIR",
+    os.path.join(tempfile.gettempdir(), 'hulk-images')
+)
+
+
+def image_name(folder):
+    return md5.new(os.path.abspath(folder)).hexdigest()
+
+
+def dataset_signature(folder):
+    """Returns a signature that changes whenever the responses in a dataset
+    folder do, or None if there's no such folder.
+    """
+    try:
+        names = sorted(os.listdir(folder))
+        stats = [('', os.stat(folder).st_mtime)]
+    except OSError as e:
+        if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+            raise
+        return None
+
+    for name in names:
+        stats.append((name, os.stat(os.path.join(folder, name)).st_mtime))
+    return md5.new(repr(stats)).hexdigest()[:16]
+
+
+def write_image(folder, path):
+    """Writes a pack of every response in a dataset folder to the folder
+    `path`. Packed responses take precedence over loose copies, as they do
+    when serving. Returns the number of responses written.
+    """
+    entries = {}
+    with open(os.path.join(path, PACK_FILENAME), 'wb') as data:
+        data.write(PACK_MAGIC)
+
+        def write(hostname, hashname, body):
+            data.write(RECORD_HEADER.pack(
+                len(hostname), len(hashname), len(body)))
+            data.write(hostname)
+            data.write(hashname)
+            entries[pack_key(hostname, hashname)] = (data.tell(), len(body))
+            data.write(body)
+
+        if os.path.exists(os.path.join(folder, INDEX_FILENAME)):
+            pack = PackedDataset(folder)
+            for hostname, hashname, body in pack.records():
+                write(hostname, hashname, body)
+            pack.close()
+
+        for hostname, hashname, loose_path in iter_loose_files(folder):
+            if pack_key(hostname, hashname) in entries:
+                continue
+            with open(loose_path, 'rb') as loose:
+                write(hostname, hashname, loose.read())
+
+    write_index(path, entries)
+    return len(entries)
+
+
+def build_image(folder, base_folder=None):
+    """Returns the folder of the image of a dataset folder, building it
+    first if it doesn't exist yet. Returns None if there's no dataset.
+    """
+    base_folder = base_folder or image_folder
+    signature = dataset_signature(folder)
+    if signature is None:
+        return None
+
+    name = image_name(folder)
+    path = os.path.join(base_folder, '{}-{}'.format(name, signature))
+    if os.path.exists(os.path.join(path, INDEX_FILENAME)):
+        return path
+
+    try:
+        os.makedirs(base_folder)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    with open(os.path.join(base_folder, name + '.lock'), 'w') as lock:
+        flock(lock, LOCK_EX)
+        try:
+            # built by another process while we waited for the lock
+            if os.path.exists(os.path.join(path, INDEX_FILENAME)):
+                return path
+
+            temp_path = tempfile.mkdtemp(dir=base_folder, suffix='.tmp')
+            count = write_image(folder, temp_path)
+            os.rename(temp_path, path)
+            logger.info('built an image of {} responses in {} for {}'.format(
+                count, path, folder))
+
+            for stale in os.listdir(base_folder):
+                if stale.startswith(name + '-') and \
+                        stale != os.path.basename(path):
+                    shutil.rmtree(os.path.join(base_folder, stale), True)
+        finally:
+            flock(lock, LOCK_UN)
+    return path
+
+
+_images = {}
+_images_lock = threading.Lock()
+
+
+def get_image(folder):
+    """Returns a PackedDataset over the image of a dataset folder, or None if
+    there's no such dataset. Images are checked, built if needed and mapped
+    once per process and then reused.
+    """
+    try:
+        return _images[folder]
+    except KeyError:
+        pass
+
+    with _images_lock:
+        if folder not in _images:
+            path = build_image(folder)
+            _images[folder] = PackedDataset(path) if path else None
+        return _images[folder]
+
+
+def forget_image(folder):
+    """Drops the mapped image for `folder`, so its signature is checked (and
+    the image rebuilt if it changed) on next use.
+    """
+    with _images_lock:
+        image = _images.pop(folder, None)
+    if image is not None:
+        image.close()
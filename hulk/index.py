@@ -0,0 +1,160 @@
+"""In-memory index of the loose files in a dataset.
+
+The index is a set of hashes per hostname, built with one scan of the dataset
+folder the first time the dataset is used. Hit and miss checks are then
+answered from memory instead of with an `os.path.exists` per request, and new
+recordings are added to it as they are saved.
+
+Every change to the index gets it a new `version`, so anything derived from
+it (eg remembered misses, see `hulk.misses`) can tell when it's out of date.
+
+Recordings made by other processes (eg `hulk record` next to a running
+`hulk`) are picked up by re-listing a hostname's folder on a miss, at most
+once every `refresh_after` seconds.
+"""
+import errno
+import itertools
+import logging
+import os
+import threading
+import time
+
+from hulk.pack import iter_loose_files
+
+
+logger = logging.getLogger()
+
+# how long (seconds) a miss is trusted before the hostname folder is re-listed
+DEFAULT_REFRESH_AFTER = 5.0
+
+# index versions are unique across indexes, so a rebuilt index never reuses one
+_versions = itertools.count(1)
+
+
+class DatasetIndex(object):
+    """The (hostname, hash) pairs of the loose files in a dataset folder.
+    """
+
+    def __init__(self, folder, refresh_after=DEFAULT_REFRESH_AFTER):
+        self.folder = folder
+        self.refresh_after = refresh_after
+        self.hosts = {}
+        self.checked = {}
+        self.version = next(_versions)
+        self.lock = threading.Lock()
+        self.scan()
+
+    def __len__(self):
+        return sum(len(hashes) for hashes in self.hosts.values())
+
+    def __contains__(self, key):
+        hostname, hashname = key
+        hashes = self.hosts.get(hostname)
+        if hashes is not None and hashname in hashes:
+            return True
+
+        if self.refresh_after is not None and \
+                time.time() - self.checked.get(hostname, self.built) > \
+                self.refresh_after:
+            self.refresh(hostname)
+            return hashname in self.hosts.get(hostname, ())
+        return False
+
+    def keys(self):
+        """Returns a snapshot of the indexed (hostname, hash) pairs.
+        """
+        with self.lock:
+            return [(hostname, hashname)
+                for hostname, hashes in self.hosts.items()
+                for hashname in hashes]
+
+    def has_host(self, hostname):
+        """Whether the hostname has a folder in the dataset.
+        """
+        return hostname in self.hosts
+
+    def scan(self):
+        """(Re)builds the whole index from the dataset folder.
+        """
+        hosts = {}
+        if os.path.isdir(self.folder):
+            for hostname, hashname, _ in iter_loose_files(self.folder):
+                hosts.setdefault(hostname, set()).add(hashname)
+            # hostname folders that are still empty
+            for hostname in os.listdir(self.folder):
+                if not hostname.startswith('.') and \
+                        os.path.isdir(os.path.join(self.folder, hostname)):
+                    hosts.setdefault(hostname, set())
+
+        with self.lock:
+            self.hosts = hosts
+            self.checked = {}
+            self.built = time.time()
+            self.version = next(_versions)
+        logger.debug('indexed {} responses in {}'.format(
+            len(self), self.folder))
+
+    def refresh(self, hostname):
+        """Re-lists one hostname folder, for recordings made elsewhere.
+        """
+        try:
+            names = os.listdir(os.path.join(self.folder, hostname))
+        except OSError as e:
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            names = None
+
+        with self.lock:
+            self.checked[hostname] = time.time()
+            if names is None:
+                return
+            hashes = set(name for name in names if not name.endswith('.tmp'))
+            known = self.hosts.get(hostname, set())
+            if not hashes <= known:
+                self.version = next(_versions)
+            self.hosts[hostname] = hashes | known
+
+    def add(self, hostname, hashname):
+        """Adds a response that was just saved.
+        """
+        with self.lock:
+            self.hosts.setdefault(hostname, set()).add(hashname)
+            self.version = next(_versions)
+
+    def add_host(self, hostname):
+        """Records that the hostname folder now exists.
+        """
+        with self.lock:
+            self.hosts.setdefault(hostname, set())
+
+    def discard(self, hostname, hashname):
+        """Removes a response whose file turned out to be gone.
+        """
+        with self.lock:
+            self.hosts.get(hostname, set()).discard(hashname)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(folder):
+    """Returns the DatasetIndex for a dataset folder, scanning it the first
+    time it is asked for.
+    """
+    try:
+        return _indexes[folder]
+    except KeyError:
+        pass
+
+    with _indexes_lock:
+        if folder not in _indexes:
+            _indexes[folder] = DatasetIndex(folder)
+        return _indexes[folder]
+
+
+def forget_index(folder):
+    """Drops the index for `folder`, so it is scanned again on next use.
+    """
+    with _indexes_lock:
+        _indexes.pop(folder, None)
@@ -0,0 +1,259 @@
+"""Cache keys for recorded responses.
+
+A response is saved under the hash of a canonical string built from the
+request path and params and, optionally, its JSON body and a few selected
+headers:
+
+    /items?a=1&a=2&b=3#json={"x":1}#headers=accept=text%2Fhtml
+
+Params are sorted by name, repeated params keep all their values in the order
+they were given, and params whose value is None are dropped. For a request
+with single-valued params and nothing else, the string and its md5 are exactly
+what hulk has always built, so existing datasets keep resolving with the
+default `md5` hash.
+
+The key engine is configured from the environment, so the proxy and the
+patched `requests` agree on the keys:
+
+* `HULK_KEY_HASH`: `md5` (default) or `xxh64`, which needs `xxhash`
+* `HULK_KEY_HEADERS`: comma separated header names to include in the key
+* `HULK_KEY_JSON_BODY`: set to include JSON request bodies in the key
+
+A dataset has to be replayed with the same settings it was recorded with.
+Its request-matching rules (see `hulk.rules`) are applied to the request
+before the key is built.
+"""
+import hashlib
+import json
+import logging
+import os
+import urllib
+from operator import itemgetter
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+logger = logging.getLogger()
+
+DEFAULT_HASH = 'md5'
+# keys remembered per engine; the memo is simply emptied when it fills up
+DEFAULT_MEMO_SIZE = 10000
+
+# quoted param names and values, see `quote`
+_quoted = {}
+
+
+def md5_hex(data):
+    return hashlib.md5(data).hexdigest()
+
+
+def xxh64_hex(data):
+    return xxhash.xxh64(data).hexdigest()
+
+
+HASHES = {
+    'md5': md5_hex,
+    'xxh64': xxh64_hex,
+}
+
+
+def to_str(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def iter_params(vals):
+    """Yields (name, value) pairs from a dict, a werkzeug MultiDict or a list
+    of pairs, with list values expanded into one pair per value.
+    """
+    if hasattr(vals, 'iterlists'):
+        items = vals.iterlists()
+    elif isinstance(vals, (list, tuple)):
+        items = vals
+    else:
+        items = vals.iteritems()
+
+    for name, value in items:
+        if isinstance(value, (list, tuple)):
+            for each in value:
+                if each is not None:
+                    yield name, each
+        elif value is not None:
+            yield name, value
+
+
+def quote(value):
+    """Same as `urllib.quote_plus(to_str(value))`, remembering the result
+    since the same names and values turn up over and over.
+    """
+    key = (value.__class__, value)
+    try:
+        return _quoted[key]
+    except KeyError:
+        pass
+    except TypeError:   # unhashable
+        return urllib.quote_plus(to_str(value))
+
+    quoted = urllib.quote_plus(to_str(value))
+    if len(_quoted) >= DEFAULT_MEMO_SIZE:
+        _quoted.clear()
+    _quoted[key] = quoted
+    return quoted
+
+
+def canonical_query(vals):
+    """Urlencodes the params sorted by name, the same as `urllib.urlencode`.
+    The sort is stable, so repeated params keep the order of their values.
+    """
+    pairs = sorted(((to_str(name), value)
+        for name, value in iter_params(vals)), key=itemgetter(0))
+    return '&'.join([quote(name) + '=' + quote(value)
+        for name, value in pairs])
+
+
+def is_json(content_type):
+    """Whether a request's body counts as JSON for its key: the same test
+    as Flask's `request.is_json`, on a content type that may have params.
+    """
+    mimetype = (content_type or '').split(';')[0].strip().lower()
+    return mimetype == 'application/json' or (
+        mimetype.startswith('application/') and mimetype.endswith('+json'))
+
+
+def canonical_json(body):
+    """Re-serializes a JSON body with sorted keys and no whitespace, or
+    returns None if it isn't JSON.
+    """
+    try:
+        parsed = json.loads(body)
+    except (TypeError, ValueError):
+        return None
+    return json.dumps(parsed, sort_keys=True, separators=(',', ':'))
+
+
+def freeze(vals):
+    """Returns a hashable copy of the params for the memo, insensitive to
+    the order of the names but not of a repeated param's values, the same as
+    `canonical_query`. Value types are kept, since eg `True` and `1` encode
+    differently.
+    """
+    if not vals:
+        return None
+    if hasattr(vals, 'iterlists'):
+        return frozenset((name, tuple((value.__class__, value)
+            for value in values)) for name, values in vals.iterlists())
+    items = vals if isinstance(vals, (list, tuple)) else vals.iteritems()
+    return tuple(sorted(((name, value.__class__,
+        tuple(value) if isinstance(value, list) else value)
+        for name, value in items), key=itemgetter(0)))
+
+
+class KeyEngine(object):
+    """Builds (hash, canonical string) keys for requests, remembering the
+    keys it has already built.
+
+    :param hash_name: `md5`, or `xxh64` for a faster non-cryptographic hash.
+    :param headers: names of the request headers to include in the key.
+    :param json_body: include JSON request bodies in the key.
+    """
+
+    def __init__(self, hash_name=DEFAULT_HASH, headers=(), json_body=False,
+            memo_size=DEFAULT_MEMO_SIZE):
+        if hash_name not in HASHES:
+            raise ValueError('Unknown key hash "{}", use one of: {}'.format(
+                hash_name, ', '.join(sorted(HASHES))))
+        if hash_name == 'xxh64' and xxhash is None:
+            raise ValueError('The xxh64 key hash needs the xxhash package')
+
+        self.hash_name = hash_name
+        self.hash = HASHES[hash_name]
+        self.headers = tuple(name.strip().lower() for name in headers)
+        self.json_body = json_body
+        self.memo_size = memo_size
+        self.memo = {}
+
+    def extras(self, body, headers):
+        """Returns the canonical JSON body and selected headers that go into
+        the key, if the engine uses them.
+        """
+        body_part = header_part = None
+        if self.json_body and body:
+            body_part = canonical_json(body)
+        if self.headers and headers:
+            if isinstance(headers, dict):   # case-sensitive, unlike Headers
+                headers = dict((name.lower(), value)
+                    for name, value in headers.iteritems())
+            header_part = tuple((name, to_str(headers.get(name)))
+                for name in self.headers if headers.get(name) is not None)
+        return body_part, header_part
+
+    def key(self, path, vals=None, body=None, headers=None):
+        """Returns the (hash, canonical string) key for a request.
+        """
+        extras = self.extras(body, headers)
+        try:
+            memo_key = (path, freeze(vals), extras)
+            found = self.memo.get(memo_key)
+        except TypeError:   # unhashable values, eg nested dicts
+            memo_key = found = None
+        if found is not None:
+            return found
+
+        found = self.build(path, vals, extras)
+        if memo_key is not None:
+            if len(self.memo) >= self.memo_size:
+                self.memo.clear()
+            self.memo[memo_key] = found
+        return found
+
+    def build(self, path, vals, extras):
+        parts = [to_str(path)]
+        query = canonical_query(vals) if vals else ''
+        if query:
+            parts.append('?')
+            parts.append(query)
+
+        body_part, header_part = extras
+        if body_part is not None:
+            parts.append('#json=')
+            parts.append(body_part)
+        if header_part:
+            parts.append('#headers=')
+            parts.append(urllib.urlencode(header_part))
+
+        name_to_hash = ''.join(parts)
+        hashed = self.hash(name_to_hash)
+        logger.debug('cache key for %s: %s', name_to_hash, hashed)
+        return hashed, name_to_hash
+
+
+def engine_from_environment(environ=os.environ):
+    headers = [name for name in environ.get('HULK_KEY_HEADERS', '').split(',')
+        if name.strip()]
+    return KeyEngine(hash_name=environ.get('HULK_KEY_HASH', DEFAULT_HASH),
+        headers=headers, json_body=bool(environ.get('HULK_KEY_JSON_BODY')))
+
+
+# shared by the proxy, the recorder and the patched requests
+key_engine = engine_from_environment()
+
+
+def set_key_engine(engine):
+    """Replaces the engine used by `build_filename`.
+    """
+    global key_engine
+    key_engine = engine
+
+
+def build_filename(path, vals, body=None, headers=None, hostname=None,
+        rules=None):
+    """Returns the (hash, canonical string) key a response is saved under,
+    after applying the dataset's `rules` (see `hulk.rules`) for `hostname`.
+    """
+    if rules is not None:
+        path, vals, headers = rules.apply(hostname, path, vals, headers)
+    return key_engine.key(path, vals, body, headers)
@@ -0,0 +1,162 @@
+"""Layered datasets.
+
+A dataset can declare parent layers in a `hulk.json` in its folder:
+
+    {"parents": ["team-search"]}
+
+Parents can have parents of their own (eg my-ticket-1234 -> team-search ->
+default). Responses a dataset doesn't have itself are looked up in its
+parents, nearest first, so a variant only has to hold the responses that
+differ. New recordings are always saved to the top layer; parents are never
+written to through a child.
+
+The parent layers of a `DatasetStack` are searched through one merged
+in-memory index of every response in them, packed or loose, the nearest
+layer winning. It is built the first time it is needed and rebuilt when the
+index or pack of a parent changes, eg when a recording made by another
+process is picked up.
+"""
+import collections
+import json
+import logging
+import os
+import threading
+
+from hulk.index import get_index
+from hulk.pack import get_pack, pack_key
+
+
+logger = logging.getLogger()
+
+LAYERS_FILENAME = 'hulk.json'
+
+# where a response was found: the layer's dataset name and folder, and
+# whether it is in the layer's pack rather than a loose file
+Layer = collections.namedtuple('Layer', ['dataset', 'folder', 'packed'])
+
+
+def read_parents(folder):
+    """Returns the names of the parent layers a dataset folder declares.
+    """
+    try:
+        with open(os.path.join(folder, LAYERS_FILENAME)) as config:
+            content = config.read()
+    except IOError:
+        return []
+    return list(json.loads(content).get('parents') or []) \
+        if content.strip() else []
+
+
+def resolve_layers(base_folder, dataset):
+    """Returns the (dataset, folder) of every layer of a dataset, the dataset
+    itself first and then its parents, nearest first. Parents shared by
+    several layers are only searched once, at their nearest position.
+    """
+    layers = []
+    seen = set()
+
+    def visit(name, path):
+        if name in path:
+            raise ValueError('dataset layers loop: {}'.format(
+                ' -> '.join(path + [name])))
+        if name in seen:
+            return
+        folder = os.path.join(base_folder, name)
+        if path and not os.path.isdir(folder):
+            logger.warning('skipping missing parent layer {} of {}'.format(
+                name, path[-1]))
+            return
+        seen.add(name)
+        layers.append((name, folder))
+        for parent in read_parents(folder):
+            visit(parent, path + [name])
+
+    visit(dataset, [])
+    return layers
+
+
+class DatasetStack(object):
+    """A dataset and its parent layers.
+    """
+
+    def __init__(self, base_folder, dataset):
+        self.layers = resolve_layers(base_folder, dataset)
+        self.parents = self.layers[1:]
+        self.merged = {}
+        self.merged_versions = ()
+        self.lock = threading.Lock()
+
+    def versions(self):
+        """Changes whenever a response is added to a parent layer.
+        """
+        versions = []
+        for _, folder in self.parents:
+            pack = get_pack(folder)
+            versions.append((get_index(folder).version,
+                pack.version if pack is not None else None))
+        return tuple(versions)
+
+    def merged_index(self):
+        versions = self.versions()
+        if versions == self.merged_versions:
+            return self.merged
+
+        with self.lock:
+            if versions != self.merged_versions:
+                merged = {}
+                # farthest first, so nearer layers overwrite
+                for dataset, folder in reversed(self.parents):
+                    for hostname, hashname in get_index(folder).keys():
+                        merged[pack_key(hostname, hashname)] = Layer(
+                            dataset, folder, False)
+                    # a layer's pack is searched before its loose files
+                    pack = get_pack(folder)
+                    if pack is not None:
+                        for key, _, _ in pack.entries():
+                            merged[key] = Layer(dataset, folder, True)
+                self.merged = merged
+                self.merged_versions = versions
+            return self.merged
+
+    def locate(self, hostname, hashname):
+        """Returns the Layer of the nearest parent holding a response, or
+        None.
+        """
+        if not self.parents:
+            return None
+
+        key = pack_key(hostname, hashname)
+        found = self.merged_index().get(key)
+        if found is None:
+            # lets the parents' indexes pick up recordings made elsewhere
+            for _, folder in self.parents:
+                if (hostname, hashname) in get_index(folder):
+                    return self.merged_index().get(key)
+        return found
+
+
+_stacks = {}
+_stacks_lock = threading.Lock()
+
+
+def get_stack(base_folder, dataset):
+    """Returns the DatasetStack of a dataset, reading its layers the first
+    time it is asked for.
+    """
+    key = (base_folder, dataset)
+    try:
+        return _stacks[key]
+    except KeyError:
+        pass
+
+    with _stacks_lock:
+        if key not in _stacks:
+            _stacks[key] = DatasetStack(base_folder, dataset)
+        return _stacks[key]
+
+
+def forget_stack(base_folder, dataset):
+    """Drops the stack of a dataset, eg after changing its `hulk.json`.
+    """
+    with _stacks_lock:
+        _stacks.pop((base_folder, dataset), None)
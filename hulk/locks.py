@@ -0,0 +1,73 @@
+"""Locks on recording a key, held across processes.
+
+`origin_flights` (see `hulk.handler`) keeps the threads of one process from
+fetching the same key twice. The workers of `hulk --processes=N` and any
+`hulk record` run next to them need the same across processes: a `KeyLock`
+is an flock on a file in the dataset's `.locks` folder, which the holder
+removes again when it's done recording.
+"""
+import errno
+import os
+
+from fcntl import flock, LOCK_EX, LOCK_NB
+
+
+LOCKS_DIRNAME = '.locks'
+
+
+class KeyLock(object):
+    """An exclusive lock on recording one (hostname, hash) of a dataset.
+    """
+
+    def __init__(self, folder, hostname, hashname):
+        self.path = os.path.join(folder, LOCKS_DIRNAME, '{}.{}'.format(
+            hostname, hashname))
+        self.fd = None
+
+    def open(self):
+        try:
+            return os.open(self.path, os.O_RDWR | os.O_CREAT, 0644)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+        try:
+            os.makedirs(os.path.dirname(self.path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        return os.open(self.path, os.O_RDWR | os.O_CREAT, 0644)
+
+    def acquire(self, blocking=True):
+        """Takes the lock, waiting for another process to release it unless
+        `blocking` is false. Returns whether the lock was taken.
+        """
+        while True:
+            fd = self.open()
+            try:
+                flock(fd, LOCK_EX if blocking else LOCK_EX | LOCK_NB)
+            except IOError as e:
+                os.close(fd)
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    return False
+                raise
+
+            # the previous holder removes the file as it releases it, so the
+            # lock only counts if the file is still the one at the path
+            try:
+                current = os.fstat(fd).st_ino == os.stat(self.path).st_ino
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    os.close(fd)
+                    raise
+                current = False
+            if current:
+                self.fd = fd
+                return True
+            os.close(fd)
+
+    def release(self):
+        if self.fd is None:
+            return
+        os.unlink(self.path)
+        os.close(self.fd)
+        self.fd = None
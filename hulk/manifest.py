@@ -0,0 +1,127 @@
+"""Dataset manifests.
+
+A manifest maps each recorded hash to the url, method and content-type it
+was recorded from. It is kept as two files in the dataset folder:
+
+* `dataset.json`: a compacted snapshot, `{hash: {"url": .., "content-type": ..}}`
+* `dataset.jsonl`: an append-only log of records added since the snapshot,
+  one JSON object per line.
+
+Recording appends a single line under an exclusive `flock`, so it costs the
+same however big the dataset is and concurrent recorders don't lose entries.
+Every `COMPACT_EVERY` appends the log is folded into the snapshot.
+"""
+import collections
+import json
+import logging
+import os
+import threading
+from fcntl import flock, LOCK_EX, LOCK_SH
+
+
+logger = logging.getLogger()
+
+MANIFEST_FILENAME = 'dataset.json'
+LOG_FILENAME = 'dataset.jsonl'
+COMPACT_EVERY = 1000
+
+_appends = collections.defaultdict(int)
+_appends_lock = threading.Lock()
+
+
+def append_record(folder, hashname, content_type, url, digest=None,
+        status=None, headers=None, method=None):
+    """Appends a record to the manifest log of a dataset folder, with the
+    `method` of the request if it's given, to re-record it. `digest` is
+    the blob a deduplicated response's body is stored in (see `hulk.blobs`),
+    recorded with the response's `status` and `headers`, so it can be served
+    without reading the response file.
+    """
+    record = {
+        'hash': hashname,
+        'content-type': content_type,
+        'url': url,
+    }
+    if method is not None:
+        record['method'] = method
+    if digest is not None:
+        record['digest'] = digest
+        if status is not None:
+            record['status'] = status
+            record['headers'] = [list(pair) for pair in headers or []]
+    line = json.dumps(record, sort_keys=True) + '\n'
+
+    # the lock is released when the file is closed, after the write is flushed
+    with open(os.path.join(folder, LOG_FILENAME), 'a') as log:
+        flock(log, LOCK_EX)
+        log.write(line)
+
+    with _appends_lock:
+        _appends[folder] += 1
+        compact = _appends[folder] >= COMPACT_EVERY
+        if compact:
+            _appends[folder] = 0
+
+    if compact:
+        compact_manifest(folder)
+
+
+def read_log(log):
+    records = {}
+    for line in log:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # a recorder died mid-write; the rest of the log is still good
+            logger.warning('skipping corrupt manifest line: {!r}'.format(line))
+            continue
+        records[record.pop('hash')] = record
+    return records
+
+
+def read_snapshot(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST_FILENAME)) as snapshot:
+            content = snapshot.read()
+    except IOError:
+        return {}
+    return json.loads(content) if content.strip() else {}
+
+
+def load_manifest(folder):
+    """Returns {hash: {'url': .., 'content-type': ..}} for a dataset folder.
+    """
+    log_path = os.path.join(folder, LOG_FILENAME)
+    if not os.path.exists(log_path):
+        return read_snapshot(folder)
+
+    with open(log_path) as log:
+        # holding the log lock keeps a compaction from running in between
+        # reading the snapshot and reading the log
+        flock(log, LOCK_SH)
+        records = read_snapshot(folder)
+        records.update(read_log(log))
+    return records
+
+
+def compact_manifest(folder):
+    """Folds the manifest log into the snapshot and empties the log.
+    """
+    with open(os.path.join(folder, LOG_FILENAME), 'a+') as log:
+        flock(log, LOCK_EX)
+        log.seek(0)
+        records = read_snapshot(folder)
+        records.update(read_log(log))
+
+        path = os.path.join(folder, MANIFEST_FILENAME)
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'w') as snapshot:
+            json.dump(records, snapshot, sort_keys=True)
+        os.rename(temp_path, path)
+        log.truncate(0)
+
+    logger.debug('compacted manifest of {} ({} records)'.format(
+        folder, len(records)))
+    return records
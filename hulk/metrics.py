@@ -0,0 +1,216 @@
+"""Counters and histograms for the proxy, in the Prometheus text format.
+
+Metrics are kept in memory per process and rendered by the
+`/__hulk/metrics` endpoint. Values that already live elsewhere (eg the hot
+cache's own hit counts) are read when the metrics are rendered, through
+collectors.
+
+With `server_timing` set in the app config, every proxied response also gets
+a `Server-Timing` header with the time spent in each phase of the request
+(looking up the key, reading from disk, waiting on the origin).
+"""
+import bisect
+import logging
+import threading
+import time
+
+from flask import g
+from hulk.application import app
+
+
+logger = logging.getLogger()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(['{}="{}"'.format(name, str(value).replace(
+        '\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values)]) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """A monotonically increasing count per combination of label values.
+    """
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self.values[label_values] = \
+                self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        for label_values, value in values:
+            yield self.name, format_labels(self.labels, label_values), value
+
+
+class Histogram(object):
+    """Observations counted into cumulative buckets, per combination of
+    label values.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                # one count per bucket plus +Inf, then the sum
+                counts = self.values[label_values] = \
+                    [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = sorted((key, list(counts))
+                for key, counts in self.values.items())
+        names = self.labels + ('le',)
+        for label_values, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),),
+                    counts[:-1]):
+                total += count
+                yield self.name + '_bucket', format_labels(names,
+                    label_values + (format_value(bound),)), total
+            labels = format_labels(self.labels, label_values)
+            yield self.name + '_count', labels, total
+            yield self.name + '_sum', labels, counts[-1]
+
+
+class Registry(object):
+    """The metrics of a process, plus collectors that report values kept
+    elsewhere as (name, kind, help, [(labels dict, value)]).
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, labels,
+                    format_value(value)))
+
+        for collector in self.collectors:
+            for name, kind, help, samples in collector():
+                lines.append('# HELP {} {}'.format(name, help))
+                lines.append('# TYPE {} {}'.format(name, kind))
+                for labels, value in samples:
+                    names = sorted(labels)
+                    lines.append('{}{} {}'.format(name, format_labels(names,
+                        [labels[label] for label in names]),
+                        format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+requests_served = registry.counter('hulk_requests_total',
+    'Proxied requests by hostname and where they were answered from',
+    ['hostname', 'source'])
+request_seconds = registry.histogram('hulk_request_seconds',
+    'Time to build the response for a proxied request, by source',
+    ['source'])
+bytes_served = registry.counter('hulk_response_bytes_total',
+    'Bytes of the responses with a known length, by hostname',
+    ['hostname'])
+origin_seconds = registry.histogram('hulk_origin_fetch_seconds',
+    'Time to fetch and record a response from the origin, by hostname',
+    ['hostname'])
+disk_seconds = registry.histogram('hulk_disk_read_seconds',
+    'Time spent opening and reading saved responses')
+
+
+class Timing(object):
+    """The phases of one request, for metrics and the Server-Timing header.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.source = None
+        self.phases = []
+
+    def add(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    def header(self, total):
+        return ', '.join(['{};dur={:.3f}'.format(name, seconds * 1000)
+            for name, seconds in self.phases + [('total', total)]])
+
+
+def current_timing():
+    """Returns the Timing of the request being handled.
+    """
+    timing = getattr(g, 'hulk_timing', None)
+    if timing is None:
+        timing = g.hulk_timing = Timing()
+    return timing
+
+
+def instrument(response, hostname, server_timing=False):
+    """Records the metrics of a finished request and, with `server_timing`,
+    adds its Server-Timing header.
+    """
+    timing = current_timing()
+    total = time.time() - timing.started
+    source = timing.source or 'unknown'
+    requests_served.inc(1, hostname, source)
+    request_seconds.observe(total, source)
+    if response.content_length is not None and response.status_code != 304:
+        bytes_served.inc(response.content_length, hostname)
+    if server_timing:
+        response.headers['Server-Timing'] = timing.header(total)
+    return response
+
+
+def metrics_response():
+    """The `/__hulk/metrics` view.
+    """
+    return app.response_class(registry.render(), mimetype=CONTENT_TYPE)
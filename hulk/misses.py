@@ -0,0 +1,206 @@
+"""Replay misses: a negative cache and the missing-request log.
+
+Test suites tend to poll an endpoint that was never recorded, and every poll
+is the same lookup failing again. `MissCache` remembers recent misses, so a
+repeated miss is answered without looking for the response again. A
+remembered miss is dropped when the dataset's index changes (eg the response
+was just recorded), and trusted for at most `recheck_after` seconds, so
+recordings made by other processes are still picked up.
+
+Every miss is also counted in the dataset's `MissingLog`, one record per
+distinct request with how often it was asked for. Counts are buffered in
+memory and merged into `missing.json` in the dataset folder at most once
+every `flush_after` seconds, and when the process exits. `missing.json` has
+the same layout as a dataset manifest, plus the method, form, body and key
+headers of each request, so it can be given straight to `hulk record`:
+
+    $ hulk record datasets/testing/missing.json --dataset=testing
+"""
+import atexit
+import collections
+import json
+import logging
+import os
+import threading
+import time
+from fcntl import flock, LOCK_EX
+
+
+logger = logging.getLogger()
+
+MISSING_FILENAME = 'missing.json'
+DEFAULT_MAX_MISSES = 10000
+# how long (seconds) a miss is trusted, the same as the index's refresh
+DEFAULT_RECHECK_AFTER = 5.0
+# how long (seconds) miss counts are buffered before they're written out
+DEFAULT_FLUSH_AFTER = 1.0
+
+
+class MissCache(object):
+    """Bounded LRU of keys that weren't found in a dataset, each with the
+    version of the dataset index it was missing from and a value to answer
+    it with.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_MISSES,
+            recheck_after=DEFAULT_RECHECK_AFTER):
+        self.max_entries = max_entries
+        self.recheck_after = recheck_after
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, version):
+        """Returns the value a miss was remembered with, or None if it isn't
+        remembered or is out of date.
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return None
+            value, missed_version, checked = entry
+            if missed_version != version or \
+                    time.time() - checked > self.recheck_after:
+                return None
+            self.entries[key] = entry
+            self.hits += 1
+            return value
+
+    def add(self, key, version, value=True):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (value, version, time.time())
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def read_missing(folder):
+    """Returns the records of a dataset's missing-request log.
+    """
+    try:
+        with open(os.path.join(folder, MISSING_FILENAME)) as missing:
+            content = missing.read()
+    except IOError:
+        return {}
+    return json.loads(content) if content.strip() else {}
+
+
+class MissingLog(object):
+    """The distinct requests a dataset folder was missing, with how many
+    times each one was asked for.
+    """
+
+    def __init__(self, folder, flush_after=DEFAULT_FLUSH_AFTER):
+        self.folder = folder
+        self.flush_after = flush_after
+        self.pending = {}
+        self.flushed = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, hostname, hashname, method, url, content_type='',
+            form=(), body=None, headers=()):
+        """Counts a miss. `form` and `headers` are lists of (name, value)
+        pairs, `headers` only those that are part of the key.
+        """
+        key = '{}/{}'.format(hostname, hashname)
+        with self.lock:
+            record = self.pending.get(key)
+            if record is None:
+                record = self.pending[key] = {
+                    'method': method,
+                    'url': url,
+                    'content-type': content_type or '',
+                    'form': [list(pair) for pair in form],
+                    'body': body,
+                    'headers': [list(pair) for pair in headers],
+                    'count': 0,
+                }
+            record['count'] += 1
+            flush = time.time() - self.flushed >= self.flush_after
+        if flush:
+            self.flush()
+
+    def flush(self):
+        """Merges the buffered counts into `missing.json`.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.flushed = time.time()
+        if not pending:
+            return
+
+        path = os.path.join(self.folder, MISSING_FILENAME)
+        try:
+            missing = open(path, 'a+')
+        except IOError as e:
+            logger.warning('could not write {}: {}'.format(path, e))
+            return
+
+        # the lock is released when the file is closed, after the write
+        with missing:
+            flock(missing, LOCK_EX)
+            missing.seek(0)
+            content = missing.read()
+            try:
+                records = json.loads(content) if content.strip() else {}
+            except ValueError:
+                logger.warning('replacing corrupt {}'.format(path))
+                records = {}
+
+            for key, record in pending.items():
+                if key in records:
+                    records[key]['count'] += record['count']
+                else:
+                    records[key] = record
+
+            missing.seek(0)
+            missing.truncate()
+            json.dump(records, missing, indent=2, sort_keys=True)
+
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def get_missing_log(folder):
+    """Returns the MissingLog for a dataset folder.
+    """
+    try:
+        return _logs[folder]
+    except KeyError:
+        pass
+
+    with _logs_lock:
+        if folder not in _logs:
+            _logs[folder] = MissingLog(folder)
+        return _logs[folder]
+
+
+def forget_missing_log(folder):
+    """Drops the MissingLog for `folder`, writing out its buffered counts.
+    """
+    with _logs_lock:
+        log = _logs.pop(folder, None)
+    if log is not None:
+        log.flush()
+
+
+@atexit.register
+def flush_missing_logs():
+    """Writes out the buffered counts of every MissingLog.
+    """
+    with _logs_lock:
+        logs = _logs.values()
+    for log in logs:
+        log.flush()
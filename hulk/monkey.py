@@ -1,19 +1,71 @@
+import errno
 import sys
 import requests
 import logging
 import os
+import threading
 import types
-from fcntl import flock, LOCK_EX
-from urlparse import urlparse
+from contextlib import contextmanager
+from fcntl import flock, LOCK_EX, LOCK_SH
+from urlparse import urlparse, parse_qsl
 
-from flask import session
 from requests.models import Request, Response
 from requests.compat import builtin_str
-from hulk.utils import build_filename, dataset_folder, CURRENT_DATASET_FILENAME
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from hulk import keys
+from hulk.codec import decode
+from hulk.envelope import read_envelope
+from hulk.image import get_image
+from hulk.index import get_index
+from hulk.keys import build_filename
+from hulk.layers import get_stack
+from hulk.misses import MissCache, get_missing_log
+from hulk.pack import get_pack
+from hulk.preload import Usage, get_snapshot
+from hulk.rules import get_rules
+from hulk.settings import dataset_folder, CURRENT_DATASET_FILENAME
 
 
 DEFAULT_DATASET = os.environ.get("HULK_DATASET", "default")
 
+# Opt-in: also share the selected dataset with other processes through
+# CURRENT_DATASET_FILENAME, eg an app server driven by a separate test runner.
+USE_SHARED_DATASET_FILE = bool(os.environ.get("HULK_SHARED_DATASET"))
+
+# Opt-in: serve datasets from a read-only image shared by every process (see
+# hulk.image), eg the workers of a multiprocess test run.
+USE_SHARED_IMAGE = bool(os.environ.get("HULK_SHARED_IMAGE"))
+
+# Opt-in: count missing fixtures in the dataset's missing-request log (see
+# hulk.misses), to record them later with `hulk record`.
+USE_MISSING_LOG = bool(os.environ.get("HULK_MISSING_LOG"))
+
+# recent misses and their 417 messages, by (folder, hostname, hash)
+miss_cache = MissCache()
+
+# datasets entered by the current thread, innermost last
+_local = threading.local()
+
+# datasets entered by any thread, for threads that haven't entered one (eg
+# worker threads started by the code under test)
+_active = []
+_active_lock = threading.Lock()
+
+# dataset set with set_dataset() for the whole process
+_selected = None
+
+# (stat signature, dataset) of the last read of the shared dataset file
+_shared = (None, None)
+
+# the function patched into requests.Session.request, see patch_requests()
+_patched = None
+
+# the fixtures served from the preloaded snapshots (see hulk.preload) of the
+# datasets entered with with_dataset(preload=...), by dataset
+_preloaded = {}
+
+
 def set_default_dataset(dataset):
     """
     Sets the default dataset. Typically called during initialization of the 
@@ -23,6 +75,285 @@ def set_default_dataset(dataset):
     global DEFAULT_DATASET      # TODO: Not certain if this is a good way to do 
     DEFAULT_DATASET = dataset   # this...
 
+
+def use_shared_dataset_file(enabled=True):
+    """
+    Turns sharing the selected dataset through CURRENT_DATASET_FILENAME on or
+    off. Only needed when the dataset is selected in a different process than
+    the one making the requests.
+    """
+
+    global USE_SHARED_DATASET_FILE
+    USE_SHARED_DATASET_FILE = enabled
+
+
+def use_shared_image(enabled=True):
+    """
+    Turns serving datasets from shared images (see hulk.image) on or off.
+    Worth it when several processes replay the same dataset; each one then
+    maps the same image rather than reading the fixture files itself.
+    """
+
+    global USE_SHARED_IMAGE
+    USE_SHARED_IMAGE = enabled
+
+
+def use_missing_log(enabled=True):
+    """
+    Turns counting missing fixtures in the dataset's missing-request log
+    (`missing.json`, see hulk.misses) on or off.
+    """
+
+    global USE_MISSING_LOG
+    USE_MISSING_LOG = enabled
+
+
+def _thread_stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def read_shared_dataset():
+    """
+    Returns the dataset named in CURRENT_DATASET_FILENAME. The file is only
+    re-read when it has changed since the last call.
+    """
+
+    global _shared
+
+    try:
+        stat = os.stat(CURRENT_DATASET_FILENAME)
+    except OSError:
+        return None
+
+    signature = (stat.st_ino, stat.st_mtime, stat.st_size)
+    if _shared[0] != signature:
+        with open(CURRENT_DATASET_FILENAME, "r") as dataset_file:
+            flock(dataset_file, LOCK_SH)
+            _shared = (signature, dataset_file.read().strip())
+    return _shared[1]
+
+
+def write_shared_dataset(dataset_name):
+
+    with open(CURRENT_DATASET_FILENAME, "w") as current_dataset:
+        flock(current_dataset, LOCK_EX)
+        current_dataset.write(dataset_name)
+
+
+def current_dataset():
+    """
+    Returns the dataset requests should be served from: the innermost dataset
+    entered by this thread, else the latest one entered by any thread, else the
+    one from set_dataset(), else the shared file (if enabled), else the default.
+    """
+
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        return stack[-1]
+    if _active:
+        return _active[-1]
+    if _selected:
+        return _selected
+    if USE_SHARED_DATASET_FILE:
+        return read_shared_dataset() or DEFAULT_DATASET
+    return DEFAULT_DATASET
+
+
+@contextmanager
+def use_dataset(dataset_name):
+    """
+    Context manager serving requests from `dataset_name` until it exits.
+    Nests, so an inner use_dataset (or with_dataset) falls back to the outer
+    one when it's done.
+    """
+
+    stack = _thread_stack()
+    stack.append(dataset_name)
+    with _active_lock:
+        _active.append(dataset_name)
+    if USE_SHARED_DATASET_FILE:
+        write_shared_dataset(dataset_name)
+
+    try:
+        yield
+    finally:
+        stack.pop()
+        with _active_lock:
+            # remove our own (the most recent) entry
+            del _active[len(_active) - 1 - _active[::-1].index(dataset_name)]
+        if USE_SHARED_DATASET_FILE:
+            previous = stack[-1] if stack else (
+                _active[-1] if _active else _selected)
+            write_shared_dataset(previous or "")
+
+
+def preload_usage(dataset_name, preload, name):
+    """
+    Returns a Usage (see hulk.preload) of a snapshot of `dataset_name`, to
+    keep track of the fixtures `name` (a test or test class) is served from
+    it, or None if `preload` is false. `preload` is True for the whole
+    dataset, or a list of hostnames to only preload those.
+    """
+
+    if not preload:
+        return None
+    hostnames = None if preload is True else preload
+    return Usage(get_snapshot(os.path.join(dataset_folder, dataset_name),
+        hostnames, shared_image=USE_SHARED_IMAGE), name)
+
+
+@contextmanager
+def preloaded(dataset_name, usage):
+    """
+    Context manager serving requests for `dataset_name` from the snapshot of
+    `usage` until it exits. Does nothing if `usage` is None.
+    """
+
+    if usage is None:
+        yield
+        return
+
+    previous = _preloaded.get(dataset_name)
+    _preloaded[dataset_name] = usage
+    try:
+        yield
+    finally:
+        if previous is None:
+            _preloaded.pop(dataset_name, None)
+        else:
+            _preloaded[dataset_name] = previous
+
+
+class ReplayedResponse(Response):
+    """
+    A Response for a stored response. The body, and the headers (and the
+    encoding they imply), are only decoded when they're first used.
+    """
+
+    _envelope = None
+    _guess_encoding = False
+    _body = None
+
+    def __init__(self, envelope=None, body=None, folder=None):
+        super(ReplayedResponse, self).__init__()
+        self._envelope = envelope
+        self._guess_encoding = envelope is not None
+        self._body = body
+        self._folder = folder
+
+    @property
+    def content(self):
+        # stored bodies (eg a slice of a mapped image) are only decoded and
+        # copied into a string when they're first used
+        if self._body is not None:
+            self._content = decode(self._body, self._folder)
+            self._body = None
+        return super(ReplayedResponse, self).content
+
+    def iter_content(self, *args, **kwargs):
+        self.content
+        return super(ReplayedResponse, self).iter_content(*args, **kwargs)
+
+    @property
+    def headers(self):
+        if self._envelope is not None:
+            headers = CaseInsensitiveDict()
+            for name, value in self._envelope.headers:
+                if name in headers:
+                    # the same as requests does with repeated headers
+                    value = '{}, {}'.format(headers[name], value)
+                headers[name] = value
+            self._headers = headers
+            self._envelope = None
+        return self._headers
+
+    @headers.setter
+    def headers(self, headers):
+        self._headers = headers
+        self._envelope = None
+
+    @property
+    def encoding(self):
+        if self._guess_encoding:
+            self._encoding = get_encoding_from_headers(self.headers)
+            self._guess_encoding = False
+        return self._encoding
+
+    @encoding.setter
+    def encoding(self, encoding):
+        self._encoding = encoding
+        self._guess_encoding = False
+
+
+def find_stored(folder, hostname, hashname):
+    """
+    Returns a stored response from the dataset's pack or shared image, which
+    are mapped in memory, or None. Never blocks on the disk.
+    """
+
+    if USE_SHARED_IMAGE:
+        # the image holds the loose files as well as the pack
+        pack = get_image(folder)
+    else:
+        pack = get_pack(folder)
+    return pack.get(hostname, hashname) if pack else None
+
+
+def read_stored(folder, hostname, hashname):
+    """
+    Returns a stored response from the dataset's loose files, or None.
+    """
+
+    if USE_SHARED_IMAGE or (hostname, hashname) not in get_index(folder):
+        return None
+    return read_loose(folder, hostname, hashname)
+
+
+def read_loose(folder, hostname, hashname):
+    """
+    Returns an indexed loose file of a dataset, or None if it's gone.
+    """
+
+    try:
+        with open(os.path.join(folder, hostname, hashname), 'rb') as original:
+            return original.read()
+    except IOError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        get_index(folder).discard(hostname, hashname)
+    return None
+
+
+def read_layered(stack, hostname, hashname):
+    """
+    Returns (layer folder, stored response) from the nearest parent layer of
+    a dataset holding the response (see hulk.layers), or (None, None).
+    """
+
+    layer = stack.locate(hostname, hashname)
+    if layer is None:
+        return None, None
+    if layer.packed:
+        pack = get_pack(layer.folder)
+        return layer.folder, pack.get(hostname, hashname) if pack else None
+    return layer.folder, read_loose(layer.folder, hostname, hashname)
+
+
+def form_pairs(data):
+    """
+    Returns the (name, value) pairs of form data passed to requests.
+    """
+
+    if not data or isinstance(data, basestring):
+        return []
+    if hasattr(data, 'items'):
+        return data.items()
+    return list(data)
+
+
 def patched_request():
 
     def patched(self, method, url,
@@ -38,7 +369,8 @@ def patched_request():
             hooks=None,
             stream=None,
             verify=None,
-            cert=None):
+            cert=None,
+            json=None):
 
         ### Borrowed directly from requests.Session.request ###
         method = builtin_str(method)
@@ -54,59 +386,86 @@ def patched_request():
             auth = auth,
             cookies = cookies,
             hooks = hooks,
+            json = json,
         )
         prep = self.prepare_request(req)
 
-        # build filename
-        values = params or {}
-        if data:
-            values.update(data)
-
+        # build filename from every param the proxy would see: the url's
+        # query string, params and form data
         parsed_url = urlparse(url)
-        filename = build_filename(parsed_url.path, values)
+        values = parse_qsl(parsed_url.query, keep_blank_values=True)
+        for source in (params, data):
+            if isinstance(source, basestring):
+                if source is params:
+                    values.extend(parse_qsl(source, keep_blank_values=True))
+            elif hasattr(source, 'items'):
+                values.extend(source.items())
+            elif source:
+                values.extend(source)
+        # the proxy only keys JSON bodies, on the headers actually sent
+        body = prep.body if keys.is_json(prep.headers.get('Content-Type')) \
+            else None
 
         # determine which dataset to use
-
-        dataset = None
-        dataset_file = None
-
-        try:
-            dataset_file = open(CURRENT_DATASET_FILENAME, "rw")
-        except IOError:
-            pass
-
-        if dataset_file:
-            flock(dataset_file, LOCK_EX) # block until we can acquire the lock
-            dataset = dataset_file.read().strip() # NOTE! `dataset` may be set to ""
-        
-        if not dataset:
-            dataset = DEFAULT_DATASET
-
-        # try to load file
-        full_path = os.path.join(dataset_folder, dataset, parsed_url.hostname, 
-            filename[0])
-
-        logging.info('Attempting to load dataset: {}'.format(full_path))
-
-        content = ''
-        if os.path.exists(full_path):
-            with open(full_path, 'r') as original_file:
-                content = original_file.read()
-                status_code = 200
-                # TODO: mime-type
-        else:
-            status_code = 417
-            content = 'The dataset {} could not be found.'.format(full_path)
+        dataset = current_dataset()
+        folder = os.path.join(dataset_folder, dataset)
+        stack = get_stack(dataset_folder, dataset)
+
+        hostname = parsed_url.hostname
+        filename = build_filename(parsed_url.path, values, body=body,
+            headers=prep.headers, hostname=hostname, rules=get_rules(folder))
+
+        # try to load file, unless it was missing the last time
+        full_path = os.path.join(folder, hostname, filename[0])
+        logging.info('Attempting to load dataset: %s', full_path)
+
+        usage = _preloaded.get(dataset)
+        content = usage.get(hostname, filename[0]) \
+            if usage is not None else None
+        missing = None
+        stored_folder = folder
+        if content is None:
+            miss_key = (folder, hostname, filename[0])
+            version = (None if USE_SHARED_IMAGE else
+                get_index(folder).version, stack.versions())
+            missing = miss_cache.get(miss_key, version)
+        if content is None and missing is None:
+            # a complete snapshot leaves only the parent layers to look in
+            if usage is None or not usage.covers(hostname):
+                content = find_stored(folder, hostname, filename[0])
+                if content is None:
+                    content = read_stored(folder, hostname, filename[0])
+                if content is not None and usage is not None:
+                    usage.used.add((hostname, filename[0]))
+            if content is None:
+                stored_folder, content = read_layered(stack, hostname,
+                    filename[0])
 
         # TODO: fail violently on error?
         # Fudge the response object...
-        resp = Response()
-        resp.status_code = status_code
+        if content is not None:
+            envelope = read_envelope(content)
+            if envelope is not None:
+                content = buffer(content, envelope.offset)
+            resp = ReplayedResponse(envelope, content, stored_folder)
+            resp.status_code = envelope.status if envelope is not None \
+                else 200
+        else:
+            if missing is None:
+                missing = 'The dataset {} could not be found.'.format(
+                    full_path)
+                miss_cache.add(miss_key, version, missing)
+            if USE_MISSING_LOG:
+                get_missing_log(folder).add(hostname, filename[0],
+                    prep.method, prep.url, prep.headers.get('Content-Type'),
+                    form_pairs(data),
+                    data if isinstance(data, basestring) else body,
+                    keys.key_engine.extras(None, prep.headers)[1] or ())
+            resp = ReplayedResponse()
+            resp.status_code = 417
+            resp._content = missing
+        resp._content_consumed = True
         resp.url = prep.url
-        resp._content = content
-
-        if dataset_file:
-            dataset_file.close()
 
         return resp
 
@@ -114,46 +473,72 @@ def patched_request():
 
 
 def patch_requests():
+    """
+    Patches requests.Session.request to answer from the datasets. Safe to call
+    any number of times: requests is checked and the patch built once, and
+    only put back if something (eg a test's mock.patch) took it out.
+    """
 
-    # test that requests is version 2:
+    global _patched
 
-    version = [int(i) for i in requests.__version__.split('.')]
-    if version[0] < 2:
-        print "ERROR: hulk.monkey.path_requests is only compatible with requests > 2.0.0"
-        import sys
-        sys.exit(1)
+    if _patched is None:
+        # test that requests is version 2:
+        version = [int(i) for i in requests.__version__.split('.')]
+        if version[0] < 2:
+            print "ERROR: hulk.monkey.path_requests is only compatible with requests > 2.0.0"
+            sys.exit(1)
 
-    # TODO make this work for requests 1.x
-    requests.Session.request = patched_request()
+        # TODO make this work for requests 1.x
+        _patched = patched_request()
+
+    if requests.Session.__dict__.get('request') is not _patched:
+        requests.Session.request = _patched
 
 def set_dataset(dataset_name, print_on_call=True):
+    """
+    Selects the dataset for the whole process, until reset_dataset() is called.
+    Datasets entered with with_dataset/use_dataset take precedence.
+    """
 
-    with open(CURRENT_DATASET_FILENAME, "w") as current_dataset:
-        flock(current_dataset, LOCK_EX)
-        current_dataset.write(dataset_name)
+    global _selected
+    _selected = dataset_name
+
+    if USE_SHARED_DATASET_FILE:
+        write_shared_dataset(dataset_name)
 
     if print_on_call: #"-v" in sys.argv:
-        sys.stdout.write('(dataset: ' + dataset_name + ') ')
-        sys.stdout.flush()
+        announce_dataset(dataset_name)
+
+def announce_dataset(dataset_name):
+
+    sys.stdout.write('(dataset: ' + dataset_name + ') ')
+    sys.stdout.flush()
 
 def reset_dataset():
 
-    with open(CURRENT_DATASET_FILENAME, "w") as current_dataset:
-        flock(current_dataset, LOCK_EX)
-        current_dataset.write("")
+    global _selected
+    _selected = None
+
+    if USE_SHARED_DATASET_FILE:
+        write_shared_dataset("")
 
-def with_dataset(dataset_name, print_on_call=True):
+def with_dataset(dataset_name, print_on_call=True, preload=False):
     """
     This decorator wraps a function or TestCase class. When that function or the
     TestCase's run() method is called we will change the dataset that is being 
-    injected by hulk. Once the function returns, we revert to the default 
-    dataset.
+    injected by hulk. Once the function returns, we revert to the previous 
+    dataset, so method decorators can be used inside class decorators.
 
     :param dataset_name: The name of the dataset (folder underneath the hulk 
         base directory) to use for this function call.
 
     :param print_on_call: If True then the name of the dataset will be printed
         out. Helpful when the test runner is running the verbose flag.
+
+    :param preload: If True, the dataset is loaded into memory the first time
+        it is used, and the fixtures used are reported when the function
+        returns or after the TestCase's tearDownClass (see hulk.preload). A
+        list of hostnames only preloads those.
     """
     # need to make sure requests is patched
     patch_requests()
@@ -163,23 +548,52 @@ def with_dataset(dataset_name, print_on_call=True):
 
         if isinstance(original_obj, types.FunctionType):
 
+            name = '{}.{}'.format(original_obj.__module__,
+                original_obj.__name__)
+
             def wrapped_obj(*a, **kw):
-                set_dataset(dataset_name, print_on_call)
-                return_value = original_obj(*a, **kw)    # Now try calling the test
-                reset_dataset()
-                return return_value     # Annnddd, we're done.
+                if print_on_call: #"-v" in sys.argv:
+                    announce_dataset(dataset_name)
+                usage = preload_usage(dataset_name, preload, name)
+                try:
+                    with use_dataset(dataset_name), \
+                            preloaded(dataset_name, usage):
+                        return original_obj(*a, **kw)    # Now try calling the test
+                finally:
+                    if usage is not None:
+                        usage.report()
 
         else:
 
+            name = '{}.{}'.format(original_obj.__module__,
+                original_obj.__name__)
+
+            # one snapshot usage for all the tests of the class
+            usages = []
+
             def hulk_run(self, *a, **kw):   # FIXME, do we want to ensure that the class passed in inherits from TestCase?
-                set_dataset(dataset_name)
-                return_value = super(original_obj, self).run(*a, **kw)
-                reset_dataset()
-                return return_value
+                announce_dataset(dataset_name)
+                if preload and not usages:
+                    usages.append(preload_usage(dataset_name, preload, name))
+                with use_dataset(dataset_name), \
+                        preloaded(dataset_name, usages[0] if usages else None):
+                    return super(original_obj, self).run(*a, **kw)
 
             wrapped_obj = original_obj
             wrapped_obj.run = hulk_run
 
+            if preload:
+                tear_down_class = original_obj.tearDownClass
+
+                def hulk_tear_down_class(cls):
+                    try:
+                        tear_down_class()
+                    finally:
+                        if usages:
+                            usages.pop().report()
+
+                wrapped_obj.tearDownClass = classmethod(hulk_tear_down_class)
+
         return wrapped_obj
 
     return instantiate_func
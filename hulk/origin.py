@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+from urlparse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+
+logger = logging.getLogger()
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_RETRIES = 2
+
+
+class HostStats(object):
+    """Fetch counts and latency (time to response headers) for one host.
+    """
+
+    def __init__(self):
+        self.fetches = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+
+class OriginPool(object):
+    """Keeps one `requests.Session` per origin host, so origin fetches reuse
+    keep-alive connections instead of opening a new TCP/TLS connection for
+    every recorded request.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+            retries=DEFAULT_RETRIES):
+        self.sessions = {}
+        self.stats_by_host = {}
+        self.lock = threading.Lock()
+        self.configure(pool_size, timeout, retries)
+
+    def configure(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+            retries=DEFAULT_RETRIES):
+        """Changes the pool settings. Existing sessions are closed.
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.retries = retries
+        self.close()
+
+    def session_for(self, hostname):
+        session = self.sessions.get(hostname)
+        if session is not None:
+            return session
+
+        with self.lock:
+            if hostname not in self.sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1,
+                    pool_maxsize=self.pool_size,
+                    max_retries=Retry(total=self.retries, backoff_factor=0.1,
+                        status_forcelist=(502, 503, 504),
+                        raise_on_status=False))
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.sessions[hostname] = session
+                self.stats_by_host[hostname] = HostStats()
+            return self.sessions[hostname]
+
+    def request(self, method, url, **kwargs):
+        """Same as `requests.request`, through the pooled session for the
+        url's host.
+        """
+        hostname = urlparse(url).netloc
+        session = self.session_for(hostname)
+        kwargs.setdefault('timeout', self.timeout)
+
+        started = time.time()
+        try:
+            response = session.request(method, url, **kwargs)
+        except Exception:
+            with self.lock:
+                self.stats_by_host[hostname].errors += 1
+            raise
+        elapsed = time.time() - started
+
+        with self.lock:
+            stats = self.stats_by_host[hostname]
+            stats.fetches += 1
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+        logger.debug('origin fetch from {} took {:.1f}ms'.format(
+            hostname, elapsed * 1000))
+        return response
+
+    def stats(self):
+        """Returns per-host fetch, latency and connection reuse counts.
+        """
+        report = {}
+        with self.lock:
+            for hostname, session in self.sessions.items():
+                stats = self.stats_by_host[hostname]
+                connections = requests_sent = 0
+                for adapter in set(session.adapters.values()):
+                    for key in adapter.poolmanager.pools.keys():
+                        pool = adapter.poolmanager.pools[key]
+                        connections += pool.num_connections
+                        requests_sent += pool.num_requests
+                report[hostname] = {
+                    'fetches': stats.fetches,
+                    'errors': stats.errors,
+                    'connections': connections,
+                    'reused': max(0, requests_sent - connections),
+                    'avg_ms': (stats.total_time / stats.fetches * 1000
+                        if stats.fetches else 0.0),
+                    'max_ms': stats.max_time * 1000,
+                }
+        return report
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+            self.stats_by_host = {}
+
+
+# shared by every origin fetch in the process
+origin_pool = OriginPool()
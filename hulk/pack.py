@@ -0,0 +1,290 @@
+"""Packed, single-file datasets.
+
+A packed dataset lives next to the loose `<hostname>/<hash>` files in the
+dataset folder as two files:
+
+* `dataset.pack`: an append-only data file. After an 8 byte magic it holds
+  one record per response: a header (hostname length, hash length, body
+  length), the hostname, the hash and the raw body.
+* `dataset.idx`: a sorted index of fixed width entries mapping
+  md5("<hostname>/<hash>") to the offset and length of the body in the data
+  file, searched by bisection.
+
+Both are mapped read-only with `mmap`, so opening a pack costs two `open`s
+regardless of its size and lookups return zero-copy `buffer` slices.
+"""
+import logging
+import md5
+import mmap
+import os
+import struct
+import threading
+
+
+logger = logging.getLogger()
+
+PACK_FILENAME = 'dataset.pack'
+INDEX_FILENAME = 'dataset.idx'
+
+PACK_MAGIC = 'HULKPAK1'
+INDEX_MAGIC = 'HULKIDX1'
+
+RECORD_HEADER = struct.Struct('>HHQ')
+INDEX_HEADER = struct.Struct('>8sI')
+INDEX_ENTRY = struct.Struct('>16sQQ')
+KEY_SIZE = 16
+
+
+def pack_key(hostname, hashname):
+    return md5.new('{}/{}'.format(hostname, hashname)).digest()
+
+
+class PackedDataset(object):
+    """Read-only view of a packed dataset.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, PACK_FILENAME), 'rb') as data:
+            self.data = mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(os.path.join(folder, INDEX_FILENAME), 'rb') as index:
+            self.index = mmap.mmap(index.fileno(), 0, access=mmap.ACCESS_READ)
+            # changes whenever the pack is rewritten; used to build etags
+            self.version = os.fstat(index.fileno()).st_mtime
+
+        if self.data[:len(PACK_MAGIC)] != PACK_MAGIC:
+            raise ValueError('{} is not a hulk pack'.format(folder))
+        magic, self.count = INDEX_HEADER.unpack_from(self.index, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError('{} has no valid pack index'.format(folder))
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        hostname, hashname = key
+        return self.find(pack_key(hostname, hashname)) is not None
+
+    def find(self, key):
+        """Returns (offset, length) of the body stored under `key`, or None.
+        """
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            position = INDEX_HEADER.size + middle * INDEX_ENTRY.size
+            found = self.index[position:position + KEY_SIZE]
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                _, offset, length = INDEX_ENTRY.unpack_from(
+                    self.index, position)
+                return offset, length
+        return None
+
+    def get(self, hostname, hashname):
+        """Returns a zero-copy buffer over the stored body, or None.
+        """
+        location = self.find(pack_key(hostname, hashname))
+        if location is None:
+            return None
+        offset, length = location
+        return buffer(self.data, offset, length)
+
+    def entries(self):
+        """Yields (key, offset, length) for every indexed body.
+        """
+        for i in range(self.count):
+            yield INDEX_ENTRY.unpack_from(
+                self.index, INDEX_HEADER.size + i * INDEX_ENTRY.size)
+
+    def records(self):
+        """Yields (hostname, hashname, body) for every indexed body.
+        """
+        indexed = set(offset for _, offset, _ in self.entries())
+        position = len(PACK_MAGIC)
+        while position < len(self.data):
+            host_length, name_length, body_length = \
+                RECORD_HEADER.unpack_from(self.data, position)
+            position += RECORD_HEADER.size
+            hostname = self.data[position:position + host_length]
+            position += host_length
+            hashname = self.data[position:position + name_length]
+            position += name_length
+            # superseded records stay in the data file but not the index
+            if position in indexed:
+                yield hostname, hashname, buffer(
+                    self.data, position, body_length)
+            position += body_length
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+
+_packs = {}
+_packs_lock = threading.Lock()
+
+
+def get_pack(folder):
+    """Returns the PackedDataset for a dataset folder, or None if it isn't
+    packed. Packs are opened once per process and then reused.
+    """
+    try:
+        return _packs[folder]
+    except KeyError:
+        pass
+
+    with _packs_lock:
+        if folder not in _packs:
+            pack = None
+            if os.path.exists(os.path.join(folder, INDEX_FILENAME)):
+                pack = PackedDataset(folder)
+            _packs[folder] = pack
+        return _packs[folder]
+
+
+def forget_pack(folder):
+    """Drops the cached pack for `folder`, eg after repacking it.
+    """
+    with _packs_lock:
+        pack = _packs.pop(folder, None)
+    if pack is not None:
+        pack.close()
+
+
+def iter_loose_files(folder):
+    """Yields (hostname, hashname, path) for each loose response file.
+    Folders starting with a dot (eg the blob store, see `hulk.blobs`) aren't
+    hostnames.
+    """
+    for hostname in sorted(os.listdir(folder)):
+        host_folder = os.path.join(folder, hostname)
+        if hostname.startswith('.') or not os.path.isdir(host_folder):
+            continue
+        for hashname in sorted(os.listdir(host_folder)):
+            if hashname.endswith('.tmp'):
+                continue
+            yield hostname, hashname, os.path.join(host_folder, hashname)
+
+
+def write_index(folder, entries):
+    """Atomically writes the sorted index for {key: (offset, length)}.
+    """
+    path = os.path.join(folder, INDEX_FILENAME)
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'wb') as index:
+        index.write(INDEX_HEADER.pack(INDEX_MAGIC, len(entries)))
+        for key in sorted(entries):
+            offset, length = entries[key]
+            index.write(INDEX_ENTRY.pack(key, offset, length))
+    os.rename(temp_path, path)
+
+
+def pack_dataset(folder, prune=False):
+    """Appends the loose files of a dataset folder to its pack and rewrites
+    the index. Returns the number of responses added.
+
+    Loose files that are already packed with identical content are skipped;
+    changed ones are appended and supersede the packed copy. With `prune`,
+    loose files are removed once the new index is in place.
+    """
+    entries = {}
+    existing = None
+    if os.path.exists(os.path.join(folder, INDEX_FILENAME)):
+        existing = PackedDataset(folder)
+        entries = dict((key, (offset, length))
+            for key, offset, length in existing.entries())
+
+    added = 0
+    packed_paths = []
+    with open(os.path.join(folder, PACK_FILENAME), 'ab') as data:
+        data.seek(0, os.SEEK_END)
+        if data.tell() == 0:
+            data.write(PACK_MAGIC)
+
+        for hostname, hashname, path in iter_loose_files(folder):
+            with open(path, 'rb') as loose:
+                body = loose.read()
+            packed_paths.append(path)
+
+            key = pack_key(hostname, hashname)
+            if existing is not None and key in entries:
+                offset, length = entries[key]
+                if existing.data[offset:offset + length] == body:
+                    continue
+
+            data.write(RECORD_HEADER.pack(
+                len(hostname), len(hashname), len(body)))
+            data.write(hostname)
+            data.write(hashname)
+            entries[key] = (data.tell(), len(body))
+            data.write(body)
+            added += 1
+
+    if existing is not None:
+        existing.close()
+    write_index(folder, entries)
+    forget_pack(folder)
+
+    if prune:
+        for path in packed_paths:
+            os.unlink(path)
+        # only the hostname folders emptied here; other folders (eg `.locks`,
+        # `.blobs`) are expected to stay
+        for host_folder in set(os.path.dirname(path) for path in packed_paths):
+            if not os.listdir(host_folder):
+                os.rmdir(host_folder)
+
+    logger.info('packed {} new responses into {}'.format(added, folder))
+    return added
+
+
+def rewrite_pack(folder, transform):
+    """Rewrites the pack of a dataset folder with every body replaced by
+    `transform(hostname, hashname, body)`, dropping superseded records.
+    Returns the number of responses written.
+    """
+    pack = PackedDataset(folder)
+    path = os.path.join(folder, PACK_FILENAME)
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())
+    entries = {}
+    with open(temp_path, 'wb') as data:
+        data.write(PACK_MAGIC)
+        for hostname, hashname, body in pack.records():
+            body = transform(hostname, hashname, body)
+            data.write(RECORD_HEADER.pack(
+                len(hostname), len(hashname), len(body)))
+            data.write(hostname)
+            data.write(hashname)
+            entries[pack_key(hostname, hashname)] = (data.tell(), len(body))
+            data.write(body)
+    pack.close()
+
+    os.rename(temp_path, path)
+    write_index(folder, entries)
+    forget_pack(folder)
+    return len(entries)
+
+
+def unpack_dataset(folder):
+    """Writes every packed response back out as a loose file and removes the
+    pack. Returns the number of responses written.
+    """
+    pack = PackedDataset(folder)
+    written = 0
+    for hostname, hashname, body in pack.records():
+        host_folder = os.path.join(folder, hostname)
+        if not os.path.isdir(host_folder):
+            os.makedirs(host_folder)
+        with open(os.path.join(host_folder, hashname), 'wb') as loose:
+            loose.write(body)
+        written += 1
+    pack.close()
+
+    forget_pack(folder)
+    os.unlink(os.path.join(folder, INDEX_FILENAME))
+    os.unlink(os.path.join(folder, PACK_FILENAME))
+    logger.info('unpacked {} responses from {}'.format(written, folder))
+    return written
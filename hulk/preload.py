@@ -0,0 +1,216 @@
+"""Preloaded dataset snapshots for `with_dataset(..., preload=True)`.
+
+A snapshot holds every stored response of a dataset (or of the hostnames it
+was asked for) in one dict, read the first time the dataset is preloaded and
+never changed after that, so a request is answered with a dict lookup
+instead of an index check and a file read. Packed responses are kept as
+slices of the mapped pack rather than copies.
+
+Loose files are read until the snapshot holds `preload_bytes` of them
+(`HULK_PRELOAD_BYTES`, 256MB by default); past that the snapshot is
+incomplete and what it's missing is read lazily, the usual way.
+
+Each preloaded run keeps track of the fixtures it was served (`Usage`), and
+merges them into `used.json` in the dataset folder when it's done, with the
+names of the tests that used them. `unused_fixtures` (`hulk unused`) then
+lists what no test asked for, to prune the dataset with.
+"""
+import json
+import logging
+import os
+import threading
+from fcntl import flock, LOCK_EX
+
+from hulk.image import get_image
+from hulk.index import get_index
+from hulk.pack import get_pack
+
+
+logger = logging.getLogger()
+
+USED_FILENAME = 'used.json'
+DEFAULT_PRELOAD_BYTES = 256 * 1024 * 1024
+
+# how many bytes of loose files a snapshot reads at most
+preload_bytes = int(os.environ.get('HULK_PRELOAD_BYTES',
+    DEFAULT_PRELOAD_BYTES))
+
+
+def set_preload_limit(max_bytes):
+    """Sets how many bytes of loose files new snapshots read at most.
+    """
+    global preload_bytes
+    preload_bytes = max_bytes
+
+
+class Snapshot(object):
+    """The stored responses of a dataset folder, by (hostname, hash).
+
+    :param hostnames: only load these hostnames, or every one if None.
+    :param shared_image: load the dataset's shared image (see
+        `hulk.image`), which also holds its loose files.
+    """
+
+    def __init__(self, folder, hostnames=None, max_bytes=None,
+            shared_image=False):
+        self.folder = folder
+        self.hostnames = frozenset(hostnames) if hostnames else None
+        self.max_bytes = preload_bytes if max_bytes is None else max_bytes
+        self.loaded_bytes = 0
+        self.complete = True
+        self.responses = {}
+        self.load(shared_image)
+
+    def wanted(self, hostname):
+        return self.hostnames is None or hostname in self.hostnames
+
+    def load(self, shared_image):
+        responses = {}
+        if not shared_image:
+            for hostname, hashname in sorted(get_index(self.folder).keys()):
+                if not self.wanted(hostname):
+                    continue
+                path = os.path.join(self.folder, hostname, hashname)
+                try:
+                    size = os.path.getsize(path)
+                    if self.loaded_bytes + size > self.max_bytes:
+                        self.complete = False
+                        break
+                    with open(path, 'rb') as loose:
+                        responses[(hostname, hashname)] = loose.read()
+                except (IOError, OSError):
+                    # gone since it was indexed
+                    continue
+                self.loaded_bytes += size
+
+        # packed responses win over loose ones, the same as when replaying
+        pack = get_image(self.folder) if shared_image else \
+            get_pack(self.folder)
+        if pack is not None:
+            for hostname, hashname, stored in pack.records():
+                if self.wanted(hostname):
+                    responses[(hostname, hashname)] = stored
+
+        self.responses = responses
+        logger.info('preloaded {} responses ({} bytes of loose files) from '
+            '{}{}'.format(len(responses), self.loaded_bytes, self.folder,
+                '' if self.complete else ', the rest is read lazily'))
+
+    def covers(self, hostname):
+        """Whether a response of `hostname` the snapshot doesn't have isn't
+        in the dataset either.
+        """
+        return self.complete and self.wanted(hostname)
+
+
+class Usage(object):
+    """The fixtures a test (or test class) was served from a snapshot.
+    """
+
+    def __init__(self, snapshot, name):
+        self.snapshot = snapshot
+        self.name = name
+        self.used = set()
+
+    def get(self, hostname, hashname):
+        key = (hostname, hashname)
+        stored = self.snapshot.responses.get(key)
+        if stored is not None:
+            self.used.add(key)
+        return stored
+
+    def covers(self, hostname):
+        return self.snapshot.covers(hostname)
+
+    def report(self):
+        """Logs how much of the dataset was used and merges the fixtures
+        used into its `used.json`.
+        """
+        folder = self.snapshot.folder
+        logger.info('{} used {} of {} preloaded fixtures of {}'.format(
+            self.name, len(self.used), len(self.snapshot.responses), folder))
+        if self.used:
+            merge_used(folder, self.name, self.used)
+
+
+def read_used(folder):
+    """Returns {"hostname/hash": [test names]} from a dataset's `used.json`.
+    """
+    try:
+        with open(os.path.join(folder, USED_FILENAME)) as used:
+            content = used.read()
+    except IOError:
+        return {}
+    return json.loads(content) if content.strip() else {}
+
+
+def merge_used(folder, name, keys):
+    path = os.path.join(folder, USED_FILENAME)
+    try:
+        used = open(path, 'a+')
+    except IOError as e:
+        logger.warning('could not write {}: {}'.format(path, e))
+        return
+
+    # the lock is released when the file is closed, after the write
+    with used:
+        flock(used, LOCK_EX)
+        used.seek(0)
+        content = used.read()
+        try:
+            records = json.loads(content) if content.strip() else {}
+        except ValueError:
+            logger.warning('replacing corrupt {}'.format(path))
+            records = {}
+
+        for hostname, hashname in keys:
+            names = records.setdefault('{}/{}'.format(hostname, hashname), [])
+            if name not in names:
+                names.append(name)
+                names.sort()
+
+        used.seek(0)
+        used.truncate()
+        json.dump(records, used, indent=2, sort_keys=True)
+
+
+def unused_fixtures(folder):
+    """Returns the (hostname, hash) of every response in a dataset folder,
+    loose and packed, that its `used.json` doesn't list.
+    """
+    used = read_used(folder)
+    keys = set(get_index(folder).keys())
+    pack = get_pack(folder)
+    if pack is not None:
+        keys.update((hostname, hashname)
+            for hostname, hashname, _ in pack.records())
+    return sorted(key for key in keys if '{}/{}'.format(*key) not in used)
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot(folder, hostnames=None, shared_image=False):
+    """Returns the Snapshot of a dataset folder (or of some of its
+    hostnames), loading it the first time it is asked for.
+    """
+    key = (folder, frozenset(hostnames) if hostnames else None, shared_image)
+    try:
+        return _snapshots[key]
+    except KeyError:
+        pass
+
+    with _snapshots_lock:
+        if key not in _snapshots:
+            _snapshots[key] = Snapshot(folder, hostnames,
+                shared_image=shared_image)
+        return _snapshots[key]
+
+
+def forget_snapshots(folder):
+    """Drops the snapshots of `folder`, eg after recording into it.
+    """
+    with _snapshots_lock:
+        for key in [key for key in _snapshots if key[0] == folder]:
+            del _snapshots[key]
@@ -0,0 +1,290 @@
+"""Batch recording of datasets.
+
+Fetches a list of requests from their origins concurrently and saves the
+responses under the same keys the proxy would, so a dataset can be built or
+refreshed without driving traffic through `hulk --load-origin`.
+
+Requests can come from:
+
+* a plain list of URLs, one per line, optionally prefixed with a method
+  (`POST http://...`); blank lines and `#` comments are skipped
+* a dataset manifest (`dataset.json`, `dataset.jsonl` or the dataset folder,
+  see `hulk.manifest`), to re-record an existing dataset with the method
+  each response was recorded with; entries from before manifests kept the
+  method are re-fetched as a GET
+* a missing-request log (`missing.json`, see `hulk.misses`), to record the
+  requests a dataset was missing, with their method, form and body
+* a HAR file, eg exported from a browser's developer tools
+"""
+import collections
+import json
+import logging
+import os
+import threading
+import time
+import Queue
+import urllib
+from urlparse import urlparse, parse_qsl
+
+from hulk import keys
+from hulk.blobs import recording_blobs
+from hulk.codec import recording_codec
+from hulk.envelope import pack_head, response_headers, storable_headers
+from hulk.index import get_index
+from hulk.layers import get_stack
+from hulk.locks import KeyLock
+from hulk.manifest import LOG_FILENAME, MANIFEST_FILENAME, load_manifest
+from hulk.origin import origin_pool
+from hulk.rules import get_rules
+from hulk.stream import RecordingStream
+from hulk.utils import build_filename, create_dataset_folder, record_file, \
+    dataset_folder
+
+
+logger = logging.getLogger()
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_RATE = 10.0
+
+FORM_MIMETYPE = 'application/x-www-form-urlencoded'
+
+
+# `form` and `headers` are lists of (name, value) pairs
+RecordRequest = collections.namedtuple('RecordRequest',
+    ['method', 'url', 'form', 'body', 'content_type', 'headers'])
+
+
+def requests_from_url_list(lines):
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = line.split(None, 1)
+        method, url = parts if len(parts) == 2 else ('GET', parts[0])
+        yield RecordRequest(method.upper(), url, [], None, '', [])
+
+
+def requests_from_manifest(records):
+    for hashname, record in sorted(records.items()):
+        url = record['url']
+        if '://' not in url:
+            url = 'http://' + url
+        yield RecordRequest(record.get('method') or 'GET', url,
+            [tuple(pair) for pair in record.get('form') or []],
+            record.get('body'), record.get('content-type') or '',
+            [tuple(pair) for pair in record.get('headers') or []])
+
+
+def requests_from_har(har):
+    for entry in har['log']['entries']:
+        request = entry['request']
+        post = request.get('postData') or {}
+        content_type = (post.get('mimeType') or '').split(';')[0].strip()
+
+        form = []
+        body = post.get('text')
+        if post.get('params'):
+            form = [(param['name'], param.get('value', ''))
+                for param in post['params']]
+            body = None
+        elif body and content_type == FORM_MIMETYPE:
+            form = parse_qsl(body, keep_blank_values=True)
+            body = None
+
+        headers = [(header['name'], header['value'])
+            for header in request.get('headers') or []]
+        yield RecordRequest(request['method'].upper(), request['url'],
+            form, body, content_type, headers)
+
+
+def load_requests(path):
+    """Reads the requests to record from a URL list, manifest or HAR file.
+    A manifest is read with its log, from either of its files or the
+    dataset folder.
+    """
+    if os.path.isdir(path):
+        return list(requests_from_manifest(load_manifest(path)))
+    if os.path.basename(path) in (MANIFEST_FILENAME, LOG_FILENAME):
+        return list(requests_from_manifest(load_manifest(
+            os.path.dirname(path))))
+
+    with open(path) as source:
+        content = source.read()
+
+    try:
+        parsed = json.loads(content)
+    except ValueError:
+        return list(requests_from_url_list(content.splitlines()))
+
+    if isinstance(parsed, dict) and 'log' in parsed:
+        return list(requests_from_har(parsed))
+    return list(requests_from_manifest(parsed))
+
+
+class RateLimiter(object):
+    """Per-host token buckets, allowing `rate` requests per second per host
+    with bursts of up to `rate` requests.
+    """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def wait(self, hostname):
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self.lock:
+                now = time.time()
+                tokens, updated = self.buckets.get(hostname, (self.rate, now))
+                tokens = min(self.rate, tokens + (now - updated) * self.rate)
+                if tokens >= 1:
+                    self.buckets[hostname] = (tokens - 1, now)
+                    return
+                self.buckets[hostname] = (tokens, now)
+                delay = (1 - tokens) / self.rate
+            time.sleep(delay)
+
+
+class Recorder(object):
+    """Records a batch of requests into a dataset with a pool of threads.
+    """
+
+    def __init__(self, dataset, concurrency=DEFAULT_CONCURRENCY,
+            rate=DEFAULT_RATE, overwrite=False):
+        self.dataset = dataset
+        self.concurrency = concurrency
+        self.limiter = RateLimiter(rate)
+        self.overwrite = overwrite
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()
+
+    def record(self, requests):
+        """Records every request and returns counts of what happened.
+        """
+        work = Queue.Queue()
+        for request in requests:
+            work.put(request)
+
+        workers = []
+        for i in range(min(self.concurrency, work.qsize())):
+            worker = threading.Thread(target=self.process, args=(work,),
+                name='hulk-recorder-{}'.format(i))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        for worker in workers:
+            worker.join()
+
+        return dict(self.counts)
+
+    def process(self, work):
+        while True:
+            try:
+                request = work.get_nowait()
+            except Queue.Empty:
+                return
+
+            try:
+                outcome = self.record_one(request)
+            except Exception as e:
+                logger.error('failed to record {} {}: {}'.format(
+                    request.method, request.url, e))
+                outcome = 'failed'
+
+            with self.lock:
+                self.counts[outcome] += 1
+
+    def record_one(self, request):
+        url = urlparse(request.url)
+        hostname = url.netloc
+
+        # the same key the proxy builds from `request.values`, the body and
+        # the headers
+        values = parse_qsl(url.query, keep_blank_values=True) + \
+            list(request.form)
+        headers = dict((name.lower(), value)
+            for name, value in request.headers)
+        if request.content_type:
+            headers.setdefault('content-type', request.content_type)
+        body = request.body if keys.is_json(request.content_type) else None
+        folder = os.path.join(dataset_folder, self.dataset)
+        rules = get_rules(folder)
+        hashname, full_query_name = build_filename(url.path or '/', values,
+            body=body, headers=headers, hostname=hostname, rules=rules)
+
+        index = get_index(folder)
+        # responses the dataset's parent layers have don't need recording
+        if not self.overwrite and ((hostname, hashname) in index or
+                get_stack(dataset_folder, self.dataset).locate(hostname,
+                    hashname)):
+            return 'skipped'
+        if not index.has_host(hostname):
+            create_dataset_folder(dataset_folder, '/'.join(
+                [self.dataset, hostname]))
+            index.add_host(hostname)
+        file_path = os.path.join(dataset_folder, self.dataset, hostname,
+            hashname)
+
+        # a running `hulk --load-origin` may be recording the same key
+        lock = KeyLock(folder, hostname, hashname)
+        lock.acquire()
+        try:
+            if not self.overwrite and os.path.exists(file_path):
+                index.add(hostname, hashname)
+                return 'skipped'
+            if rules is not None:
+                # the manifest keeps the request as it was made, the rules
+                # only shape the key it's saved under
+                full_query_name = build_filename(url.path or '/', values,
+                    body=body, headers=headers)[1]
+            return self.fetch_one(request, headers, hostname, hashname,
+                full_query_name, file_path)
+        finally:
+            lock.release()
+
+    def fetch_one(self, request, headers, hostname, hashname,
+            full_query_name, file_path):
+        """Fetches a request from the origin and saves the response, with
+        the key's lock held.
+        """
+        folder = os.path.join(dataset_folder, self.dataset)
+        self.limiter.wait(hostname)
+        data = urllib.urlencode(request.form) if request.form else \
+            request.body
+        # send the headers that are part of the key, so the recording matches
+        sent = dict((name, headers[name])
+            for name in keys.key_engine.headers if name in headers)
+        if request.content_type:
+            sent['content-type'] = headers['content-type']
+        # redirects and client errors are recorded with their status, like
+        # the proxy does; server errors are usually passing
+        upstream = origin_pool.request(request.method, request.url,
+            data=data, headers=sent, stream=True, allow_redirects=False)
+        if upstream.status_code >= 500:
+            upstream.close()
+            logger.warning('{} {} returned {}'.format(
+                request.method, request.url, upstream.status_code))
+            return 'failed'
+
+        errors = []
+        stored_headers = storable_headers(response_headers(upstream))
+        stream = RecordingStream(upstream, file_path,
+            lambda error=None: errors.append(error),
+            codec=recording_codec(folder),
+            head=pack_head(upstream.status_code, stored_headers),
+            blobs=recording_blobs(folder))
+        for _ in stream:
+            pass
+        stream.close()
+        if errors and errors[0] is not None:
+            raise errors[0]
+
+        get_index(folder).add(hostname, hashname)
+        record_file(self.dataset, hashname, request.content_type, ''.join(
+            [hostname, full_query_name]), digest=stream.blob_digest,
+            status=upstream.status_code, headers=stored_headers,
+            method=request.method)
+        return 'recorded'
@@ -0,0 +1,216 @@
+"""Request-matching rules, applied to requests before they are hashed.
+
+Requests carrying cache-busters, timestamps, nonces or session tokens get a
+new key every time, so they never match a recording. A dataset can normalize
+them with rules in a `rules.json` in its folder:
+
+    {"rules": [
+        {"host": "*", "ignore_params": ["_", "utm_*"]},
+        {"host": "api.example.com", "path": "^/search",
+         "wildcard_params": ["session"], "drop_headers": ["x-request-id"],
+         "map_path": ["^/v2/", "/v1/"]}
+    ]}
+
+`host` is a hostname (the port is ignored) or `*` for every host, and `path`
+an optional regex searched for in the requested path. Every rule matching a
+request is applied, in the order they are listed:
+
+* `ignore_params`: params left out of the key
+* `wildcard_params`: params whose value doesn't matter, only that they're set
+* `drop_headers`: headers left out of the key (see `HULK_KEY_HEADERS`)
+* `map_path`: a regex and its replacement, rewriting the path
+
+Param names can be globs. The rules are compiled the first time a dataset is
+used, and the rules that apply to a hostname are picked out the first time
+it's seen, so a request only runs the path regexes of its own host's rules.
+
+The proxy, the recorder and the patched clients all apply the rules, so a
+dataset has to be replayed with the rules it was recorded with; after editing
+them, re-record the responses whose keys changed. Parent layers (see
+`hulk.layers`) are looked up with the keys the top dataset's rules build.
+"""
+import fnmatch
+import json
+import os
+import re
+import threading
+
+from hulk.keys import iter_params
+
+
+RULES_FILENAME = 'rules.json'
+WILDCARD = '*'
+IGNORE = object()
+MISSING = object()
+# param names whose action is remembered per rule; emptied when it fills up
+MAX_NAMES = 10000
+RULE_FIELDS = ('host', 'path', 'ignore_params', 'wildcard_params',
+    'drop_headers', 'map_path')
+
+
+def has_magic(pattern):
+    return any(char in pattern for char in '*?[')
+
+
+class NameSet(object):
+    """Param names, some of which may be globs.
+    """
+
+    def __init__(self, patterns):
+        patterns = list(patterns or ())
+        self.exact = frozenset(name for name in patterns
+            if not has_magic(name))
+        globs = [name for name in patterns if has_magic(name)]
+        self.globs = re.compile('|'.join(fnmatch.translate(name)
+            for name in globs)) if globs else None
+
+    def __nonzero__(self):
+        return bool(self.exact) or self.globs is not None
+
+    def __contains__(self, name):
+        return name in self.exact or (self.globs is not None and
+            self.globs.match(name) is not None)
+
+
+class Rule(object):
+    """One compiled entry of a rules file.
+    """
+
+    def __init__(self, spec):
+        unknown = sorted(set(spec) - set(RULE_FIELDS))
+        if unknown:
+            raise ValueError('Unknown rule field(s) {}, use: {}'.format(
+                ', '.join(unknown), ', '.join(RULE_FIELDS)))
+
+        self.host = spec.get('host', WILDCARD).lower()
+        self.path = re.compile(spec['path']) if spec.get('path') else None
+        self.ignored = NameSet(spec.get('ignore_params'))
+        self.wildcards = NameSet(spec.get('wildcard_params'))
+        self.rewrites_params = bool(self.ignored) or bool(self.wildcards)
+        # param name -> IGNORE, WILDCARD or None, as names turn up
+        self.actions = {}
+        self.dropped = frozenset(name.lower()
+            for name in spec.get('drop_headers') or ())
+        self.map_path = None
+        if spec.get('map_path') is not None:
+            if len(spec['map_path']) != 2:
+                raise ValueError('map_path takes a regex and a replacement')
+            pattern, replacement = spec['map_path']
+            self.map_path = (re.compile(pattern), replacement)
+
+    def matches(self, path):
+        return self.path is None or self.path.search(path) is not None
+
+    def action(self, name):
+        action = IGNORE if name in self.ignored else \
+            WILDCARD if name in self.wildcards else None
+        if len(self.actions) >= MAX_NAMES:
+            self.actions.clear()
+        self.actions[name] = action
+        return action
+
+    def params(self, vals):
+        """Returns the params as (name, value) pairs, without the ignored
+        ones. Values are left for the key engine to expand (see
+        `hulk.keys.iter_params`).
+        """
+        if hasattr(vals, 'iterlists'):
+            items = iter_params(vals)
+        elif isinstance(vals, (list, tuple)):
+            items = vals
+        else:
+            items = vals.iteritems()
+
+        actions = self.actions
+        pairs = []
+        for name, value in items:
+            action = actions.get(name, MISSING)
+            if action is MISSING:
+                action = self.action(name)
+            if action is IGNORE:
+                continue
+            if action is WILDCARD and value is not None:
+                value = WILDCARD
+            pairs.append((name, value))
+        return pairs
+
+    def headers(self, headers):
+        return dict((name.lower(), value) for name, value in headers.items()
+            if name.lower() not in self.dropped)
+
+
+class RuleSet(object):
+    """The compiled rules of a dataset.
+    """
+
+    def __init__(self, specs):
+        self.rules = [Rule(spec) for spec in specs]
+        # hostname -> the rules for it, filled in as hostnames turn up
+        self.by_host = {}
+
+    def for_host(self, hostname):
+        try:
+            return self.by_host[hostname]
+        except KeyError:
+            pass
+
+        host = (hostname or '').split(':')[0].lower()
+        rules = tuple(rule for rule in self.rules
+            if rule.host in (WILDCARD, host))
+        self.by_host[hostname] = rules
+        return rules
+
+    def apply(self, hostname, path, vals, headers):
+        """Returns the (path, params, headers) to build a request's key
+        from.
+        """
+        requested = path
+        for rule in self.for_host(hostname):
+            if not rule.matches(requested):
+                continue
+            if vals and rule.rewrites_params:
+                vals = rule.params(vals)
+            if headers and rule.dropped:
+                headers = rule.headers(headers)
+            if rule.map_path is not None:
+                pattern, replacement = rule.map_path
+                path = pattern.sub(replacement, path)
+        return path, vals, headers
+
+
+def read_rules(folder):
+    """Returns the RuleSet of a dataset folder, or None if it has no rules.
+    """
+    try:
+        with open(os.path.join(folder, RULES_FILENAME)) as config:
+            content = config.read()
+    except IOError:
+        return None
+    specs = json.loads(content).get('rules') if content.strip() else None
+    return RuleSet(specs) if specs else None
+
+
+_rule_sets = {}
+_rule_sets_lock = threading.Lock()
+
+
+def get_rules(folder):
+    """Returns the RuleSet of a dataset folder, or None, compiling its rules
+    the first time it is asked for.
+    """
+    try:
+        return _rule_sets[folder]
+    except KeyError:
+        pass
+
+    with _rule_sets_lock:
+        if folder not in _rule_sets:
+            _rule_sets[folder] = read_rules(folder)
+        return _rule_sets[folder]
+
+
+def forget_rules(folder):
+    """Drops the rules of `folder`, eg after editing its `rules.json`.
+    """
+    with _rule_sets_lock:
+        _rule_sets.pop(folder, None)
@@ -0,0 +1,168 @@
+import atexit
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import Queue
+
+from werkzeug.serving import BaseWSGIServer
+
+
+logger = logging.getLogger()
+
+DEFAULT_WORKERS = 16
+
+
+class ThreadPoolMixIn(object):
+    """Hands accepted connections to a fixed pool of worker threads.
+
+    The stock dev server handles one connection at a time, so a single slow
+    origin fetch stalls every cache hit queued behind it. Here the accepting
+    thread only queues the socket; the workers do the actual request handling.
+    """
+    workers = DEFAULT_WORKERS
+
+    def start_workers(self):
+        self.connections = Queue.Queue()
+        self.pool = []
+        for i in range(self.workers):
+            worker = threading.Thread(target=self.process_connections,
+                name='hulk-worker-{}'.format(i))
+            worker.daemon = True
+            worker.start()
+            self.pool.append(worker)
+
+    def process_connections(self):
+        while True:
+            request, client_address = self.connections.get()
+            if request is None:
+                break
+
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        self.connections.put((request, client_address))
+
+    def stop_workers(self):
+        for _ in self.pool:
+            self.connections.put((None, None))
+        for worker in self.pool:
+            worker.join()
+        self.pool = []
+
+
+class PooledWSGIServer(ThreadPoolMixIn, BaseWSGIServer):
+    """Werkzeug WSGI server backed by a bounded pool of worker threads.
+    """
+    request_queue_size = 128
+
+    def __init__(self, host, port, app, workers=DEFAULT_WORKERS, **kwargs):
+        BaseWSGIServer.__init__(self, host, port, app, **kwargs)
+        if kwargs.get('fd') is not None:
+            # werkzeug binds a throwaway port before taking over the socket
+            self.port = self.server_address[1]
+        self.workers = workers
+        self.start_workers()
+
+    def server_close(self):
+        BaseWSGIServer.server_close(self)
+        self.stop_workers()
+
+
+def run_pooled(app, host, port, workers=DEFAULT_WORKERS):
+    """Serves `app` forever using the pooled server.
+    """
+    server = PooledWSGIServer(host, int(port), app, workers=workers)
+    logger.info(' * Running on http://{}:{}/ ({} workers)'.format(
+        host, server.port, workers))
+    server.serve_forever()
+
+
+def fork_server(app, host, listener, workers):
+    """Forks a process serving `app` with the pooled server, accepting
+    connections from the shared `listener` socket. Returns its pid.
+    """
+    pid = os.fork()
+    if pid:
+        return pid
+
+    status = 0
+    try:
+        server = PooledWSGIServer(host, 0, app, workers=workers,
+            fd=listener.fileno())
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    except Exception:
+        logger.exception('server process {} failed'.format(os.getpid()))
+        status = 1
+    finally:
+        # run the exit handlers (eg flushing the missing logs) but don't
+        # return into the parent's code
+        atexit._run_exitfuncs()
+        os._exit(status)
+
+
+def run_prefork(app, host, port, processes, workers=DEFAULT_WORKERS,
+        before_fork=None):
+    """Serves `app` forever from `processes` forked processes, each running
+    the pooled server, that share one listening socket.
+
+    `before_fork` is run in the parent first, eg to build the dataset
+    indexes, so the processes inherit what it builds (copy-on-write) instead
+    of building it themselves. Processes that die are replaced.
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, int(port)))
+    listener.listen(PooledWSGIServer.request_queue_size)
+    # every process is woken up for each connection, and only one of them
+    # gets it; the others shouldn't then block in accept()
+    listener.setblocking(0)
+
+    if before_fork is not None:
+        before_fork()
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+    signal.signal(signal.SIGTERM, stop)
+
+    logger.info(' * Running on http://{}:{}/ ({} processes x {} '
+        'workers)'.format(host, listener.getsockname()[1], processes,
+            workers))
+    children = {}
+    try:
+        while True:
+            while len(children) < processes:
+                children[fork_server(app, host, listener, workers)] = \
+                    time.time()
+            pid, status = os.wait()
+            started = children.pop(pid, None)
+            if started is None:
+                continue
+            logger.warning('server process {} exited ({}), replacing '
+                'it'.format(pid, status))
+            # don't spin if they die straight away
+            if time.time() - started < 1.0:
+                time.sleep(1.0)
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in children:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        listener.close()
@@ -0,0 +1,14 @@
+"""Settings shared by the proxy and the patched clients.
+
+Kept free of Flask and the rest of the server, so `hulk.monkey` (and the test
+suites importing it) only load what replaying a dataset needs.
+"""
+import os
+
+
+CURRENT_DATASET_FILENAME = "/tmp/current_dataset.hulk"
+
+dataset_folder = os.environ.get(
+    "HULK_DATASET_BASE_DIR", 
+    os.path.join(os.path.abspath(os.path.dirname(__file__)), 'datasets')
+)
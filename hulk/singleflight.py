@@ -0,0 +1,83 @@
+import logging
+import threading
+
+
+logger = logging.getLogger()
+
+
+class Flight(object):
+    """A call in progress that other callers can wait on.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        """Blocks until the flight lands, then returns its result or raises
+        its error.
+        """
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls for the same key into a single call.
+
+    The first caller for a key runs the function; callers arriving while it
+    is still running wait for it and share its result (or its exception).
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.lock = threading.Lock()
+
+    def begin(self, key):
+        """Joins the flight for `key`, starting one if there isn't any.
+
+        Returns (flight, leader). The leader must call `finish` when done;
+        everyone else can `wait` on the flight.
+        """
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        return flight, leader
+
+    def finish(self, key, flight, result=None, error=None):
+        flight.result = result
+        flight.error = error
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        flight.done.set()
+
+    def do(self, key, func, *args, **kwargs):
+        flight, leader = self.begin(key)
+        if not leader:
+            logger.debug('waiting on in-flight call for {}'.format(key))
+            return flight.wait()
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result=result)
+        return result
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'in_flight': len(self.flights),
+        }
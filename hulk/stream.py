@@ -0,0 +1,259 @@
+import hashlib
+import logging
+import os
+
+from flask import current_app
+from werkzeug.wsgi import ClosingIterator, FileWrapper, wrap_file
+from hulk.blobs import DIGEST_SIZE, REF_MAGIC, REF_SIZE, get_blob_store, \
+    make_ref
+from hulk.codec import MAGIC_SIZE, detect, get_codec, iter_decoded
+from hulk.envelope import read_envelope, read_envelope_file
+from hulk.utils import apply_headers, serve_content, temp_path_for
+
+
+logger = logging.getLogger()
+
+CHUNK_SIZE = 64 * 1024
+
+
+class RecordingStream(object):
+    """WSGI response iterable that passes an origin body through to the
+    client chunk by chunk while writing the same chunks to a temp file.
+
+    The body is never decoded or held in memory as a whole. Once it has been
+    read to the end the temp file is renamed to `path` and `on_complete` is
+    called with no arguments; if anything fails the temp file is removed and
+    `on_complete` gets the exception instead.
+
+    If the client goes away early the rest of the body is still read into
+    the file, so the recording (and anyone waiting on it) isn't lost.
+
+    With a `codec` (see `hulk.codec`) the file is compressed as it's written;
+    the client still gets the body as the origin sent it. A `head` (see
+    `hulk.envelope`) is written ahead of the body.
+
+    With a `blobs` store (see `hulk.blobs`) the body is written to the store
+    instead, under its digest, and `path` gets the head and a reference to
+    it. The digest is then kept in `blob_digest`.
+    """
+
+    def __init__(self, upstream, path, on_complete, chunk_size=CHUNK_SIZE,
+            codec=None, head=None, blobs=None):
+        self.upstream = upstream
+        self.path = path
+        self.on_complete = on_complete
+        self.head = head
+        self.blobs = blobs
+        self.digest = None
+        self.blob_digest = None
+        if blobs is not None:
+            self.temp_path = blobs.temp_path()
+            self.digest = hashlib.sha1()
+        else:
+            self.temp_path = temp_path_for(path)
+        self.temp = open(self.temp_path, 'wb')
+        self.chunks = upstream.iter_content(chunk_size)
+        self.compressor = None
+        if head and blobs is None:
+            self.temp.write(head)
+        if codec is not None:
+            self.temp.write(codec.magic)
+            self.compressor = codec.compressor()
+        self.done = False
+
+    def write(self, chunk):
+        if self.digest is not None:
+            self.digest.update(chunk)
+        if self.compressor is not None:
+            chunk = self.compressor.compress(chunk)
+        self.temp.write(chunk)
+
+    def __iter__(self):
+        try:
+            for chunk in self.chunks:
+                self.write(chunk)
+                yield chunk
+        except GeneratorExit:
+            raise
+        except Exception as e:
+            self.fail(e)
+            raise
+        self.complete()
+
+    def close(self):
+        """Called by the server once the response is over, however it ended.
+        """
+        if self.done:
+            return
+
+        try:
+            for chunk in self.chunks:
+                self.write(chunk)
+        except Exception as e:
+            self.fail(e)
+        else:
+            self.complete()
+
+    def complete(self):
+        if self.done:
+            return
+        self.done = True
+        if self.compressor is not None:
+            self.temp.write(self.compressor.flush())
+        self.temp.close()
+        self.upstream.close()
+        if self.blobs is None:
+            os.rename(self.temp_path, self.path)
+        else:
+            self.blob_digest = self.digest.hexdigest()
+            self.blobs.add(self.temp_path, self.blob_digest)
+            temp_path = temp_path_for(self.path)
+            with open(temp_path, 'wb') as stored:
+                stored.write((self.head or '') + make_ref(self.blob_digest))
+            os.rename(temp_path, self.path)
+        logger.debug('recorded {}'.format(self.path))
+        self.on_complete()
+
+    def fail(self, error):
+        if self.done:
+            return
+        self.done = True
+        logger.error('recording {} failed: {}'.format(self.path, error))
+        self.temp.close()
+        self.upstream.close()
+        try:
+            os.unlink(self.temp_path)
+        except OSError:
+            pass
+        self.on_complete(error)
+
+
+def iter_buffer(body, chunk_size=CHUNK_SIZE):
+    """Yields a buffer (eg a packed body) in chunks, without copying it whole.
+    """
+    for offset in xrange(0, len(body), chunk_size):
+        yield body[offset:offset + chunk_size]
+
+
+class SliceFileWrapper(FileWrapper):
+    """Iterates over an open file from `offset` on, eg past an envelope, and
+    seeks relative to it so Range requests land in the right place.
+    """
+
+    def __init__(self, file, offset, buffer_size=CHUNK_SIZE):
+        FileWrapper.__init__(self, file, buffer_size)
+        self.offset = offset
+        file.seek(offset)
+
+    def seek(self, position, whence=0):
+        if whence == 0:
+            position += self.offset
+        self.file.seek(position, whence)
+
+    def tell(self):
+        return self.file.tell() - self.offset
+
+
+def serve_stream(request, body, length, etag, headers=None, status=200,
+        offset=0):
+    """Builds a streamed, conditional, Range-aware response for a body that is
+    either an open file or a buffer. The body of a file starts at `offset`.
+
+    Files go through the server's `wsgi.file_wrapper`, which is zero-copy
+    `sendfile` on servers that support it and chunked reads otherwise.
+    """
+    if isinstance(body, buffer):
+        data = iter_buffer(body)
+    elif offset:
+        data = SliceFileWrapper(body, offset)
+    else:
+        data = wrap_file(request.environ, body, CHUNK_SIZE)
+
+    response = current_app.response_class(data, status=status,
+        direct_passthrough=True)
+    apply_headers(response, request, headers)
+    response.content_length = length
+    response.set_etag(etag)
+    if status != 200:
+        return response
+    response.headers["Accept-Ranges"] = "bytes"
+    return response.make_conditional(request, accept_ranges=True,
+        complete_length=length)
+
+
+def serve_stored(request, body, etag, folder, headers=None, status=200):
+    """Serves a stored response (a string, a buffer or an open file) with the
+    status and headers of its envelope (see `hulk.envelope`) and a body that
+    may be compressed (see `hulk.codec`) or stored as a blob (see
+    `hulk.blobs`). `headers` are added to the stored ones, and `status` is
+    used if there's no envelope.
+
+    Clients that accept the stored encoding get the compressed bytes as they
+    are. Everyone else gets them decompressed on the fly, without Range
+    support since the decompressed length isn't known up front.
+    """
+    if isinstance(body, file):
+        envelope = read_envelope_file(body)
+        length = os.fstat(body.fileno()).st_size
+        magic = body.read(MAGIC_SIZE)
+    else:
+        envelope = read_envelope(body)
+        length = len(body)
+        magic = body[envelope.offset:envelope.offset + MAGIC_SIZE] \
+            if envelope is not None else body[:MAGIC_SIZE]
+
+    offset = 0
+    if envelope is not None:
+        status = envelope.status
+        offset = envelope.offset
+        length -= offset
+        headers = envelope.headers + list(headers or [])
+        if not isinstance(body, file):
+            body = buffer(body, offset)
+
+    if magic == REF_MAGIC and length == REF_SIZE:
+        if isinstance(body, file):
+            digest = body.read(DIGEST_SIZE)
+            body.close()
+        else:
+            digest = str(body[len(REF_MAGIC):])
+        store = get_blob_store(folder)
+        blob = store.get(digest)
+        return serve_stored(request, blob if blob is not None else
+            store.open(digest), etag, folder, headers, status)
+
+    name = detect(magic)
+    if name is None:
+        if isinstance(body, file):
+            body.seek(offset)
+            return serve_stream(request, body, length, etag, headers, status,
+                offset)
+        if isinstance(body, buffer):
+            return serve_stream(request, body, length, etag, headers, status)
+        return serve_content(request, body, headers, etag, status)
+
+    codec = get_codec(name, folder)
+    headers = list(headers or []) + [('Vary', 'Accept-Encoding')]
+    if request.accept_encodings[codec.encoding]:
+        headers.append(('Content-Encoding', codec.encoding))
+        if isinstance(body, file):
+            return serve_stream(request, body, length - MAGIC_SIZE,
+                '{}-{}'.format(etag, codec.encoding), headers, status,
+                offset + MAGIC_SIZE)
+        return serve_stream(request, buffer(body, MAGIC_SIZE),
+            length - MAGIC_SIZE, '{}-{}'.format(etag, codec.encoding),
+            headers, status)
+
+    if isinstance(body, file):
+        chunks = wrap_file(request.environ, body, CHUNK_SIZE)
+    else:
+        chunks = iter_buffer(buffer(body, MAGIC_SIZE))
+    response = current_app.response_class(
+        ClosingIterator(iter_decoded(chunks, codec),
+            getattr(chunks, 'close', None)),
+        status=status, direct_passthrough=True)
+    apply_headers(response, request, headers)
+    response.set_etag(etag)
+    if status != 200:
+        return response
+    return response.make_conditional(request)
@@ -1,25 +1,18 @@
 import os
 import logging
-import requests
 import logging
-import urllib
-import collections
-import md5
 import errno
-import json
+import threading
 
 from flask import request, make_response
 from hulk.exceptions import IFuckedUpException
-
-CURRENT_DATASET_FILENAME = "/tmp/current_dataset.hulk"
+from hulk.keys import build_filename
+from hulk.manifest import append_record
+from hulk.origin import origin_pool
+from hulk.settings import CURRENT_DATASET_FILENAME, dataset_folder
 
 logger = logging.getLogger()
 
-dataset_folder = os.environ.get(
-    "HULK_DATASET_BASE_DIR", 
-    os.path.join(os.path.abspath(os.path.dirname(__file__)), 'datasets')
-)
-
 
 def create_dataset_folder(base_folder, child_folder):
     """Creates the dataset folder, recursively.
@@ -48,35 +41,6 @@ def clear_working_data():
         pass
 
 
-def build_filename(path, vals):
-    # in order to make this loading of data consistent, we want to eliminate
-    # all key/value pairs that have 'None' for values, and then alphabetize 
-    # the keys. This will ensure a consistent cache name.
-    values = {}
-
-    if vals:    # may be None if no query string args
-        values.update((k, v) for k, v in vals.iteritems() if v is not None)
-        values = collections.OrderedDict(sorted(values.items()))
-
-    logger.debug('Using ordered values: {}'.format(values))
-
-    query_string_parts = [path,]
-
-    if values:
-        query_string = urllib.urlencode(values)
-        logger.debug(' - mashed all params and data into query string: {}'.format(
-            query_string))
-        query_string_parts.append('?')
-        query_string_parts.append(query_string)
-
-    name_to_hash = ''.join(query_string_parts)
-
-    hashed = md5.new(name_to_hash).hexdigest()
-    logger.debug('filename before: {}'.format(name_to_hash))
-    logger.debug('filename after: {}'.format(hashed))
-    return hashed, name_to_hash
-
-
 def load_original(request):
     logger.debug('loading original request for {}'.format(request))
 
@@ -84,7 +48,7 @@ def load_original(request):
     # localhost, we may be running this in the same environment
 
     if request.method == 'GET':
-        req = requests.get(request.url)
+        req = origin_pool.request('GET', request.url)
 
         if req.status_code != 200:
             raise IFuckedUpException(
@@ -99,7 +63,8 @@ def load_original(request):
 
         logger.debug('posting with params: {}'.format(params))
         logger.debug('posting with data: {}'.format(data))
-        req = requests.post(request.url, data=data, params=params)
+        req = origin_pool.request('POST', request.url, data=data,
+            params=params)
 
         if req.status_code != 200:
             raise IFuckedUpException(
@@ -116,7 +81,8 @@ def load_original(request):
 
         logger.debug('putting with params: {}'.format(params))
         logger.debug('putting with data: {}'.format(data))
-        req = requests.put(request.url, data=data, params=params)
+        req = origin_pool.request('PUT', request.url, data=data,
+            params=params)
 
         if req.status_code != 200:
             raise IFuckedUpException(
@@ -128,43 +94,94 @@ def load_original(request):
     # raise Exception('We don\'t handle that method type.')
 
 
+def stream_original(request):
+    """Like `load_original`, but returns the origin response with its body
+    still unread, so it can be streamed instead of held in memory. Redirects
+    and client errors are returned as they are, to be recorded with their
+    status; server errors raise, since they're usually passing.
+    """
+    logger.debug('streaming original request for {}'.format(request))
+
+    kwargs = {'stream': True, 'allow_redirects': False}
+    if request.method in ('POST', 'PUT'):
+        kwargs['params'] = request.args.to_dict()
+        kwargs['data'] = request.form.to_dict()
+    elif request.method != 'GET':
+        raise IFuckedUpException(
+            'We don\'t handle {} requests.'.format(request.method))
+
+    req = origin_pool.request(request.method, request.url, **kwargs)
+    if req.status_code >= 500:
+        req.close()
+        raise IFuckedUpException(
+            'Could\'t load the original data for {}'.format(request))
+
+    return req
+
+
 def get_dataset_folder():
     return dataset_folder
 
 
+def temp_path_for(path):
+    """Returns a temp file name next to `path`, unique to this thread.
+    """
+    return '{}.{}-{}.tmp'.format(path, os.getpid(),
+        threading.current_thread().ident)
+
+
 def save_original(path, content):
+    """Writes `content` to `path` atomically, via a temp file and a rename,
+    so readers never see a partially written file.
+    """
     logger.debug('writing file {}'.format(path))
-    with open(path, 'w') as original:
+    temp_path = temp_path_for(path)
+    with open(temp_path, 'w') as original:
         original.write(content.encode('utf-8'))
+    os.rename(temp_path, path)
     logger.debug('file written!')
 
 
 def serve_file(request, path):
     logging.debug('serving file from disk {}'.format(path))
-    response = make_response(open(path).read())
-    response.headers["Content-type"] = request.mimetype
-    return response
+    with open(path) as original:
+        return serve_content(request, original.read())
 
 
-def record_file(dataset, hashname, content_type, full_url):
-    filename = 'dataset.json'
-    file_path = os.path.join(dataset_folder, dataset, filename)
-
-    # create the file if not there
-    if not os.path.exists(file_path):
-        open(file_path, 'w').close()
-
-    record = {}
-    with open(file_path, 'r+') as infile:
-        content = infile.read()
-        if content:
-            record = json.loads(content)
-            infile.seek(0)
-            infile.truncate()
+def apply_headers(response, request, headers=None):
+    """Sets the headers of a stored response on `response`. The Content-type
+    is the request's mimetype unless the response was stored with one.
+    """
+    response.headers["Content-type"] = request.mimetype
+    for name, value in headers or []:
+        if name.lower() == 'content-type':
+            response.headers["Content-type"] = value
+        else:
+            response.headers.add(name, value)
 
-        record[hashname] = {
-            'content-type': content_type,
-            'url': full_url
-        }
 
-        infile.write(json.dumps(record))
+def serve_content(request, content, headers=None, etag=None, status=200):
+    """Builds the response for a stored body. With an `etag` the response
+    also honours conditional (If-None-Match) and Range requests, if it's a
+    200.
+    """
+    response = make_response(content, status)
+    apply_headers(response, request, headers)
+    if etag is None:
+        return response
+
+    response.set_etag(etag)
+    if status != 200:
+        return response
+    response.headers["Accept-Ranges"] = "bytes"
+    return response.make_conditional(request, accept_ranges=True,
+        complete_length=len(content))
+
+
+def record_file(dataset, hashname, content_type, full_url, digest=None,
+        status=None, headers=None, method=None):
+    """Adds a record of a newly saved response to the dataset manifest.
+    """
+    append_record(os.path.join(dataset_folder, dataset), hashname,
+        content_type, full_url, digest=digest, status=status, headers=headers,
+        method=method)
@@ -36,7 +36,16 @@ extras = {
     'develop': [
         'nose',
         'coverage',
-    ]
+    ],
+    'fast': [
+        'xxhash',
+    ],
+    'zstd': [
+        'zstandard',
+    ],
+    'tornado': [
+        'tornado',
+    ],
 }
 
 setup(
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from tornado.httpclient import AsyncHTTPClient, HTTPError
+    from tornado.testing import AsyncTestCase, gen_test
+    from hulk.async_monkey import DatasetHTTPClient, patch_tornado
+except ImportError:
+    AsyncTestCase = unittest.TestCase
+    gen_test = lambda test: test
+    patch_tornado = None
+
+from hulk.envelope import pack_head
+from hulk.keys import KeyEngine
+from hulk.monkey import use_dataset
+from hulk.pack import forget_pack, pack_dataset
+from hulk.utils import build_filename
+
+
+@unittest.skipIf(patch_tornado is None, 'tornado is not installed')
+class TestDatasetHTTPClient(AsyncTestCase):
+
+    def setUp(self):
+        super(TestDatasetHTTPClient, self).setUp()
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+        patcher = mock.patch('hulk.monkey.dataset_folder', self.folder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        configured = AsyncHTTPClient._save_configuration()
+        self.addCleanup(AsyncHTTPClient._restore_configuration, configured)
+        patch_tornado()
+        self.client = AsyncHTTPClient()
+        self.addCleanup(self.client.close)
+
+        dataset = use_dataset('testing')
+        dataset.__enter__()
+        self.addCleanup(dataset.__exit__, None, None, None)
+
+    def write_fixture(self, path, content, values=None, hostname='foo.com'):
+        hashname, _ = build_filename(path, values or {})
+        folder = os.path.join(self.folder, 'testing', hostname)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, hashname), 'w') as fixture:
+            fixture.write(content)
+
+    def test_should_be_patched_in(self):
+        self.assertIsInstance(self.client, DatasetHTTPClient)
+
+    @gen_test
+    def test_should_serve_fixtures_with_their_status_and_headers(self):
+        self.write_fixture('/bar', pack_head(200, [
+            ('Content-Type', 'application/json')]) + '{"a": 1}',
+            [('page', '2')])
+        response = yield self.client.fetch('http://foo.com/bar?page=2')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body), {'a': 1})
+        self.assertEqual(response.headers['Content-Type'],
+            'application/json')
+
+    @gen_test
+    def test_should_key_form_bodies_like_requests(self):
+        self.write_fixture('/search', 'found', [('q', 'civic'), ('a', '1')])
+        response = yield self.client.fetch('http://foo.com/search?a=1',
+            method='POST', body='q=civic')
+        self.assertEqual(response.body, 'found')
+
+    @gen_test
+    def test_should_only_key_json_bodies(self):
+        self.write_fixture('/search', 'not keyed')
+        with mock.patch('hulk.keys.key_engine', KeyEngine(json_body=True)):
+            hashname, _ = build_filename('/search', {}, body='{"q": 1}')
+            with open(os.path.join(self.folder, 'testing', 'foo.com',
+                    hashname), 'w') as fixture:
+                fixture.write('keyed')
+
+            for content_type, expected in [
+                    ('application/json; charset=utf-8', 'keyed'),
+                    ('text/plain', 'not keyed')]:
+                response = yield self.client.fetch('http://foo.com/search',
+                    method='POST', body='{"q": 1}',
+                    headers={'Content-Type': content_type})
+                self.assertEqual(response.body, expected)
+
+    @gen_test
+    def test_missing_fixtures_should_be_417s(self):
+        with self.assertRaises(HTTPError) as raised:
+            yield self.client.fetch('http://foo.com/nope')
+        self.assertEqual(raised.exception.code, 417)
+
+        response = yield self.client.fetch('http://foo.com/nope',
+            raise_error=False)
+        self.assertEqual(response.code, 417)
+
+    @gen_test
+    def test_should_serve_concurrent_fetches_from_files_and_packs(self):
+        for i in range(10):
+            self.write_fixture('/item/{}'.format(i), 'item {}'.format(i))
+        folder = os.path.join(self.folder, 'testing')
+        pack_dataset(folder, prune=True)
+        self.addCleanup(forget_pack, folder)
+        for i in range(10, 20):
+            self.write_fixture('/item/{}'.format(i), 'item {}'.format(i))
+
+        responses = yield [self.client.fetch('http://foo.com/item/{}'.format(i))
+            for i in range(20)]
+        self.assertEqual([response.body for response in responses],
+            ['item {}'.format(i) for i in range(20)])
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from hulk.blobs import collect_garbage, count_references, dedupe_dataset, \
+    dedupe_stats, forget_blob_refs, forget_blob_store, get_blob_refs, \
+    get_blob_store, make_ref, read_ref, REF_MAGIC
+from hulk.codec import compact_dataset, decode, detect, forget_codecs
+from hulk.envelope import pack_head, read_envelope, split_envelope
+from hulk.manifest import append_record
+from hulk.pack import PackedDataset, forget_pack, pack_dataset
+
+
+BODY = json.dumps([{'id': i, 'name': 'item {}'.format(i)} for i in range(100)])
+DIGEST = hashlib.sha1(BODY).hexdigest()
+
+
+class BlobsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.addCleanup(forget_blob_store, self.folder)
+        self.addCleanup(forget_codecs, self.folder)
+
+    def write(self, hostname, hashname, content):
+        folder = os.path.join(self.folder, hostname)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        path = os.path.join(folder, hashname)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+class TestRefs(BlobsTestCase):
+
+    def test_should_round_trip_digests(self):
+        self.assertEqual(read_ref(make_ref(DIGEST)), DIGEST)
+        self.assertEqual(read_ref(buffer(make_ref(DIGEST))), DIGEST)
+
+    def test_bodies_should_not_be_refs(self):
+        self.assertIsNone(read_ref(BODY))
+        self.assertIsNone(read_ref(REF_MAGIC + 'short'))
+
+    def test_decode_should_resolve_refs(self):
+        get_blob_store(self.folder).put(BODY, DIGEST)
+        self.assertEqual(decode(make_ref(DIGEST), self.folder), BODY)
+
+
+class TestBlobRefs(BlobsTestCase):
+
+    def test_should_load_the_manifests_deduplicated_responses(self):
+        self.addCleanup(forget_blob_refs, self.folder)
+        append_record(self.folder, 'a', 'text/plain', 'foo.com/a', DIGEST,
+            status=410, headers=[('X-Foo', 'bar')])
+        append_record(self.folder, 'b', 'text/plain', 'foo.com/b', DIGEST,
+            status=200)
+        append_record(self.folder, 'b', 'text/plain', 'foo.com/b')
+        append_record(self.folder, 'c', 'text/plain', 'foo.com/c', DIGEST)
+
+        refs = get_blob_refs(self.folder)
+        self.assertEqual(len(refs), 1)
+        self.assertEqual(refs.get('foo.com', 'a'),
+            (DIGEST, 410, [('X-Foo', 'bar')]))
+        self.assertIsNone(refs.get('foo.com', 'b'))
+        self.assertIs(get_blob_refs(self.folder), refs)
+
+
+class TestDedupeDataset(BlobsTestCase):
+
+    def test_should_store_identical_bodies_once(self):
+        head = pack_head(200, [('Content-Type', 'application/json')])
+        first = self.write('foo.com', 'a', head + BODY)
+        second = self.write('foo.com', 'b', BODY)
+        self.write('bar.com', 'c', 'other')
+
+        count, before, after = dedupe_dataset(self.folder)
+        self.assertEqual(count, 3)
+        self.assertEqual(before, 2 * len(BODY) + len('other'))
+        self.assertEqual(after, len(BODY) + len('other'))
+        self.assertEqual(len(list(get_blob_store(self.folder).blobs())), 2)
+
+        # the envelope stays with the response
+        self.assertEqual(read_envelope(self.read(first)).headers,
+            [('Content-Type', 'application/json')])
+        self.assertEqual(str(split_envelope(self.read(first))[1]),
+            make_ref(DIGEST))
+        self.assertEqual(self.read(second), make_ref(DIGEST))
+        self.assertEqual(decode(self.read(second), self.folder), BODY)
+
+    def test_should_dedupe_packed_responses(self):
+        self.write('foo.com', 'a', BODY)
+        self.write('foo.com', 'b', BODY)
+        pack_dataset(self.folder, prune=True)
+        self.addCleanup(forget_pack, self.folder)
+
+        self.assertEqual(dedupe_dataset(self.folder)[0], 2)
+        pack = PackedDataset(self.folder)
+        self.addCleanup(pack.close)
+        self.assertEqual(str(pack.get('foo.com', 'a')), make_ref(DIGEST))
+        self.assertEqual(count_references(self.folder), {DIGEST: 2})
+
+    def test_should_leave_deduplicated_responses_alone(self):
+        self.write('foo.com', 'a', BODY)
+        dedupe_dataset(self.folder)
+        self.assertEqual(dedupe_dataset(self.folder)[0], 0)
+
+    def test_should_compact_blobs_in_place(self):
+        self.write('foo.com', 'a', BODY)
+        self.write('foo.com', 'b', BODY)
+        dedupe_dataset(self.folder)
+
+        self.assertEqual(compact_dataset(self.folder)[0], 1)
+        blob = get_blob_store(self.folder).read(DIGEST)
+        self.assertEqual(detect(blob), 'gzip')
+        self.assertEqual(decode(make_ref(DIGEST), self.folder), BODY)
+
+
+class TestCollectGarbage(BlobsTestCase):
+
+    def test_should_remove_only_unreferenced_blobs(self):
+        self.write('foo.com', 'a', BODY)
+        path = self.write('foo.com', 'b', 'other')
+        dedupe_dataset(self.folder)
+        os.unlink(path)
+
+        removed, freed = collect_garbage(self.folder, grace=0)
+        self.assertEqual((removed, freed), (1, len('other')))
+        self.assertEqual([digest for digest, _ in
+            get_blob_store(self.folder).blobs()], [DIGEST])
+
+    def test_should_keep_new_blobs(self):
+        get_blob_store(self.folder).put('other', 'f' * 40)
+        self.assertEqual(collect_garbage(self.folder), (0, 0))
+
+
+class TestDedupeStats(BlobsTestCase):
+
+    def test_should_report_the_dedup_ratio(self):
+        for hashname in 'abcd':
+            self.write('foo.com', hashname, BODY)
+        dedupe_dataset(self.folder)
+
+        stats = dedupe_stats(self.folder)
+        self.assertEqual(stats['references'], 4)
+        self.assertEqual(stats['blobs'], 1)
+        self.assertEqual(stats['logical_bytes'], 4 * len(BODY))
+        self.assertEqual(stats['stored_bytes'], len(BODY))
+        self.assertEqual(stats['ratio'], 4.0)
+
+    def test_empty_datasets_should_have_a_ratio_of_one(self):
+        self.assertEqual(dedupe_stats(self.folder)['ratio'], 1.0)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from hulk.cache import HotCache
+
+
+class TestHotCache(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def write(self, name, content):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_should_miss_then_hit_once_loaded(self):
+        cache = HotCache()
+        path = self.write('a', 'bibble')
+        self.assertIsNone(cache.get(('ds', 'host', 'a')))
+
+        cache.load(('ds', 'host', 'a'), path)
+        self.assertEqual(cache.get(('ds', 'host', 'a')).body, 'bibble')
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_warm_hit_should_not_touch_the_disk(self):
+        cache = HotCache()
+        cache.load('a', self.write('a', 'bibble'))
+        with mock.patch('os.stat') as stat:
+            with mock.patch('hulk.cache.open', create=True) as mock_open:
+                self.assertEqual(cache.get('a').body, 'bibble')
+                self.assertFalse(stat.called)
+                self.assertFalse(mock_open.called)
+
+    def test_should_evict_least_recently_used_over_entry_limit(self):
+        cache = HotCache(max_entries=2)
+        cache.load('a', self.write('a', '1'))
+        cache.load('b', self.write('b', '2'))
+        cache.get('a')
+        cache.load('c', self.write('c', '3'))
+
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_should_evict_to_stay_within_byte_budget(self):
+        cache = HotCache(max_bytes=10)
+        cache.load('a', self.write('a', 'x' * 6))
+        cache.load('b', self.write('b', 'y' * 6))
+
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.stats()['bytes'], 6)
+
+    def test_should_not_read_bodies_larger_than_the_entry_limit(self):
+        cache = HotCache(max_entry_bytes=4)
+        self.assertIsNone(cache.load('a', self.write('a', 'too big')))
+        self.assertEqual(len(cache), 0)
+
+    def test_should_invalidate_when_mtime_changes(self):
+        cache = HotCache(revalidate_after=0)
+        path = self.write('a', 'old')
+        cache.load('a', path)
+        os.utime(path, (0, 0))
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['invalidations'], 1)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+import hulk.codec
+from hulk.codec import compact_dataset, decode, detect, encode, get_codec, \
+    forget_codecs, set_storage_codec, zstandard, DICTIONARY_FILENAME, \
+    MAGIC_SIZE
+from hulk.pack import PackedDataset, forget_pack, pack_dataset
+
+
+BODY = json.dumps([{'id': i, 'name': 'item {}'.format(i)} for i in range(100)])
+
+
+class CodecTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.addCleanup(forget_codecs, self.folder)
+
+    def write(self, hostname, hashname, content):
+        folder = os.path.join(self.folder, hostname)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        path = os.path.join(folder, hashname)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+
+class TestCodecs(CodecTestCase):
+
+    def test_gzip_bodies_should_be_plain_gzip_after_the_magic(self):
+        stored = encode(BODY, get_codec('gzip', self.folder))
+        self.assertEqual(detect(stored), 'gzip')
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO.StringIO(
+            stored[MAGIC_SIZE:])).read(), BODY)
+        self.assertEqual(decode(stored, self.folder), BODY)
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_should_round_trip_zstd(self):
+        stored = encode(BODY, get_codec('zstd', self.folder))
+        self.assertEqual(detect(stored), 'zstd')
+        self.assertEqual(decode(buffer(stored), self.folder), BODY)
+
+    def test_plain_bodies_should_be_left_alone(self):
+        self.assertIsNone(detect(BODY))
+        self.assertEqual(decode(BODY, self.folder), BODY)
+
+    def test_should_refuse_unknown_codecs(self):
+        self.assertRaises(ValueError, set_storage_codec, 'lzma')
+        set_storage_codec('gzip')
+        self.addCleanup(set_storage_codec, None)
+        self.assertEqual(hulk.codec.storage_codec, 'gzip')
+
+
+class TestCompactDataset(CodecTestCase):
+
+    def test_should_compress_loose_files_in_place(self):
+        path = self.write('foo.com', 'asdf', BODY)
+        self.write('foo.com', 'tiny', 'x')
+
+        count, before, after = compact_dataset(self.folder)
+        self.assertEqual(count, 1)
+        self.assertEqual(before, len(BODY) + 1)
+        self.assertLess(after, before / 2)
+        with open(path, 'rb') as f:
+            self.assertEqual(decode(f.read(), self.folder), BODY)
+        # too small to be worth compressing
+        with open(os.path.join(self.folder, 'foo.com', 'tiny')) as f:
+            self.assertEqual(f.read(), 'x')
+
+    def test_should_skip_bodies_already_compressed(self):
+        self.write('foo.com', 'asdf', BODY)
+        compact_dataset(self.folder)
+        self.assertEqual(compact_dataset(self.folder)[0], 0)
+
+    def test_none_should_decompress_everything_again(self):
+        path = self.write('foo.com', 'asdf', BODY)
+        compact_dataset(self.folder)
+        compact_dataset(self.folder, 'none')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), BODY)
+
+    def test_should_compress_packed_bodies(self):
+        self.write('foo.com', 'asdf', BODY)
+        pack_dataset(self.folder, prune=True)
+        self.addCleanup(forget_pack, self.folder)
+
+        self.assertEqual(compact_dataset(self.folder)[0], 1)
+        pack = PackedDataset(self.folder)
+        stored = pack.get('foo.com', 'asdf')
+        self.assertEqual(detect(stored), 'gzip')
+        self.assertEqual(decode(stored, self.folder), BODY)
+        pack.close()
+
+    @unittest.skipIf(zstandard is None, 'zstandard is not installed')
+    def test_should_train_a_zstd_dictionary(self):
+        for i in range(200):
+            self.write('foo.com', 'hash{}'.format(i), json.dumps(
+                {'id': i, 'make': 'honda', 'model': 'civic {}'.format(i),
+                    'price': i * 100, 'colours': ['red', 'blue', 'green']}))
+        compact_dataset(self.folder, 'gzip')
+
+        compact_dataset(self.folder, 'zstd', train=True, dictionary_size=4096)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.folder, DICTIONARY_FILENAME)))
+        with open(os.path.join(self.folder, 'foo.com', 'hash7'), 'rb') as f:
+            stored = f.read()
+        self.assertEqual(detect(stored), 'zstd')
+        self.assertEqual(json.loads(decode(stored, self.folder))['id'], 7)
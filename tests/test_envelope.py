@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import mock
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+from hulk.codec import compact_dataset, decode, detect
+from hulk.envelope import migrate_dataset, pack_head, parse_headers, \
+    read_envelope, read_envelope_file, split_envelope, storable_headers
+from hulk.pack import PackedDataset, forget_pack, pack_dataset
+
+
+HEADERS = [('Content-Type', 'application/json'), ('Set-Cookie', 'a=1'),
+    ('Set-Cookie', 'b=2')]
+
+
+class TestEnvelope(unittest.TestCase):
+
+    def test_should_round_trip_status_and_headers(self):
+        stored = pack_head(404, HEADERS) + 'body'
+        envelope = read_envelope(stored)
+        self.assertEqual(envelope.status, 404)
+        self.assertEqual(envelope.headers, HEADERS)
+        self.assertEqual(envelope.header('content-type'), 'application/json')
+        self.assertEqual(stored[envelope.offset:], 'body')
+
+    def test_headers_should_only_be_parsed_when_used(self):
+        envelope = read_envelope(buffer(pack_head(200, HEADERS) + 'body'))
+        with mock.patch('hulk.envelope.parse_headers',
+                side_effect=parse_headers) as parse:
+            self.assertEqual(envelope.status, 200)
+            self.assertFalse(parse.called)
+            envelope.headers
+            envelope.headers
+            self.assertEqual(parse.call_count, 1)
+
+    def test_body_only_recordings_should_have_no_envelope(self):
+        self.assertIsNone(read_envelope('{"legacy": true}'))
+        self.assertIsNone(read_envelope(''))
+        self.assertEqual(split_envelope('legacy'), ('', 'legacy'))
+
+    def test_should_leave_files_at_the_start_of_the_body(self):
+        stored = StringIO.StringIO(pack_head(200, HEADERS) + 'body')
+        self.assertEqual(read_envelope_file(stored).status, 200)
+        self.assertEqual(stored.read(), 'body')
+
+        legacy = StringIO.StringIO('legacy')
+        self.assertIsNone(read_envelope_file(legacy))
+        self.assertEqual(legacy.read(), 'legacy')
+
+    def test_should_not_store_transfer_headers(self):
+        self.assertEqual(storable_headers([('Content-Length', '4'),
+            ('Transfer-Encoding', 'chunked'), ('content-encoding', 'gzip'),
+            ('ETag', '"x"')]), [('ETag', '"x"')])
+
+
+class TestMigrateDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        os.makedirs(os.path.join(self.folder, 'foo.com'))
+
+    def write(self, hashname, content):
+        path = os.path.join(self.folder, 'foo.com', hashname)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def read(self, hashname):
+        with open(os.path.join(self.folder, 'foo.com', hashname), 'rb') as f:
+            return f.read()
+
+    def test_should_wrap_loose_bodies_once(self):
+        self.write('json', '{"a": 1}')
+        self.write('xml', '<?xml version="1.0"?><a/>')
+        self.write('text', 'plain text')
+        self.write('new', pack_head(201, []) + 'already wrapped')
+
+        self.assertEqual(migrate_dataset(self.folder), 3)
+        self.assertEqual(migrate_dataset(self.folder), 0)
+
+        envelope = read_envelope(self.read('json'))
+        self.assertEqual(envelope.status, 200)
+        self.assertEqual(envelope.headers,
+            [('Content-Type', 'application/json')])
+        self.assertEqual(read_envelope(self.read('xml')).header(
+            'Content-Type'), 'application/xml')
+        self.assertEqual(read_envelope(self.read('text')).headers, [])
+        self.assertEqual(read_envelope(self.read('new')).status, 201)
+
+    def test_should_wrap_compressed_and_packed_bodies(self):
+        self.write('json', '[' + ', '.join(['{"a": 1}'] * 100) + ']')
+        compact_dataset(self.folder)
+        pack_dataset(self.folder, prune=True)
+        self.addCleanup(forget_pack, self.folder)
+
+        self.assertEqual(migrate_dataset(self.folder), 1)
+        pack = PackedDataset(self.folder)
+        head, body = split_envelope(pack.get('foo.com', 'json'))
+        self.assertEqual(read_envelope(head).header('Content-Type'),
+            'application/json')
+        self.assertEqual(detect(body), 'gzip')
+        self.assertEqual(decode(body, self.folder),
+            '[' + ', '.join(['{"a": 1}'] * 100) + ']')
+        pack.close()
+
+    def test_compact_should_keep_envelopes(self):
+        body = '[' + ', '.join(['{"a": 1}'] * 100) + ']'
+        self.write('json', pack_head(200, HEADERS) + body)
+        self.assertEqual(compact_dataset(self.folder)[0], 1)
+
+        head, stored = split_envelope(self.read('json'))
+        self.assertEqual(read_envelope(head).headers, HEADERS)
+        self.assertEqual(decode(stored, self.folder), body)
@@ -0,0 +1,602 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import hulk.handler
+
+from flask import request
+from hulk.application import app
+from hulk.blobs import forget_blob_refs, forget_blob_store, get_blob_refs, \
+    get_blob_store, read_ref, set_blob_storage
+from hulk.cache import HotCache
+from hulk.codec import compact_dataset, decode, detect, set_storage_codec
+from hulk.envelope import pack_head, read_envelope, split_envelope
+from hulk.handler import handle_request
+from hulk.index import get_index
+from hulk.layers import LAYERS_FILENAME, forget_stack
+from hulk.locks import KeyLock
+from hulk.metrics import requests_served
+from hulk.misses import MissCache, forget_missing_log, read_missing
+from hulk.pack import pack_dataset, forget_pack
+from hulk.rules import RULES_FILENAME, forget_rules
+from hulk.utils import build_filename
+
+
+class FakeUpstream(object):
+    """Stands in for a streaming `requests` response.
+    """
+
+    def __init__(self, chunks, status_code=200, headers=None):
+        self.chunks = chunks
+        self.status_code = status_code
+        self.headers = dict(headers or {})
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+class HandlerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+        patcher = mock.patch('hulk.handler.dataset_folder', self.folder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('hulk.handler.hot_cache', HotCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = mock.patch('hulk.handler.miss_cache', MissCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(forget_missing_log,
+            os.path.join(self.folder, 'testing'))
+
+        patcher = mock.patch.dict(app.config,
+            {'dataset': 'testing', 'load_origin': False,
+                'server_timing': False})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_fixture(self, path, content, values=None, hostname='foo.com'):
+        hashname, _ = build_filename(path, values or {})
+        folder = os.path.join(self.folder, 'testing', hostname)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, hashname), 'w') as fixture:
+            fixture.write(content)
+
+    def get(self, url, **kwargs):
+        with app.test_request_context(url, **kwargs):
+            response = app.make_response(
+                handle_request(request, url.split('?')[0].split('/', 3)[3]))
+            # buffer streamed bodies too, so tests can look at them
+            response.direct_passthrough = False
+            response.get_data()
+            response.close()
+            return response
+
+
+class TestHandleRequest(HandlerTestCase):
+
+    def test_should_serve_existing_fixture(self):
+        self.write_fixture('/bar', 'bibble')
+        response = self.get('http://foo.com/bar')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, 'bibble')
+
+    def test_should_key_on_every_value_of_repeated_params(self):
+        self.write_fixture('/bar', 'both', [('a', '1'), ('a', '2')])
+        self.assertEqual(self.get('http://foo.com/bar?a=1&a=2').data, 'both')
+        self.assertEqual(self.get('http://foo.com/bar?a=1').status_code, 404)
+
+    def test_should_404_on_missing_fixture(self):
+        response = self.get('http://foo.com/missing')
+        self.assertEqual(response.status_code, 404)
+
+    def test_misses_should_not_touch_disk(self):
+        self.get('http://foo.com/missing')
+        with mock.patch('os.path.exists') as exists:
+            with mock.patch('os.makedirs') as makedirs:
+                response = self.get('http://foo.com/still-missing')
+                self.assertFalse(exists.called)
+                self.assertFalse(makedirs.called)
+        self.assertEqual(response.status_code, 404)
+
+    def test_repeated_misses_should_be_answered_from_the_miss_cache(self):
+        self.get('http://foo.com/missing')
+        with mock.patch('hulk.handler.get_pack') as get_pack:
+            response = self.get('http://foo.com/missing')
+            self.assertFalse(get_pack.called)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(hulk.handler.miss_cache.hits, 1)
+
+    def test_saved_responses_should_not_be_remembered_as_misses(self):
+        self.get('http://foo.com/missing')
+        self.write_fixture('/missing', 'found')
+        get_index(os.path.join(self.folder, 'testing')).add('foo.com',
+            build_filename('/missing', {})[0])
+        self.assertEqual(self.get('http://foo.com/missing').data, 'found')
+
+    def test_misses_should_be_counted_in_the_missing_log(self):
+        os.makedirs(os.path.join(self.folder, 'testing'))
+        self.get('http://foo.com/missing?a=1')
+        self.get('http://foo.com/missing?a=1')
+        self.get('http://foo.com/search', method='POST', data={'q': 'civic'})
+        forget_missing_log(os.path.join(self.folder, 'testing'))
+
+        missing = read_missing(os.path.join(self.folder, 'testing'))
+        self.assertEqual(sorted((record['method'], record['url'],
+            record['form'], record['count']) for record in missing.values()),
+            [('GET', 'http://foo.com/missing?a=1', [], 2),
+                ('POST', 'http://foo.com/search', [['q', 'civic']], 1)])
+
+    def test_should_apply_the_datasets_matching_rules(self):
+        self.write_fixture('/bar', 'bibble', {'a': '1'})
+        folder = os.path.join(self.folder, 'testing')
+        with open(os.path.join(folder, RULES_FILENAME), 'w') as config:
+            config.write('{"rules": [{"host": "foo.com", '
+                '"ignore_params": ["_"]}]}')
+        self.addCleanup(forget_rules, folder)
+        response = self.get('http://foo.com/bar?a=1&_=1234')
+        self.assertEqual(response.data, 'bibble')
+
+    def test_load_origin_should_record_the_request_made_under_rules(self):
+        app.config['load_origin'] = True
+        folder = os.path.join(self.folder, 'testing')
+        os.makedirs(folder)
+        with open(os.path.join(folder, RULES_FILENAME), 'w') as config:
+            config.write('{"rules": [{"ignore_params": ["_"], '
+                '"wildcard_params": ["session"], '
+                '"map_path": ["^/v2/", "/v1/"]}]}')
+        self.addCleanup(forget_rules, folder)
+        with mock.patch('hulk.handler.stream_original') as stream_original:
+            with mock.patch('hulk.handler.record_file') as record_file:
+                stream_original.return_value = FakeUpstream(['items'])
+                self.get('http://foo.com/v2/items?_=123&session=abc&q=1')
+
+        hashname = build_filename('/v1/items', {'q': '1', 'session': '*'})[0]
+        self.assertEqual(record_file.call_args[0][1], hashname)
+        self.assertEqual(record_file.call_args[0][3],
+            'foo.com/v2/items?_=123&q=1&session=abc')
+
+    def test_should_404_when_an_indexed_file_was_removed(self):
+        self.write_fixture('/bar', 'bibble')
+        self.get('http://foo.com/missing')
+        os.unlink(os.path.join(self.folder, 'testing', 'foo.com',
+            build_filename('/bar', {})[0]))
+        self.assertEqual(self.get('http://foo.com/bar').status_code, 404)
+
+    def test_should_serve_warm_fixture_without_touching_disk(self):
+        self.write_fixture('/bar', 'bibble')
+        self.get('http://foo.com/bar')
+
+        with mock.patch('os.path.exists') as exists:
+            with mock.patch('os.makedirs') as makedirs:
+                response = self.get('http://foo.com/bar')
+                self.assertFalse(exists.called)
+                self.assertFalse(makedirs.called)
+        self.assertEqual(response.data, 'bibble')
+        self.assertEqual(hulk.handler.hot_cache.stats()['hits'], 1)
+
+    def test_load_origin_should_stream_save_and_record_the_original(self):
+        app.config['load_origin'] = True
+        upstream = FakeUpstream(['from ', 'origin'])
+        with mock.patch('hulk.handler.stream_original') as stream_original:
+            with mock.patch('hulk.handler.record_file') as record_file:
+                stream_original.return_value = upstream
+                response = self.get('http://foo.com/new')
+
+        hashname, _ = build_filename('/new', {})
+        path = os.path.join(self.folder, 'testing', 'foo.com', hashname)
+        self.assertEqual(response.data, 'from origin')
+        self.assertEqual(str(split_envelope(open(path).read())[1]),
+            'from origin')
+        self.assertEqual(record_file.call_args[1]['method'], 'GET')
+        self.assertTrue(upstream.closed)
+
+    def test_load_origin_should_store_and_replay_status_and_headers(self):
+        app.config['load_origin'] = True
+        upstream = FakeUpstream(['{}'], headers={
+            'Content-Type': 'application/json', 'X-Origin': 'yes',
+            'Content-Length': '2', 'Transfer-Encoding': 'chunked'})
+        with mock.patch('hulk.handler.stream_original') as stream_original:
+            with mock.patch('hulk.handler.record_file'):
+                stream_original.return_value = upstream
+                recorded = self.get('http://foo.com/new')
+        self.assertEqual(recorded.headers['X-Origin'], 'yes')
+
+        hashname, _ = build_filename('/new', {})
+        path = os.path.join(self.folder, 'testing', 'foo.com', hashname)
+        envelope = read_envelope(open(path).read())
+        self.assertEqual(envelope.status, 200)
+        self.assertEqual(sorted(envelope.headers), [
+            ('Content-Type', 'application/json'), ('X-Origin', 'yes')])
+
+        hulk.handler.hot_cache.clear()
+        app.config['load_origin'] = False
+        response = self.get('http://foo.com/new')
+        self.assertEqual(response.data, '{}')
+        self.assertEqual(response.headers['Content-Type'], 'application/json')
+        self.assertEqual(response.headers['X-Origin'], 'yes')
+        self.assertEqual(response.headers['Content-Length'], '2')
+
+    def test_load_origin_should_keep_binary_bodies_intact(self):
+        app.config['load_origin'] = True
+        body = ''.join(chr(i) for i in range(256)) * 3
+        with mock.patch('hulk.handler.stream_original') as stream_original:
+            with mock.patch('hulk.handler.record_file'):
+                stream_original.return_value = FakeUpstream([body])
+                response = self.get('http://foo.com/binary')
+
+        hashname, _ = build_filename('/binary', {})
+        path = os.path.join(self.folder, 'testing', 'foo.com', hashname)
+        self.assertEqual(response.data, body)
+        self.assertEqual(str(split_envelope(open(path, 'rb').read())[1]),
+            body)
+
+    def test_load_origin_should_serve_what_another_process_recorded(self):
+        app.config['load_origin'] = True
+        # the index is built before the other process saved the response
+        get_index(os.path.join(self.folder, 'testing'))
+        self.write_fixture('/new', 'from elsewhere')
+        with mock.patch('hulk.handler.stream_original') as stream_original:
+            response = self.get('http://foo.com/new')
+        self.assertFalse(stream_original.called)
+        self.assertEqual(response.data, 'from elsewhere')
+
+    def test_load_origin_should_wait_on_other_processes_recording(self):
+        app.config['load_origin'] = True
+        hashname, _ = build_filename('/new', {})
+        lock = KeyLock(os.path.join(self.folder, 'testing'), 'foo.com',
+            hashname)
+        lock.acquire()
+        responses = []
+        with mock.patch('hulk.handler.stream_original') as stream_original:
+            thread = threading.Thread(target=lambda: responses.append(
+                self.get('http://foo.com/new')))
+            thread.start()
+            time.sleep(0.1)
+            self.write_fixture('/new', 'from elsewhere')
+            lock.release()
+            thread.join(5)
+        self.assertFalse(stream_original.called)
+        self.assertEqual(responses[0].data, 'from elsewhere')
+
+    def test_should_serve_fixture_from_pack(self):
+        self.write_fixture('/bar', 'packed bibble')
+        folder = os.path.join(self.folder, 'testing')
+        pack_dataset(folder, prune=True)
+        self.addCleanup(forget_pack, folder)
+
+        response = self.get('http://foo.com/bar')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, 'packed bibble')
+
+
+class TestLayeredReplay(HandlerTestCase):
+
+    def setUp(self):
+        super(TestLayeredReplay, self).setUp()
+        os.makedirs(os.path.join(self.folder, 'default'))
+        os.makedirs(os.path.join(self.folder, 'testing'))
+        with open(os.path.join(self.folder, 'testing', LAYERS_FILENAME),
+                'w') as config:
+            config.write('{"parents": ["default"]}')
+        self.addCleanup(forget_stack, self.folder, 'testing')
+
+    def write_parent_fixture(self, path, content):
+        hashname, _ = build_filename(path, {})
+        folder = os.path.join(self.folder, 'default', 'foo.com')
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, hashname), 'w') as fixture:
+            fixture.write(content)
+
+    def test_should_serve_fixtures_from_the_parent_layer(self):
+        self.write_parent_fixture('/bar', 'from default')
+        self.assertEqual(self.get('http://foo.com/bar').data, 'from default')
+        # and again, warm
+        self.assertEqual(self.get('http://foo.com/bar').data, 'from default')
+
+    def test_should_serve_packed_parent_layers(self):
+        self.write_parent_fixture('/bar', 'from the pack')
+        folder = os.path.join(self.folder, 'default')
+        pack_dataset(folder, prune=True)
+        self.addCleanup(forget_pack, folder)
+        self.assertEqual(self.get('http://foo.com/bar').data, 'from the pack')
+
+    def test_the_dataset_should_override_its_parents(self):
+        self.write_parent_fixture('/bar', 'from default')
+        self.write_fixture('/bar', 'from testing')
+        self.assertEqual(self.get('http://foo.com/bar').data, 'from testing')
+
+    def test_should_record_only_what_no_layer_has(self):
+        app.config['load_origin'] = True
+        self.write_parent_fixture('/bar', 'from default')
+        with mock.patch('hulk.handler.stream_original') as stream_original:
+            with mock.patch('hulk.handler.record_file'):
+                stream_original.return_value = FakeUpstream(['new'])
+                self.assertEqual(self.get('http://foo.com/bar').data,
+                    'from default')
+                self.assertEqual(self.get('http://foo.com/new').data, 'new')
+
+        self.assertEqual(stream_original.call_count, 1)
+        self.assertEqual(os.listdir(os.path.join(self.folder, 'testing',
+            'foo.com')), [build_filename('/new', {})[0]])
+        self.assertEqual(len(os.listdir(os.path.join(self.folder, 'default',
+            'foo.com'))), 1)
+
+
+class TestConditionalReplay(HandlerTestCase):
+
+    def setUp(self):
+        super(TestConditionalReplay, self).setUp()
+        self.write_fixture('/bar', '0123456789')
+
+    def test_should_send_etag_derived_from_stored_hash(self):
+        hashname, _ = build_filename('/bar', {})
+        response = self.get('http://foo.com/bar')
+        self.assertTrue(response.headers['ETag'].startswith(
+            '"{}-'.format(hashname)))
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+
+    def test_should_304_when_etag_matches(self):
+        etag = self.get('http://foo.com/bar').headers['ETag']
+        response = self.get('http://foo.com/bar',
+            headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_should_serve_byte_ranges(self):
+        response = self.get('http://foo.com/bar',
+            headers={'Range': 'bytes=2-5'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, '2345')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 2-5/10')
+
+    def test_should_stream_files_over_the_entry_limit(self):
+        hulk.handler.hot_cache.max_entry_bytes = 4
+        response = self.get('http://foo.com/bar')
+        self.assertEqual(response.data, '0123456789')
+        self.assertEqual(len(hulk.handler.hot_cache), 0)
+
+        response = self.get('http://foo.com/bar',
+            headers={'Range': 'bytes=7-'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, '789')
+
+    def test_should_stream_large_packed_bodies(self):
+        folder = os.path.join(self.folder, 'testing')
+        pack_dataset(folder, prune=True)
+        self.addCleanup(forget_pack, folder)
+        hulk.handler.hot_cache.max_entry_bytes = 4
+
+        response = self.get('http://foo.com/bar',
+            headers={'Range': 'bytes=0-2'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, '012')
+
+
+class TestInstrumentation(HandlerTestCase):
+
+    def served(self, source):
+        return requests_served.values.get(('foo.com', source), 0)
+
+    def test_should_count_requests_by_source(self):
+        self.write_fixture('/bar', 'bibble')
+        before = [self.served(source) for source in ('disk', 'hot_cache',
+            'miss')]
+        self.get('http://foo.com/bar')
+        self.get('http://foo.com/bar')
+        self.get('http://foo.com/missing')
+        self.assertEqual([self.served(source) - count for source, count in
+            zip(('disk', 'hot_cache', 'miss'), before)], [1, 1, 1])
+
+    def test_should_add_server_timing_when_enabled(self):
+        self.write_fixture('/bar', 'bibble')
+        self.assertNotIn('Server-Timing',
+            self.get('http://foo.com/bar').headers)
+
+        app.config['server_timing'] = True
+        hulk.handler.hot_cache.clear()
+        timing = self.get('http://foo.com/bar').headers['Server-Timing']
+        self.assertEqual([phase.split(';')[0] for phase in
+            timing.split(', ')], ['key', 'disk', 'total'])
+
+
+class TestEnvelopeReplay(HandlerTestCase):
+
+    def setUp(self):
+        super(TestEnvelopeReplay, self).setUp()
+        self.write_fixture('/bar', pack_head(200, [
+            ('Content-Type', 'text/csv'), ('Set-Cookie', 'a=1'),
+            ('Set-Cookie', 'b=2')]) + '0123456789')
+        self.write_fixture('/gone', pack_head(410, []) + 'gone')
+
+    def test_should_replay_stored_status_and_headers(self):
+        response = self.get('http://foo.com/bar')
+        self.assertEqual(response.data, '0123456789')
+        self.assertEqual(response.headers['Content-Type'], 'text/csv')
+        self.assertEqual(response.headers.getlist('Set-Cookie'),
+            ['a=1', 'b=2'])
+
+        response = self.get('http://foo.com/gone')
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.data, 'gone')
+
+    def test_should_serve_ranges_of_large_files_past_the_envelope(self):
+        hulk.handler.hot_cache.max_entry_bytes = 4
+        response = self.get('http://foo.com/bar',
+            headers={'Range': 'bytes=2-4'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, '234')
+        self.assertEqual(self.get('http://foo.com/gone').data, 'gone')
+
+    def test_should_replay_packed_envelopes(self):
+        folder = os.path.join(self.folder, 'testing')
+        pack_dataset(folder, prune=True)
+        self.addCleanup(forget_pack, folder)
+        response = self.get('http://foo.com/gone')
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.data, 'gone')
+
+
+class TestCompressedReplay(HandlerTestCase):
+
+    body = '{"items": [%s]}' % ', '.join(['"item"'] * 100)
+
+    def setUp(self):
+        super(TestCompressedReplay, self).setUp()
+        self.write_fixture('/bar', self.body)
+        compact_dataset(os.path.join(self.folder, 'testing'))
+
+    def test_should_send_stored_bytes_to_clients_accepting_gzip(self):
+        response = self.get('http://foo.com/bar',
+            headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        self.assertLess(len(response.data), len(self.body))
+        self.assertEqual(decode('HULKGZ01' + response.data, None), self.body)
+
+    def test_should_decompress_for_other_clients(self):
+        response = self.get('http://foo.com/bar')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.data, self.body)
+
+    def test_representations_should_have_different_etags(self):
+        plain = self.get('http://foo.com/bar').headers['ETag']
+        gzipped = self.get('http://foo.com/bar',
+            headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+        self.assertNotEqual(plain, gzipped)
+        response = self.get('http://foo.com/bar',
+            headers={'If-None-Match': plain})
+        self.assertEqual(response.status_code, 304)
+
+    def test_should_decompress_large_files_and_packs_as_a_stream(self):
+        hulk.handler.hot_cache.max_entry_bytes = 4
+        self.assertEqual(self.get('http://foo.com/bar').data, self.body)
+
+        folder = os.path.join(self.folder, 'testing')
+        pack_dataset(folder, prune=True)
+        self.addCleanup(forget_pack, folder)
+        self.assertEqual(self.get('http://foo.com/bar').data, self.body)
+
+    def test_load_origin_should_store_with_the_storage_codec(self):
+        set_storage_codec('gzip')
+        self.addCleanup(set_storage_codec, None)
+        app.config['load_origin'] = True
+        with mock.patch('hulk.handler.stream_original') as stream_original:
+            with mock.patch('hulk.handler.record_file'):
+                stream_original.return_value = FakeUpstream([self.body])
+                response = self.get('http://foo.com/new')
+
+        self.assertEqual(response.data, self.body)
+        hashname, _ = build_filename('/new', {})
+        with open(os.path.join(self.folder, 'testing', 'foo.com', hashname),
+                'rb') as stored:
+            self.assertEqual(detect(split_envelope(stored.read())[1]),
+                'gzip')
+
+
+class TestDeduplicatedReplay(HandlerTestCase):
+
+    body = '{"items": [%s]}' % ', '.join(['"item"'] * 100)
+
+    def setUp(self):
+        super(TestDeduplicatedReplay, self).setUp()
+        set_blob_storage(True)
+        self.addCleanup(set_blob_storage, False)
+        self.addCleanup(forget_blob_store, os.path.join(self.folder,
+            'testing'))
+        self.addCleanup(forget_blob_refs, os.path.join(self.folder,
+            'testing'))
+
+    def record(self, path, status_code=200):
+        app.config['load_origin'] = True
+        upstream = FakeUpstream([self.body], status_code=status_code,
+            headers={'Content-Type': 'application/json'})
+        with mock.patch('hulk.handler.stream_original') as stream_original:
+            with mock.patch('hulk.handler.record_file',
+                    wraps=hulk.handler.record_file) as record_file:
+                with mock.patch('hulk.utils.dataset_folder', self.folder):
+                    stream_original.return_value = upstream
+                    response = self.get('http://foo.com' + path)
+        app.config['load_origin'] = False
+        self.assertEqual(response.data, self.body)
+        return record_file.call_args[1]['digest']
+
+    def stored(self, path):
+        hashname, _ = build_filename(path, {})
+        with open(os.path.join(self.folder, 'testing', 'foo.com', hashname),
+                'rb') as stored:
+            return split_envelope(stored.read())[1]
+
+    def test_load_origin_should_store_identical_bodies_once(self):
+        first = self.record('/first')
+        self.assertEqual(self.record('/second'), first)
+        self.assertEqual(read_ref(self.stored('/first')), first)
+        self.assertEqual(read_ref(self.stored('/second')), first)
+        self.assertEqual(len(list(get_blob_store(os.path.join(self.folder,
+            'testing')).blobs())), 1)
+
+    def test_should_replay_the_blob_with_the_stored_envelope(self):
+        self.record('/first')
+        self.record('/second', status_code=410)
+        hulk.handler.hot_cache.clear()
+
+        response = self.get('http://foo.com/first')
+        self.assertEqual(response.data, self.body)
+        self.assertEqual(response.headers['Content-Type'], 'application/json')
+        response = self.get('http://foo.com/second')
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.data, self.body)
+
+    def test_should_serve_blobs_without_reading_the_response_files(self):
+        self.record('/first')
+        self.record('/second', status_code=410)
+        folder = os.path.join(self.folder, 'testing')
+        forget_blob_refs(folder)
+        self.assertEqual(len(get_blob_refs(folder)), 2)
+        hulk.handler.hot_cache.clear()
+
+        with mock.patch('hulk.handler.serve_saved') as serve_saved:
+            response = self.get('http://foo.com/second')
+            self.assertFalse(serve_saved.called)
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.headers['Content-Type'], 'application/json')
+        self.assertEqual(response.data, self.body)
+
+    def test_should_stream_large_and_compressed_blobs(self):
+        set_storage_codec('gzip')
+        self.addCleanup(set_storage_codec, None)
+        self.record('/first')
+        hulk.handler.hot_cache.clear()
+        folder = os.path.join(self.folder, 'testing')
+        get_blob_store(folder).cache.max_entry_bytes = 4
+
+        self.assertEqual(self.get('http://foo.com/first').data, self.body)
+        response = self.get('http://foo.com/first',
+            headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(decode('HULKGZ01' + response.data, None), self.body)
+
+    def test_should_serve_packed_refs(self):
+        self.record('/first')
+        folder = os.path.join(self.folder, 'testing')
+        pack_dataset(folder, prune=True)
+        self.addCleanup(forget_pack, folder)
+        hulk.handler.hot_cache.clear()
+        self.assertEqual(self.get('http://foo.com/first').data, self.body)
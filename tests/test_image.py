@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import mock
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from hulk.image import build_image, forget_image, get_image
+from hulk.pack import PackedDataset, forget_pack, pack_dataset
+
+
+def build_in_child(folder, base_folder, paths):
+    paths.put(build_image(folder, base_folder))
+
+
+class TestImage(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.dataset = os.path.join(self.folder, 'testing')
+        self.images = os.path.join(self.folder, 'images')
+
+        patcher = mock.patch('hulk.image.image_folder', self.images)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(forget_image, self.dataset)
+
+    def write(self, hashname, content, hostname='foo.com'):
+        folder = os.path.join(self.dataset, hostname)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, hashname), 'w') as fixture:
+            fixture.write(content)
+
+    def test_should_hold_loose_and_packed_responses(self):
+        self.write('packed', 'old')
+        pack_dataset(self.dataset, prune=True)
+        self.addCleanup(forget_pack, self.dataset)
+        self.write('loose', 'loose', hostname='bar.com')
+
+        image = get_image(self.dataset)
+        self.assertEqual(len(image), 2)
+        self.assertEqual(str(image.get('foo.com', 'packed')), 'old')
+        self.assertEqual(str(image.get('bar.com', 'loose')), 'loose')
+        self.assertIs(get_image(self.dataset), image)
+
+    def test_packed_responses_should_win_over_loose_ones(self):
+        self.write('both', 'packed')
+        pack_dataset(self.dataset, prune=True)
+        self.addCleanup(forget_pack, self.dataset)
+        self.write('both', 'loose')
+
+        # the same response the dataset is served without an image
+        pack = PackedDataset(self.dataset)
+        self.addCleanup(pack.close)
+        self.assertEqual(str(pack.get('foo.com', 'both')), 'packed')
+        image = get_image(self.dataset)
+        self.assertEqual(len(image), 1)
+        self.assertEqual(str(image.get('foo.com', 'both')), 'packed')
+
+    def test_should_reuse_an_image_until_the_dataset_changes(self):
+        self.write('a', 'a')
+        path = build_image(self.dataset)
+        self.assertEqual(build_image(self.dataset), path)
+
+        # directory mtimes have a coarse resolution on some filesystems
+        time.sleep(0.01)
+        self.write('b', 'b')
+        os.utime(os.path.join(self.dataset, 'foo.com'),
+            (time.time() + 1, time.time() + 1))
+        rebuilt = build_image(self.dataset)
+        self.assertNotEqual(rebuilt, path)
+        self.assertFalse(os.path.exists(path))
+        self.assertIn(('foo.com', 'b'), PackedDataset(rebuilt))
+
+    def test_should_have_no_image_without_a_dataset(self):
+        self.assertIsNone(get_image(self.dataset))
+
+    def test_processes_should_share_one_image(self):
+        for i in range(50):
+            self.write('hash{}'.format(i), 'x' * 1000)
+        paths = multiprocessing.Queue()
+        children = [multiprocessing.Process(target=build_in_child,
+            args=(self.dataset, self.images, paths)) for _ in range(4)]
+        for child in children:
+            child.start()
+        for child in children:
+            child.join()
+
+        self.assertEqual(len(set(paths.get() for _ in children)), 1)
+        self.assertEqual(len([name for name in os.listdir(self.images)
+            if not name.endswith('.lock')]), 1)
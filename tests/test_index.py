@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from hulk.index import DatasetIndex, get_index, forget_index
+
+
+class TestDatasetIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def write(self, hostname, hashname):
+        folder = os.path.join(self.folder, hostname)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, hashname), 'w') as f:
+            f.write('bibble')
+
+    def test_should_index_loose_files(self):
+        self.write('foo.com', 'asdf')
+        self.write('bar.com', 'qwer')
+        self.write('bar.com', 'zxcv.123-456.tmp')
+        os.makedirs(os.path.join(self.folder, 'empty.com'))
+        with open(os.path.join(self.folder, 'dataset.jsonl'), 'w'):
+            pass
+
+        index = DatasetIndex(self.folder)
+        self.assertEqual(len(index), 2)
+        self.assertIn(('foo.com', 'asdf'), index)
+        self.assertIn(('bar.com', 'qwer'), index)
+        self.assertNotIn(('bar.com', 'asdf'), index)
+        self.assertTrue(index.has_host('empty.com'))
+        self.assertFalse(index.has_host('dataset.jsonl'))
+
+    def test_should_answer_hits_and_misses_without_touching_the_disk(self):
+        self.write('foo.com', 'asdf')
+        index = DatasetIndex(self.folder)
+        with mock.patch('os.listdir') as listdir:
+            with mock.patch('os.stat') as stat:
+                self.assertIn(('foo.com', 'asdf'), index)
+                self.assertNotIn(('foo.com', 'nope'), index)
+                self.assertNotIn(('new.com', 'nope'), index)
+                self.assertFalse(listdir.called)
+                self.assertFalse(stat.called)
+
+    def test_missing_dataset_should_be_empty(self):
+        index = DatasetIndex(os.path.join(self.folder, 'nope'))
+        self.assertEqual(len(index), 0)
+        index.add('foo.com', 'asdf')
+        self.assertIn(('foo.com', 'asdf'), index)
+
+    def test_should_add_and_discard_recordings(self):
+        index = DatasetIndex(self.folder)
+        index.add('foo.com', 'asdf')
+        self.assertIn(('foo.com', 'asdf'), index)
+        index.discard('foo.com', 'asdf')
+        self.assertNotIn(('foo.com', 'asdf'), index)
+
+    def test_miss_should_relist_the_host_once_the_refresh_interval_passes(self):
+        index = DatasetIndex(self.folder, refresh_after=0)
+        self.write('foo.com', 'asdf')
+        self.assertIn(('foo.com', 'asdf'), index)
+
+    def test_miss_should_not_relist_within_the_refresh_interval(self):
+        index = DatasetIndex(self.folder, refresh_after=60)
+        self.write('foo.com', 'asdf')
+        self.assertNotIn(('foo.com', 'asdf'), index)
+
+    def test_should_keep_one_index_per_folder(self):
+        self.addCleanup(forget_index, self.folder)
+        self.assertIs(get_index(self.folder), get_index(self.folder))
+        first = get_index(self.folder)
+        forget_index(self.folder)
+        self.assertIsNot(get_index(self.folder), first)
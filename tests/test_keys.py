@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import md5
+import mock
+import unittest
+import urllib
+
+from werkzeug.datastructures import CombinedMultiDict, MultiDict
+from hulk.keys import KeyEngine, engine_from_environment, is_json, xxhash
+
+
+def legacy_filename(path, vals):
+    """The key hulk built before the key engine.
+    """
+    values = {}
+    if vals:
+        values.update((k, v) for k, v in vals.iteritems() if v is not None)
+        values = collections.OrderedDict(sorted(values.items()))
+    name = path
+    if values:
+        name += '?' + urllib.urlencode(values)
+    return md5.new(name).hexdigest(), name
+
+
+class TestKeyEngine(unittest.TestCase):
+
+    def test_single_valued_keys_should_match_legacy_keys(self):
+        engine = KeyEngine()
+        for path, vals in [
+                ('/a', {}), ('/a', None), ('/a', {'b': '1', 'a': 'x y'}),
+                ('/a', {'n': 3, 'skip': None}), (u'/a', {u'q': u'caf'})]:
+            self.assertEqual(engine.key(path, vals),
+                legacy_filename(path, vals))
+
+    def test_should_keep_every_value_of_repeated_params(self):
+        engine = KeyEngine()
+        values = CombinedMultiDict([MultiDict([('b', '2'), ('a', '1')]),
+            MultiDict([('a', '3')])])
+        self.assertEqual(engine.key('/x', values)[1], '/x?a=1&a=3&b=2')
+        self.assertEqual(engine.key('/x', {'a': ['1', '3'], 'b': '2'}),
+            engine.key('/x', values))
+        self.assertEqual(engine.key('/x', [('b', '2'), ('a', '1'),
+            ('a', '3')]), engine.key('/x', values))
+
+    def test_should_canonicalize_json_bodies_when_enabled(self):
+        engine = KeyEngine(json_body=True)
+        first = engine.key('/x', {}, body='{"b": 1, "a": [1, 2]}')
+        self.assertEqual(first[1], '/x#json={"a":[1,2],"b":1}')
+        self.assertEqual(first, engine.key('/x', {}, body='{"a":[1,2],"b":1}'))
+        self.assertEqual(engine.key('/x', {}, body='not json'),
+            engine.key('/x', {}))
+
+    def test_should_ignore_bodies_and_headers_by_default(self):
+        engine = KeyEngine()
+        self.assertEqual(engine.key('/x', {}, body='{"a": 1}',
+            headers={'Accept': 'text/html'}), engine.key('/x', {}))
+
+    def test_should_include_selected_headers(self):
+        engine = KeyEngine(headers=['Accept'])
+        key = engine.key('/x', {}, headers={'ACCEPT': 'text/html',
+            'Cookie': 'nope'})
+        self.assertEqual(key[1], '/x#headers=accept=text%2Fhtml')
+        self.assertNotEqual(key, engine.key('/x', {},
+            headers={'accept': 'application/json'}))
+
+    @unittest.skipIf(xxhash is None, 'xxhash is not installed')
+    def test_should_hash_with_xxh64(self):
+        hashed, name = KeyEngine(hash_name='xxh64').key('/x', {'a': '1'})
+        self.assertEqual(name, '/x?a=1')
+        self.assertEqual(hashed, xxhash.xxh64(name).hexdigest())
+
+    def test_should_refuse_unknown_hashes(self):
+        self.assertRaises(ValueError, KeyEngine, hash_name='crc32')
+
+    def test_should_tell_json_content_types(self):
+        for content_type in ('application/json',
+                'application/json; charset=utf-8', 'application/vnd.api+json',
+                'Application/JSON'):
+            self.assertTrue(is_json(content_type), content_type)
+        for content_type in ('', None, 'text/json', 'text/plain',
+                'application/x-www-form-urlencoded'):
+            self.assertFalse(is_json(content_type), content_type)
+
+    def test_should_memoize_keys(self):
+        engine = KeyEngine()
+        first = engine.key('/x', {'a': '1'})
+        with mock.patch.object(engine, 'build') as build:
+            self.assertEqual(engine.key('/x', {'a': '1'}), first)
+            self.assertFalse(build.called)
+
+    def test_memo_should_tell_equal_values_of_different_types_apart(self):
+        engine = KeyEngine()
+        self.assertEqual(engine.key('/x', {'a': 1})[1], '/x?a=1')
+        self.assertEqual(engine.key('/x', {'a': True})[1], '/x?a=True')
+        self.assertEqual(engine.key('/x', MultiDict([('a', 1)]))[1],
+            '/x?a=1')
+        self.assertEqual(engine.key('/x', MultiDict([('a', True)]))[1],
+            '/x?a=True')
+        self.assertEqual(engine.key('/x', MultiDict([('a', 1.0)]))[1],
+            '/x?a=1.0')
+
+    def test_memo_should_keep_the_order_of_repeated_params(self):
+        engine = KeyEngine()
+        first = engine.key('/a', [('a', '1'), ('b', '3'), ('a', '2')])
+        second = engine.key('/a', [('a', '2'), ('a', '1')])
+        self.assertEqual(first[1], '/a?a=1&a=2&b=3')
+        self.assertEqual(second[1], '/a?a=2&a=1')
+        self.assertEqual(second, KeyEngine().key('/a', [('a', '2'),
+            ('a', '1')]))
+        self.assertEqual(engine.key('/a', [('b', '3'), ('a', '1'),
+            ('a', '2')]), first)
+
+    def test_should_not_memoize_unhashable_values(self):
+        engine = KeyEngine()
+        self.assertEqual(engine.key('/x', {'a': {}})[1], '/x?a=%7B%7D')
+        self.assertEqual(len(engine.memo), 0)
+
+    def test_should_empty_a_full_memo(self):
+        engine = KeyEngine(memo_size=2)
+        for i in range(3):
+            engine.key('/x', {'a': str(i)})
+        self.assertEqual(len(engine.memo), 1)
+
+    def test_should_configure_from_the_environment(self):
+        engine = engine_from_environment({'HULK_KEY_HEADERS': 'Accept, X-Foo',
+            'HULK_KEY_JSON_BODY': '1'})
+        self.assertEqual(engine.hash_name, 'md5')
+        self.assertEqual(engine.headers, ('accept', 'x-foo'))
+        self.assertTrue(engine.json_body)
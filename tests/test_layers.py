@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from hulk.index import forget_index, get_index
+from hulk.layers import DatasetStack, LAYERS_FILENAME, resolve_layers
+from hulk.pack import forget_pack, pack_dataset
+
+
+class LayersTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def make_dataset(self, name, parents=(), fixtures=()):
+        folder = os.path.join(self.folder, name)
+        os.makedirs(folder)
+        self.addCleanup(forget_index, folder)
+        if parents:
+            with open(os.path.join(folder, LAYERS_FILENAME), 'w') as config:
+                json.dump({'parents': list(parents)}, config)
+        for hashname, content in fixtures:
+            self.write_fixture(name, hashname, content)
+        return folder
+
+    def write_fixture(self, name, hashname, content, hostname='foo.com'):
+        folder = os.path.join(self.folder, name, hostname)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, hashname), 'w') as fixture:
+            fixture.write(content)
+
+
+class TestResolveLayers(LayersTestCase):
+
+    def test_should_list_the_dataset_then_its_parents_nearest_first(self):
+        self.make_dataset('default')
+        self.make_dataset('team', ['default'])
+        self.make_dataset('other', ['default'])
+        self.make_dataset('ticket', ['team', 'other'])
+        self.assertEqual([name for name, _ in resolve_layers(self.folder,
+            'ticket')], ['ticket', 'team', 'default', 'other'])
+
+    def test_should_refuse_loops(self):
+        self.make_dataset('a', ['b'])
+        self.make_dataset('b', ['a'])
+        with self.assertRaises(ValueError):
+            resolve_layers(self.folder, 'a')
+
+    def test_should_skip_missing_parents(self):
+        self.make_dataset('ticket', ['nope'])
+        self.assertEqual([name for name, _ in resolve_layers(self.folder,
+            'ticket')], ['ticket'])
+
+
+class TestDatasetStack(LayersTestCase):
+
+    def test_nearest_layer_should_win(self):
+        self.make_dataset('default', fixtures=[('a', '1'), ('b', '1')])
+        self.make_dataset('team', ['default'], fixtures=[('a', '2')])
+        self.make_dataset('ticket', ['team'])
+        stack = DatasetStack(self.folder, 'ticket')
+        self.assertEqual(stack.locate('foo.com', 'a').dataset, 'team')
+        self.assertEqual(stack.locate('foo.com', 'b').dataset, 'default')
+        self.assertIsNone(stack.locate('foo.com', 'c'))
+        self.assertIsNone(stack.locate('bar.com', 'a'))
+
+    def test_should_find_packed_responses(self):
+        folder = self.make_dataset('default', fixtures=[('a', '1')])
+        pack_dataset(folder, prune=True)
+        self.addCleanup(forget_pack, folder)
+        self.make_dataset('ticket', ['default'])
+        layer = DatasetStack(self.folder, 'ticket').locate('foo.com', 'a')
+        self.assertEqual((layer.dataset, layer.packed), ('default', True))
+
+    def test_should_see_responses_added_to_a_parent(self):
+        folder = self.make_dataset('default', fixtures=[('a', '1')])
+        self.make_dataset('ticket', ['default'])
+        stack = DatasetStack(self.folder, 'ticket')
+        versions = stack.versions()
+        self.assertIsNone(stack.locate('foo.com', 'b'))
+
+        self.write_fixture('default', 'b', '2')
+        get_index(folder).add('foo.com', 'b')
+        self.assertNotEqual(stack.versions(), versions)
+        self.assertEqual(stack.locate('foo.com', 'b').dataset, 'default')
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from hulk.locks import KeyLock
+
+
+class TestKeyLock(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_should_be_exclusive(self):
+        held = KeyLock(self.folder, 'foo.com', 'asdf')
+        self.assertTrue(held.acquire())
+        self.addCleanup(held.release)
+        self.assertFalse(KeyLock(self.folder, 'foo.com', 'asdf').acquire(
+            blocking=False))
+        other = KeyLock(self.folder, 'foo.com', 'other')
+        self.assertTrue(other.acquire(blocking=False))
+        other.release()
+
+    def test_release_should_remove_the_lock_file(self):
+        lock = KeyLock(self.folder, 'foo.com', 'asdf')
+        lock.acquire()
+        self.assertTrue(os.path.exists(lock.path))
+        lock.release()
+        self.assertFalse(os.path.exists(lock.path))
+        lock.release()
+
+    def test_waiters_should_get_the_lock_once_released(self):
+        held = KeyLock(self.folder, 'foo.com', 'asdf')
+        held.acquire()
+        order = []
+
+        def wait():
+            waiter = KeyLock(self.folder, 'foo.com', 'asdf')
+            waiter.acquire()
+            order.append('waiter')
+            waiter.release()
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        time.sleep(0.1)
+        order.append('holder')
+        held.release()
+        thread.join(5)
+        self.assertEqual(order, ['holder', 'waiter'])
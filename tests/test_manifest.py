@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import mock
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from hulk.manifest import append_record, compact_manifest, load_manifest, \
+    LOG_FILENAME, MANIFEST_FILENAME
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_should_load_legacy_snapshot_only_manifest(self):
+        with open(os.path.join(self.folder, MANIFEST_FILENAME), 'w') as f:
+            f.write('{"asdf": {"url": "http://foo", "content-type": "a/b"}}')
+        self.assertEqual(load_manifest(self.folder),
+            {'asdf': {'url': 'http://foo', 'content-type': 'a/b'}})
+
+    def test_should_load_empty_manifest(self):
+        self.assertEqual(load_manifest(self.folder), {})
+
+    def test_log_records_should_override_the_snapshot(self):
+        with open(os.path.join(self.folder, MANIFEST_FILENAME), 'w') as f:
+            f.write('{"asdf": {"url": "http://old", "content-type": "a/b"}}')
+        append_record(self.folder, 'asdf', 'a/b', 'http://new')
+        append_record(self.folder, 'qwer', 'c/d', 'http://other')
+
+        records = load_manifest(self.folder)
+        self.assertEqual(records['asdf']['url'], 'http://new')
+        self.assertEqual(records['qwer']['content-type'], 'c/d')
+
+    def test_should_skip_torn_lines(self):
+        append_record(self.folder, 'asdf', 'a/b', 'http://foo')
+        with open(os.path.join(self.folder, LOG_FILENAME), 'a') as f:
+            f.write('{"hash": "qw')
+        self.assertEqual(load_manifest(self.folder).keys(), ['asdf'])
+
+    def test_compaction_should_fold_the_log_into_the_snapshot(self):
+        append_record(self.folder, 'asdf', 'a/b', 'http://foo')
+        compact_manifest(self.folder)
+
+        self.assertEqual(
+            os.path.getsize(os.path.join(self.folder, LOG_FILENAME)), 0)
+        with open(os.path.join(self.folder, MANIFEST_FILENAME)) as f:
+            self.assertEqual(json.load(f),
+                {'asdf': {'url': 'http://foo', 'content-type': 'a/b'}})
+
+    def test_should_compact_periodically(self):
+        with mock.patch('hulk.manifest.COMPACT_EVERY', 3):
+            for i in range(4):
+                append_record(self.folder, 'h{}'.format(i), 'a/b', 'u')
+
+        with open(os.path.join(self.folder, MANIFEST_FILENAME)) as f:
+            self.assertEqual(sorted(json.load(f)), ['h0', 'h1', 'h2'])
+        self.assertEqual(len(load_manifest(self.folder)), 4)
+
+    def test_concurrent_recorders_should_not_lose_entries(self):
+        def record(n):
+            for i in range(50):
+                append_record(self.folder, '{}-{}'.format(n, i), 'a/b', 'u')
+
+        with mock.patch('hulk.manifest.COMPACT_EVERY', 40):
+            recorders = [threading.Thread(target=record, args=(n,))
+                for n in range(4)]
+            for thread in recorders:
+                thread.start()
+            for thread in recorders:
+                thread.join()
+
+        self.assertEqual(len(load_manifest(self.folder)), 200)
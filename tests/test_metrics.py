@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import hulk.handler
+from hulk.application import app
+from hulk.metrics import Counter, Histogram, Registry, Timing, \
+    metrics_response
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counters_should_count_per_label_values(self):
+        counter = Counter('hits_total', 'Hits', ['source'])
+        counter.inc(1, 'pack')
+        counter.inc(2, 'pack')
+        counter.inc(1, 'disk')
+        self.assertEqual(list(counter.samples()), [
+            ('hits_total', '{source="disk"}', 1),
+            ('hits_total', '{source="pack"}', 3)])
+
+    def test_histograms_should_have_cumulative_buckets(self):
+        histogram = Histogram('seconds', 'Time', buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 2.0):
+            histogram.observe(value)
+        samples = dict((name + labels, value)
+            for name, labels, value in histogram.samples())
+        self.assertEqual(samples['seconds_bucket{le="0.1"}'], 1)
+        self.assertEqual(samples['seconds_bucket{le="1.0"}'], 3)
+        self.assertEqual(samples['seconds_bucket{le="+Inf"}'], 4)
+        self.assertEqual(samples['seconds_count'], 4)
+        self.assertAlmostEqual(samples['seconds_sum'], 3.05)
+
+    def test_should_render_metrics_and_collectors(self):
+        registry = Registry()
+        registry.counter('hits_total', 'Hits', ['host']).inc(1, 'a"b')
+        registry.add_collector(lambda: [
+            ('entries', 'gauge', 'Entries', [({}, 7)])])
+        self.assertEqual(registry.render(), '\n'.join([
+            '# HELP hits_total Hits',
+            '# TYPE hits_total counter',
+            'hits_total{host="a\\"b"} 1',
+            '# HELP entries Entries',
+            '# TYPE entries gauge',
+            'entries 7']) + '\n')
+
+    def test_server_timing_should_list_phases_in_milliseconds(self):
+        timing = Timing()
+        timing.add('key', 0.0001)
+        timing.add('disk', 0.0025)
+        self.assertEqual(timing.header(0.003),
+            'key;dur=0.100, disk;dur=2.500, total;dur=3.000')
+
+    def test_endpoint_should_serve_the_text_format(self):
+        with app.test_request_context('/__hulk/metrics'):
+            response = metrics_response()
+        self.assertEqual(response.mimetype, 'text/plain')
+        self.assertIn('# TYPE hulk_requests_total counter',
+            response.get_data())
+        self.assertIn('hulk_hot_cache_entries', response.get_data())
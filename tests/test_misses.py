@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from hulk.misses import MissCache, MissingLog, MISSING_FILENAME, \
+    read_missing
+from hulk.recorder import load_requests
+
+
+class TestMissCache(unittest.TestCase):
+
+    def test_should_remember_misses_for_the_same_index_version(self):
+        cache = MissCache()
+        cache.add('a', 1, 'not here')
+        self.assertEqual(cache.get('a', 1), 'not here')
+        self.assertEqual(cache.hits, 1)
+
+        self.assertIsNone(cache.get('a', 2))
+        # and it's gone for good
+        self.assertIsNone(cache.get('a', 1))
+
+    def test_should_recheck_misses_after_a_while(self):
+        cache = MissCache(recheck_after=5)
+        with mock.patch('time.time', return_value=100):
+            cache.add('a', 1)
+        with mock.patch('time.time', return_value=104):
+            self.assertTrue(cache.get('a', 1))
+        with mock.patch('time.time', return_value=106):
+            self.assertIsNone(cache.get('a', 1))
+
+    def test_should_evict_least_recently_used_misses(self):
+        cache = MissCache(max_entries=2)
+        cache.add('a', 1)
+        cache.add('b', 1)
+        cache.get('a', 1)
+        cache.add('c', 1)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b', 1))
+        self.assertTrue(cache.get('a', 1))
+
+
+class TestMissingLog(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def test_should_count_distinct_requests(self):
+        log = MissingLog(self.folder, flush_after=60)
+        for _ in range(3):
+            log.add('foo.com', 'abc', 'GET', 'http://foo.com/a')
+        log.add('bar.com', 'abc', 'POST', 'http://bar.com/a',
+            'application/x-www-form-urlencoded', [('q', '1')])
+        self.assertEqual(read_missing(self.folder), {})
+
+        log.flush()
+        missing = read_missing(self.folder)
+        self.assertEqual(missing['foo.com/abc']['count'], 3)
+        self.assertEqual(missing['bar.com/abc']['form'], [['q', '1']])
+
+    def test_flushes_should_add_to_earlier_counts(self):
+        log = MissingLog(self.folder, flush_after=60)
+        log.add('foo.com', 'abc', 'GET', 'http://foo.com/a')
+        log.flush()
+        MissingLog(self.folder, flush_after=0).add('foo.com', 'abc', 'GET',
+            'http://foo.com/a')
+        self.assertEqual(read_missing(self.folder)['foo.com/abc']['count'], 2)
+
+    def test_should_be_recordable(self):
+        log = MissingLog(self.folder)
+        log.add('foo.com', 'abc', 'POST', 'http://foo.com/a?b=1',
+            'application/json', body='{"x": 1}', headers=[('accept', 'a/b')])
+        log.flush()
+
+        parsed = load_requests(os.path.join(self.folder, MISSING_FILENAME))
+        self.assertEqual([(r.method, r.url, r.body, r.content_type, r.headers)
+            for r in parsed], [('POST', 'http://foo.com/a?b=1', '{"x": 1}',
+                'application/json', [('accept', 'a/b')])])
+
+    def test_should_give_up_on_a_missing_folder(self):
+        log = MissingLog(os.path.join(self.folder, 'nope'))
+        log.add('foo.com', 'abc', 'GET', 'http://foo.com/a')
+        log.flush()
+        self.assertEqual(log.pending, {})
@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import mock
+import os
+import requests
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+from hulk.blobs import dedupe_dataset, forget_blob_store
+from hulk.image import forget_image
+from hulk.keys import KeyEngine
+from hulk.layers import LAYERS_FILENAME, forget_stack
+from hulk.misses import MissCache, forget_missing_log, read_missing
+from hulk.monkey import patched_request, current_dataset, use_dataset, \
+    with_dataset, set_dataset, reset_dataset, use_shared_image, \
+    use_missing_log, patch_requests
+from hulk.codec import compact_dataset
+from hulk.envelope import pack_head
+from hulk.pack import pack_dataset, forget_pack
+from hulk.preload import forget_snapshots, read_used
+from hulk.rules import RULES_FILENAME, forget_rules
+from hulk.utils import build_filename
+
+
+class MonkeyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+        for name, value in [
+                ('hulk.monkey.dataset_folder', self.folder),
+                ('hulk.monkey.DEFAULT_DATASET', 'testing'),
+                ('hulk.monkey.CURRENT_DATASET_FILENAME',
+                    os.path.join(self.folder, 'current_dataset.hulk')),
+                ('hulk.monkey.miss_cache', MissCache())]:
+            patcher = mock.patch(name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # with_dataset patches requests globally; undo that after each test
+        patcher = mock.patch.object(requests.Session, 'request',
+            requests.Session.__dict__['request'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.request = patched_request()
+        self.session = requests.Session()
+
+    def write_fixture(self, path, content, values=None, hostname='foo.com'):
+        hashname, _ = build_filename(path, values or {})
+        folder = os.path.join(self.folder, 'testing', hostname)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, hashname), 'w') as fixture:
+            fixture.write(content)
+
+
+class TestPatchedRequest(MonkeyTestCase):
+
+    def test_should_serve_existing_fixture(self):
+        self.write_fixture('/bar', 'bibble', {'a': '1'})
+        response = self.request(self.session, 'GET', 'http://foo.com/bar',
+            params={'a': '1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, 'bibble')
+
+    def test_should_return_417_on_missing_fixture(self):
+        response = self.request(self.session, 'GET', 'http://foo.com/nope')
+        self.assertEqual(response.status_code, 417)
+
+    def test_should_check_fixtures_in_the_index_not_on_disk(self):
+        self.write_fixture('/bar', 'bibble')
+        # otherwise requests itself looks for a .netrc
+        self.session.trust_env = False
+        self.request(self.session, 'GET', 'http://foo.com/bar')
+        with mock.patch('os.path.exists') as exists:
+            hit = self.request(self.session, 'GET', 'http://foo.com/bar')
+            miss = self.request(self.session, 'GET', 'http://foo.com/nope')
+            self.assertFalse(exists.called)
+        self.assertEqual(hit.status_code, 200)
+        self.assertEqual(miss.status_code, 417)
+
+    def test_repeated_misses_should_not_look_again(self):
+        self.request(self.session, 'GET', 'http://foo.com/nope')
+        with mock.patch('hulk.monkey.find_stored') as find_stored:
+            response = self.request(self.session, 'GET', 'http://foo.com/nope')
+            self.assertFalse(find_stored.called)
+        self.assertEqual(response.status_code, 417)
+        self.assertIn('could not be found', response.content)
+
+    def test_should_log_misses_when_asked_to(self):
+        folder = os.path.join(self.folder, 'testing')
+        os.makedirs(folder)
+        self.addCleanup(forget_missing_log, folder)
+        self.addCleanup(use_missing_log, False)
+        self.request(self.session, 'GET', 'http://foo.com/nope')
+        use_missing_log()
+        self.request(self.session, 'POST', 'http://foo.com/nope',
+            params={'a': '1'}, data={'q': 'civic'})
+        forget_missing_log(folder)
+
+        missing = read_missing(folder).values()
+        self.assertEqual([(record['method'], record['url'], record['form'],
+            record['content-type']) for record in missing],
+            [('POST', 'http://foo.com/nope?a=1', [['q', 'civic']],
+                'application/x-www-form-urlencoded')])
+
+    def test_should_key_on_the_url_query_and_repeated_params(self):
+        self.write_fixture('/bar', 'bibble',
+            [('a', '1'), ('b', '2'), ('b', '3')])
+        response = self.request(self.session, 'GET', 'http://foo.com/bar?a=1',
+            params={'b': ['2', '3']})
+        self.assertEqual(response.content, 'bibble')
+
+    def test_should_key_json_bodies_like_the_proxy(self):
+        self.write_fixture('/search', 'not keyed')
+        with mock.patch('hulk.keys.key_engine', KeyEngine(json_body=True)):
+            hashname, _ = build_filename('/search', {},
+                body='{"q": "civic"}')
+            with open(os.path.join(self.folder, 'testing', 'foo.com',
+                    hashname), 'w') as fixture:
+                fixture.write('keyed')
+
+            response = self.request(self.session, 'POST',
+                'http://foo.com/search', json={'q': 'civic'})
+            self.assertEqual(response.content, 'keyed')
+            response = self.request(self.session, 'POST',
+                'http://foo.com/search', data='{"q": "civic"}',
+                headers={'Content-Type': 'text/plain'})
+            self.assertEqual(response.content, 'not keyed')
+
+    def test_should_apply_the_datasets_matching_rules(self):
+        self.write_fixture('/bar', 'bibble', {'session': '*'})
+        folder = os.path.join(self.folder, 'testing')
+        with open(os.path.join(folder, RULES_FILENAME), 'w') as config:
+            config.write('{"rules": [{"wildcard_params": ["session"]}]}')
+        self.addCleanup(forget_rules, folder)
+        response = self.request(self.session, 'GET',
+            'http://foo.com/bar?session=abc')
+        self.assertEqual(response.content, 'bibble')
+
+    def test_should_decompress_compressed_fixtures(self):
+        self.write_fixture('/bar', 'bibble ' * 100)
+        compact_dataset(os.path.join(self.folder, 'testing'))
+        response = self.request(self.session, 'GET', 'http://foo.com/bar')
+        self.assertEqual(response.content, 'bibble ' * 100)
+
+    def test_should_replay_stored_status_and_headers(self):
+        self.write_fixture('/bar', pack_head(201, [
+            ('Content-Type', 'application/json; charset=latin-1'),
+            ('Set-Cookie', 'a=1'), ('Set-Cookie', 'b=2')]) + '{"a": 1}')
+        compact_dataset(os.path.join(self.folder, 'testing'))
+        response = self.request(self.session, 'GET', 'http://foo.com/bar')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'a': 1})
+        self.assertEqual(response.encoding, 'latin-1')
+        self.assertEqual(response.headers['set-cookie'], 'a=1, b=2')
+
+    def test_should_resolve_deduplicated_fixtures(self):
+        for path in ('/bar', '/baz'):
+            self.write_fixture(path, pack_head(200, [
+                ('Content-Type', 'text/plain')]) + 'bibble ' * 100)
+        folder = os.path.join(self.folder, 'testing')
+        compact_dataset(folder)
+        dedupe_dataset(folder)
+        self.addCleanup(forget_blob_store, folder)
+
+        for path in ('/bar', '/baz'):
+            response = self.request(self.session, 'GET',
+                'http://foo.com' + path)
+            self.assertEqual(response.headers['Content-Type'], 'text/plain')
+            self.assertEqual(response.content, 'bibble ' * 100)
+
+    def test_should_serve_fixture_from_pack(self):
+        self.write_fixture('/bar', 'packed bibble')
+        folder = os.path.join(self.folder, 'testing')
+        pack_dataset(folder, prune=True)
+        self.addCleanup(forget_pack, folder)
+
+        response = self.request(self.session, 'GET', 'http://foo.com/bar')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, 'packed bibble')
+
+
+class TestLayeredDatasets(MonkeyTestCase):
+
+    def test_should_serve_fixtures_from_parent_layers(self):
+        self.write_fixture('/bar', 'from default', hostname='foo.com')
+        os.rename(os.path.join(self.folder, 'testing'),
+            os.path.join(self.folder, 'default'))
+        self.write_fixture('/baz', 'from testing')
+        with open(os.path.join(self.folder, 'testing', LAYERS_FILENAME),
+                'w') as config:
+            config.write('{"parents": ["default"]}')
+        self.addCleanup(forget_stack, self.folder, 'testing')
+
+        for path, content in [('/bar', 'from default'),
+                ('/baz', 'from testing')]:
+            response = self.request(self.session, 'GET',
+                'http://foo.com' + path)
+            self.assertEqual(response.content, content)
+        self.assertEqual(self.request(self.session, 'GET',
+            'http://foo.com/nope').status_code, 417)
+
+
+class TestSharedImage(MonkeyTestCase):
+
+    def setUp(self):
+        super(TestSharedImage, self).setUp()
+        patcher = mock.patch('hulk.image.image_folder',
+            os.path.join(self.folder, 'images'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        use_shared_image()
+        self.addCleanup(use_shared_image, False)
+        self.addCleanup(forget_image, os.path.join(self.folder, 'testing'))
+
+    def test_should_serve_fixtures_from_the_image(self):
+        self.write_fixture('/bar', pack_head(200, [
+            ('Content-Type', 'text/plain')]) + 'bibble ' * 100)
+        compact_dataset(os.path.join(self.folder, 'testing'))
+
+        with mock.patch('hulk.monkey.open', create=True) as opened:
+            response = self.request(self.session, 'GET', 'http://foo.com/bar')
+            self.assertFalse(opened.called)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Type'], 'text/plain')
+        self.assertEqual(response.content, 'bibble ' * 100)
+        self.assertEqual(list(response.iter_content(7))[0], 'bibble ')
+
+    def test_should_return_417_on_missing_fixture_or_dataset(self):
+        self.write_fixture('/bar', 'bibble')
+        self.assertEqual(self.request(self.session, 'GET',
+            'http://foo.com/nope').status_code, 417)
+        with use_dataset('absent'):
+            self.assertEqual(self.request(self.session, 'GET',
+                'http://foo.com/bar').status_code, 417)
+        forget_image(os.path.join(self.folder, 'absent'))
+
+
+class TestPreloadedDataset(MonkeyTestCase):
+
+    def setUp(self):
+        super(TestPreloadedDataset, self).setUp()
+        self.dataset = os.path.join(self.folder, 'testing')
+        self.addCleanup(forget_snapshots, self.dataset)
+        self.write_fixture('/bar', 'bibble')
+        self.write_fixture('/baz', 'unused')
+
+    def test_should_serve_fixtures_from_memory_and_report_them(self):
+        @with_dataset('testing', print_on_call=False, preload=True)
+        def fetch(path):
+            return self.session.get('http://foo.com' + path)
+
+        with mock.patch('hulk.monkey.open', create=True) as opened:
+            self.assertEqual(fetch('/bar').content, 'bibble')
+            self.assertEqual(fetch('/nope').status_code, 417)
+            self.assertFalse(opened.called)
+        hashname = build_filename('/bar', {})[0]
+        self.assertEqual(read_used(self.dataset), {
+            'foo.com/' + hashname: [__name__ + '.fetch']})
+
+    def test_test_classes_should_report_after_tear_down_class(self):
+        session = self.session
+        torn_down = []
+
+        @with_dataset('testing', preload=True)
+        class PreloadedTest(unittest.TestCase):
+
+            @classmethod
+            def tearDownClass(cls):
+                torn_down.append(read_used(self.dataset))
+
+            def test_bar(self):
+                self.assertEqual(session.get('http://foo.com/bar').content,
+                    'bibble')
+
+            def test_bar_again(self):
+                self.test_bar()
+
+        result = unittest.TestResult()
+        with mock.patch('sys.stdout'):
+            unittest.TestLoader().loadTestsFromTestCase(PreloadedTest).run(
+                result)
+        self.assertTrue(result.wasSuccessful(), result.errors)
+        self.assertEqual(torn_down, [{}])
+        used = read_used(self.dataset)
+        self.assertEqual(used.values(), [[__name__ + '.PreloadedTest']])
+
+
+class TestDatasetSelection(MonkeyTestCase):
+
+    def setUp(self):
+        super(TestDatasetSelection, self).setUp()
+        self.write_fixture('/bar', 'from testing')
+        folder = os.path.join(self.folder, 'other', 'foo.com')
+        os.makedirs(folder)
+        with open(os.path.join(folder, build_filename('/bar', {})[0]),
+                'w') as fixture:
+            fixture.write('from other')
+
+    def fetch(self):
+        return self.request(self.session, 'GET', 'http://foo.com/bar').content
+
+    def test_should_use_default_dataset(self):
+        self.assertEqual(current_dataset(), 'testing')
+        self.assertEqual(self.fetch(), 'from testing')
+
+    def test_use_dataset_should_nest(self):
+        with use_dataset('other'):
+            self.assertEqual(self.fetch(), 'from other')
+            with use_dataset('testing'):
+                self.assertEqual(self.fetch(), 'from testing')
+            self.assertEqual(self.fetch(), 'from other')
+        self.assertEqual(current_dataset(), 'testing')
+
+    def test_method_decorator_should_fall_back_to_class_decorator(self):
+        seen = []
+
+        @with_dataset('other', print_on_call=False)
+        def outer():
+            seen.append(current_dataset())
+            inner()
+            seen.append(current_dataset())
+
+        @with_dataset('nested', print_on_call=False)
+        def inner():
+            seen.append(current_dataset())
+
+        outer()
+        self.assertEqual(seen, ['other', 'nested', 'other'])
+
+    def test_patching_should_be_done_once(self):
+        patch_requests()
+        patched = requests.Session.__dict__['request']
+        with mock.patch('hulk.monkey.patched_request') as patched_request:
+            patch_requests()
+            with_dataset('other', print_on_call=False)
+            self.assertFalse(patched_request.called)
+        self.assertIs(requests.Session.__dict__['request'], patched)
+
+    def test_patching_should_be_put_back_if_undone(self):
+        patch_requests()
+        patched = requests.Session.__dict__['request']
+        with mock.patch.object(requests.Session, 'request', lambda *a: None):
+            patch_requests()
+            self.assertIs(requests.Session.__dict__['request'], patched)
+
+    def test_importing_should_not_load_flask(self):
+        loaded = subprocess.check_output([sys.executable, '-c',
+            'import sys, hulk.monkey; print "flask" in sys.modules'])
+        self.assertEqual(loaded.strip(), 'False')
+
+    def test_threads_without_a_dataset_should_see_the_active_one(self):
+        seen = []
+        with use_dataset('other'):
+            thread = threading.Thread(
+                target=lambda: seen.append(current_dataset()))
+            thread.start()
+            thread.join()
+        self.assertEqual(seen, ['other'])
+
+    def test_should_not_touch_the_shared_file_by_default(self):
+        with mock.patch('hulk.monkey.flock') as mock_flock:
+            with mock.patch('hulk.monkey.read_shared_dataset') as read:
+                with use_dataset('other'):
+                    self.fetch()
+                self.fetch()
+                self.assertFalse(mock_flock.called)
+                self.assertFalse(read.called)
+
+    def test_shared_file_should_only_be_reread_when_changed(self):
+        with mock.patch('hulk.monkey.USE_SHARED_DATASET_FILE', True):
+            set_dataset('other', print_on_call=False)
+            self.addCleanup(reset_dataset)
+            # forget the process-wide selection, as another process would
+            with mock.patch('hulk.monkey._selected', None):
+                self.assertEqual(self.fetch(), 'from other')
+                with mock.patch('hulk.monkey.flock') as mock_flock:
+                    self.assertEqual(current_dataset(), 'other')
+                    self.assertFalse(mock_flock.called)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import BaseHTTPServer
+import SocketServer
+import threading
+import time
+import unittest
+
+import requests
+
+from hulk.origin import OriginPool
+
+
+class StandInOriginHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # keep-alive, so connections can be reused
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(0.5)
+        if self.path == '/flaky':
+            self.server.flaky_calls += 1
+            if self.server.flaky_calls == 1:
+                return self.respond(503, 'try again')
+        self.respond(200, 'origin says {}'.format(self.path))
+
+    def respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInOrigin(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    flaky_calls = 0
+
+
+class TestOriginPool(unittest.TestCase):
+
+    def setUp(self):
+        self.origin = StandInOrigin(('127.0.0.1', 0), StandInOriginHandler)
+        thread = threading.Thread(target=self.origin.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.origin.server_close)
+        self.addCleanup(self.origin.shutdown)
+
+        self.host = '127.0.0.1:{}'.format(self.origin.server_address[1])
+        self.pool = OriginPool(pool_size=2, timeout=5, retries=2)
+        self.addCleanup(self.pool.close)
+
+    def url(self, path):
+        return 'http://{}{}'.format(self.host, path)
+
+    def test_should_fetch_from_the_origin(self):
+        response = self.pool.request('GET', self.url('/foo'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, 'origin says /foo')
+
+    def test_should_reuse_connections_to_the_same_host(self):
+        for i in range(5):
+            self.pool.request('GET', self.url('/foo/{}'.format(i))).content
+
+        stats = self.pool.stats()[self.host]
+        self.assertEqual(stats['fetches'], 5)
+        self.assertEqual(stats['connections'], 1)
+        self.assertEqual(stats['reused'], 4)
+        self.assertGreater(stats['avg_ms'], 0)
+
+    def test_should_share_one_session_per_host(self):
+        self.assertIs(self.pool.session_for(self.host),
+            self.pool.session_for(self.host))
+        self.assertIsNot(self.pool.session_for(self.host),
+            self.pool.session_for('other.host'))
+
+    def test_should_retry_unavailable_origin(self):
+        response = self.pool.request('GET', self.url('/flaky'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.origin.flaky_calls, 2)
+
+    def test_should_time_out_and_count_errors(self):
+        pool = OriginPool(timeout=0.1, retries=0)
+        self.addCleanup(pool.close)
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            pool.request('GET', self.url('/slow'))
+        self.assertEqual(pool.stats()[self.host]['errors'], 1)
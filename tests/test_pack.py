@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from hulk.pack import PackedDataset, get_pack, forget_pack, pack_dataset, \
+    unpack_dataset, INDEX_FILENAME, PACK_FILENAME
+
+
+class TestPackDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.addCleanup(forget_pack, self.folder)
+        for hostname in ('foo.com', 'bar.com:8080'):
+            for i in range(3):
+                self.write(hostname, 'hash{}'.format(i),
+                    '{} body {}'.format(hostname, i))
+
+    def write(self, hostname, hashname, content):
+        host_folder = os.path.join(self.folder, hostname)
+        if not os.path.isdir(host_folder):
+            os.makedirs(host_folder)
+        with open(os.path.join(host_folder, hashname), 'w') as f:
+            f.write(content)
+
+    def test_should_pack_every_loose_file(self):
+        self.assertEqual(pack_dataset(self.folder), 6)
+        pack = PackedDataset(self.folder)
+        self.assertEqual(len(pack), 6)
+        self.assertEqual(str(pack.get('bar.com:8080', 'hash2')),
+            'bar.com:8080 body 2')
+        self.assertIsNone(pack.get('foo.com', 'nope'))
+        self.assertIn(('foo.com', 'hash0'), pack)
+
+    def test_lookups_should_return_zero_copy_buffers(self):
+        pack_dataset(self.folder)
+        self.assertIsInstance(get_pack(self.folder).get('foo.com', 'hash1'),
+            buffer)
+
+    def test_repacking_should_only_append_changed_files(self):
+        pack_dataset(self.folder)
+        size = os.path.getsize(os.path.join(self.folder, PACK_FILENAME))
+        self.assertEqual(pack_dataset(self.folder), 0)
+        self.assertEqual(
+            os.path.getsize(os.path.join(self.folder, PACK_FILENAME)), size)
+
+        self.write('foo.com', 'hash1', 'changed')
+        self.assertEqual(pack_dataset(self.folder), 1)
+        pack = get_pack(self.folder)
+        self.assertEqual(len(pack), 6)
+        self.assertEqual(str(pack.get('foo.com', 'hash1')), 'changed')
+
+    def test_prune_should_remove_loose_files(self):
+        pack_dataset(self.folder, prune=True)
+        self.assertEqual(sorted(os.listdir(self.folder)),
+            [INDEX_FILENAME, PACK_FILENAME])
+
+    def test_prune_should_leave_other_empty_folders(self):
+        for name in ('.blobs', '.locks', 'empty.com'):
+            os.makedirs(os.path.join(self.folder, name))
+        pack_dataset(self.folder, prune=True)
+        self.assertEqual(sorted(os.listdir(self.folder)),
+            ['.blobs', '.locks', INDEX_FILENAME, PACK_FILENAME, 'empty.com'])
+
+    def test_unpack_should_restore_loose_files(self):
+        pack_dataset(self.folder, prune=True)
+        self.assertEqual(unpack_dataset(self.folder), 6)
+        self.assertEqual(sorted(os.listdir(self.folder)),
+            ['bar.com:8080', 'foo.com'])
+        with open(os.path.join(self.folder, 'foo.com', 'hash2')) as f:
+            self.assertEqual(f.read(), 'foo.com body 2')
+
+    def test_get_pack_should_return_none_for_loose_datasets(self):
+        self.assertIsNone(get_pack(self.folder))
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from hulk.index import forget_index
+from hulk.pack import forget_pack, pack_dataset
+from hulk.preload import Snapshot, Usage, read_used, unused_fixtures
+
+
+class PreloadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.addCleanup(forget_index, self.folder)
+
+    def write(self, hostname, hashname, content):
+        folder = os.path.join(self.folder, hostname)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, hashname), 'wb') as f:
+            f.write(content)
+
+
+class TestSnapshot(PreloadTestCase):
+
+    def test_should_hold_every_loose_and_packed_response(self):
+        self.write('foo.com', 'a', 'packed')
+        pack_dataset(self.folder, prune=True)
+        self.addCleanup(forget_pack, self.folder)
+        self.write('foo.com', 'b', 'loose')
+        forget_index(self.folder)
+
+        snapshot = Snapshot(self.folder)
+        self.assertEqual(str(snapshot.responses[('foo.com', 'a')]), 'packed')
+        self.assertEqual(snapshot.responses[('foo.com', 'b')], 'loose')
+        self.assertTrue(snapshot.covers('foo.com'))
+
+    def test_should_only_load_the_hostnames_asked_for(self):
+        self.write('foo.com', 'a', '1')
+        self.write('bar.com', 'b', '2')
+        snapshot = Snapshot(self.folder, hostnames=['foo.com'])
+        self.assertEqual(snapshot.responses.keys(), [('foo.com', 'a')])
+        self.assertTrue(snapshot.covers('foo.com'))
+        self.assertFalse(snapshot.covers('bar.com'))
+
+    def test_should_stop_at_the_memory_limit(self):
+        for hashname in 'abc':
+            self.write('foo.com', hashname, 'x' * 10)
+        snapshot = Snapshot(self.folder, max_bytes=25)
+        self.assertEqual(len(snapshot.responses), 2)
+        self.assertEqual(snapshot.loaded_bytes, 20)
+        self.assertFalse(snapshot.covers('foo.com'))
+
+
+class TestUsage(PreloadTestCase):
+
+    def test_should_report_the_fixtures_used(self):
+        self.write('foo.com', 'a', '1')
+        self.write('foo.com', 'b', '2')
+        self.write('foo.com', 'c', '3')
+        snapshot = Snapshot(self.folder)
+
+        first = Usage(snapshot, 'tests.FirstTest')
+        self.assertEqual(first.get('foo.com', 'a'), '1')
+        self.assertIsNone(first.get('foo.com', 'nope'))
+        first.report()
+        second = Usage(snapshot, 'tests.SecondTest')
+        second.get('foo.com', 'a')
+        second.get('foo.com', 'b')
+        second.report()
+
+        self.assertEqual(read_used(self.folder), {
+            'foo.com/a': ['tests.FirstTest', 'tests.SecondTest'],
+            'foo.com/b': ['tests.SecondTest']})
+        self.assertEqual(unused_fixtures(self.folder), [('foo.com', 'c')])
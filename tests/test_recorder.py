@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import BaseHTTPServer
+import json
+import mock
+import os
+import shutil
+import SocketServer
+import tempfile
+import threading
+import time
+import unittest
+
+from flask import request
+from hulk.application import app
+from hulk.cache import HotCache
+from hulk.envelope import read_envelope
+from hulk.handler import handle_request
+from hulk.index import forget_index
+from hulk.layers import LAYERS_FILENAME, forget_stack
+from hulk.manifest import compact_manifest, load_manifest
+from hulk.rules import RULES_FILENAME, forget_rules
+from hulk.recorder import Recorder, RateLimiter, load_requests, \
+    requests_from_har, requests_from_url_list
+from hulk.utils import record_file
+
+
+class EchoOriginHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path.startswith('/missing'):
+            return self.respond(404, 'nope')
+        if self.path.startswith('/moved'):
+            return self.respond(301, 'moved', [('Location', '/a')])
+        if self.path.startswith('/broken'):
+            return self.respond(503, 'try again')
+        self.respond(200, 'GET {}'.format(self.path))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.respond(200, 'POST {} {}'.format(self.path, body))
+
+    def respond(self, status, body, headers=()):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-Echo', self.command)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class EchoOrigin(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestLoadRequests(unittest.TestCase):
+
+    def test_should_parse_url_lists(self):
+        parsed = list(requests_from_url_list([
+            '# comment', '', 'http://foo.com/a?b=1', 'post http://foo.com/c']))
+        self.assertEqual([(r.method, r.url) for r in parsed],
+            [('GET', 'http://foo.com/a?b=1'), ('POST', 'http://foo.com/c')])
+
+    def test_should_load_recorded_manifests(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        os.makedirs(os.path.join(folder, 'testing'))
+        with mock.patch('hulk.utils.dataset_folder', folder):
+            record_file('testing', 'a', 'text/foo', 'foo.com/a?b=1')
+            record_file('testing', 'b', 'text/plain', 'foo.com/b')
+        compact_manifest(os.path.join(folder, 'testing'))
+        with mock.patch('hulk.utils.dataset_folder', folder):
+            record_file('testing', 'c', 'text/plain', 'foo.com/c')
+
+        dataset = os.path.join(folder, 'testing')
+        for path in (dataset, os.path.join(dataset, 'dataset.json'),
+                os.path.join(dataset, 'dataset.jsonl')):
+            parsed = load_requests(path)
+            self.assertEqual([(r.method, r.url) for r in parsed], [
+                ('GET', 'http://foo.com/a?b=1'), ('GET', 'http://foo.com/b'),
+                ('GET', 'http://foo.com/c')])
+            self.assertEqual(parsed[0].content_type, 'text/foo')
+
+    def test_should_parse_har_form_posts(self):
+        har = {'log': {'entries': [{'request': {
+            'method': 'POST', 'url': 'http://foo.com/a',
+            'postData': {
+                'mimeType': 'application/x-www-form-urlencoded; charset=UTF-8',
+                'text': 'x=1&y=2&x=3'}}}]}}
+        parsed = list(requests_from_har(har))
+        self.assertEqual(parsed[0].form, [('x', '1'), ('y', '2'), ('x', '3')])
+        self.assertEqual(parsed[0].content_type,
+            'application/x-www-form-urlencoded')
+
+    def test_should_detect_the_file_format(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        path = os.path.join(folder, 'requests')
+
+        with open(path, 'w') as f:
+            f.write('http://foo.com/a\n')
+        self.assertEqual(load_requests(path)[0].url, 'http://foo.com/a')
+
+        with open(path, 'w') as f:
+            json.dump({'log': {'entries': [{'request': {
+                'method': 'GET', 'url': 'http://foo.com/har'}}]}}, f)
+        self.assertEqual(load_requests(path)[0].url, 'http://foo.com/har')
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def test_should_limit_requests_per_host(self):
+        limiter = RateLimiter(20)
+        started = time.time()
+        for _ in range(30):
+            limiter.wait('foo.com')
+        # 20 from the initial burst, then 10 more at 20/s
+        self.assertGreater(time.time() - started, 0.4)
+
+    def test_hosts_should_not_share_a_bucket(self):
+        limiter = RateLimiter(5)
+        started = time.time()
+        for i in range(5):
+            limiter.wait('a.com')
+            limiter.wait('b.com')
+        self.assertLess(time.time() - started, 0.1)
+
+
+class TestRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.origin = EchoOrigin(('127.0.0.1', 0), EchoOriginHandler)
+        thread = threading.Thread(target=self.origin.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.origin.server_close)
+        self.addCleanup(self.origin.shutdown)
+        self.host = '127.0.0.1:{}'.format(self.origin.server_address[1])
+
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        for name in ('hulk.recorder.dataset_folder', 'hulk.utils.dataset_folder',
+                'hulk.handler.dataset_folder'):
+            patcher = mock.patch(name, self.folder)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def record(self, lines, **kwargs):
+        recorder = Recorder('testing', concurrency=4, rate=0, **kwargs)
+        return recorder.record(list(requests_from_url_list(lines)))
+
+    def replay(self, url, **kwargs):
+        with mock.patch('hulk.handler.hot_cache', HotCache()):
+            with mock.patch.dict(app.config, {'dataset': 'testing'}):
+                with app.test_request_context(url, **kwargs):
+                    response = app.make_response(
+                        handle_request(request,
+                        url.split('?')[0].split('/', 3)[3]))
+                    response.direct_passthrough = False
+                    return response.status_code, response.get_data()
+
+    def test_recordings_should_replay_through_the_proxy(self):
+        url = 'http://{}/items?page=2&sort=name'.format(self.host)
+        self.assertEqual(self.record([url]), {'recorded': 1})
+        self.assertEqual(self.replay(url),
+            (200, 'GET /items?page=2&sort=name'))
+
+    def test_should_store_the_origin_status_and_headers(self):
+        self.record(['http://{}/a'.format(self.host)])
+        folder = os.path.join(self.folder, 'testing', self.host)
+        with open(os.path.join(folder, os.listdir(folder)[0]), 'rb') as f:
+            envelope = read_envelope(f.read())
+        self.assertEqual(envelope.status, 200)
+        self.assertEqual(envelope.header('x-echo'), 'GET')
+        self.assertIsNone(envelope.header('Content-Length'))
+
+    def test_should_record_into_the_manifest(self):
+        self.record(['http://{}/a'.format(self.host)])
+        records = load_manifest(os.path.join(self.folder, 'testing'))
+        self.assertEqual([r['url'] for r in records.values()],
+            ['{}/a'.format(self.host)])
+
+    def test_should_record_the_request_made_under_rules(self):
+        folder = os.path.join(self.folder, 'testing')
+        os.makedirs(folder)
+        with open(os.path.join(folder, RULES_FILENAME), 'w') as config:
+            config.write('{"rules": [{"ignore_params": ["_"], '
+                '"wildcard_params": ["session"], '
+                '"map_path": ["^/v2/", "/v1/"]}]}')
+        self.addCleanup(forget_rules, folder)
+        self.record(['http://{}/v2/items?_=123&session=abc&q=1'.format(
+            self.host)])
+        records = load_manifest(folder)
+        self.assertEqual([r['url'] for r in records.values()],
+            ['{}/v2/items?_=123&q=1&session=abc'.format(self.host)])
+        self.assertEqual(self.replay('http://{}/v2/items?_=9&session=x&q=1'
+            .format(self.host)), (200, 'GET /v2/items?_=123&session=abc&q=1'))
+
+    def test_should_re_record_manifests_with_their_methods(self):
+        lines = ['POST http://{}/search?q=civic'.format(self.host),
+            'http://{}/a'.format(self.host)]
+        self.record(lines)
+        folder = os.path.join(self.folder, 'testing')
+        self.assertEqual(sorted(r['method']
+            for r in load_manifest(folder).values()), ['GET', 'POST'])
+
+        recorder = Recorder('testing', concurrency=2, rate=0, overwrite=True)
+        self.assertEqual(recorder.record(load_requests(folder)),
+            {'recorded': 2})
+        self.assertEqual(len(load_manifest(folder)), 2)
+        self.assertEqual(self.replay('http://{}/search?q=civic'.format(
+            self.host), method='POST'), (200, 'POST /search?q=civic '))
+
+    def test_should_skip_recorded_responses_unless_overwriting(self):
+        urls = ['http://{}/a'.format(self.host)]
+        self.record(urls)
+        self.assertEqual(self.record(urls), {'skipped': 1})
+        self.assertEqual(self.record(urls, overwrite=True), {'recorded': 1})
+
+    def test_should_skip_responses_a_parent_layer_has(self):
+        urls = ['http://{}/a'.format(self.host)]
+        self.record(urls)
+        os.rename(os.path.join(self.folder, 'testing'),
+            os.path.join(self.folder, 'default'))
+        os.makedirs(os.path.join(self.folder, 'testing'))
+        forget_index(os.path.join(self.folder, 'testing'))
+        with open(os.path.join(self.folder, 'testing', LAYERS_FILENAME),
+                'w') as config:
+            config.write('{"parents": ["default"]}')
+        forget_stack(self.folder, 'testing')
+        self.assertEqual(self.record(urls), {'skipped': 1})
+
+    def test_should_count_failures(self):
+        counts = self.record(['http://{}/a'.format(self.host),
+            'http://{}/broken'.format(self.host)])
+        self.assertEqual(counts, {'recorded': 1, 'failed': 1})
+
+    def test_should_record_and_replay_other_statuses(self):
+        urls = ['http://{}/missing'.format(self.host),
+            'http://{}/moved'.format(self.host)]
+        self.assertEqual(self.record(urls), {'recorded': 2})
+        self.assertEqual(self.replay(urls[0]), (404, 'nope'))
+        self.assertEqual(self.replay(urls[1]), (301, 'moved'))
+
+    def test_should_record_many_requests_concurrently(self):
+        urls = ['http://{}/item/{}'.format(self.host, i) for i in range(40)]
+        self.assertEqual(self.record(urls), {'recorded': 40})
+        self.assertEqual(self.replay(urls[17]), (200, 'GET /item/17'))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from werkzeug.datastructures import Headers, MultiDict
+
+from hulk.keys import KeyEngine, build_filename
+from hulk.rules import RULES_FILENAME, RuleSet, forget_rules, get_rules
+
+
+class TestRuleSet(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = RuleSet([
+            {'host': '*', 'ignore_params': ['_', 'utm_*']},
+            {'host': 'api.foo.com', 'path': '^/search',
+                'wildcard_params': ['session'],
+                'drop_headers': ['X-Request-Id'],
+                'map_path': ['^/search/v2', '/search']},
+        ])
+
+    def test_should_ignore_params_on_every_host(self):
+        path, vals, _ = self.rules.apply('bar.com', '/items',
+            [('a', '1'), ('_', '123'), ('utm_source', 'x')], None)
+        self.assertEqual((path, vals), ('/items', [('a', '1')]))
+
+    def test_should_apply_every_matching_rule(self):
+        path, vals, headers = self.rules.apply('api.foo.com:8080',
+            '/search/v2', MultiDict([('q', 'x'), ('session', 'abc'),
+                ('_', '1')]), Headers([('X-Request-Id', '1'),
+                    ('Accept', 'text/html')]))
+        self.assertEqual(path, '/search')
+        self.assertEqual(sorted(vals), [('q', 'x'), ('session', '*')])
+        self.assertEqual(headers, {'accept': 'text/html'})
+
+    def test_should_only_apply_rules_matching_the_path(self):
+        path, vals, _ = self.rules.apply('api.foo.com', '/items',
+            {'session': 'abc'}, None)
+        self.assertEqual((path, vals), ('/items', [('session', 'abc')]))
+
+    def test_hosts_without_rules_should_be_left_alone(self):
+        rules = RuleSet([{'host': 'api.foo.com', 'ignore_params': ['_']}])
+        vals = {'_': '1'}
+        self.assertIs(rules.apply('bar.com', '/', vals, None)[1], vals)
+
+    def test_should_refuse_unknown_fields(self):
+        self.assertRaises(ValueError, RuleSet, [{'ignore': ['_']}])
+        self.assertRaises(ValueError, RuleSet, [{'map_path': ['^/v2']}])
+
+
+class TestRulesKeys(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.addCleanup(forget_rules, self.folder)
+
+    def test_datasets_without_rules_should_have_none(self):
+        self.assertIsNone(get_rules(self.folder))
+
+    def test_volatile_requests_should_share_a_key(self):
+        with open(os.path.join(self.folder, RULES_FILENAME), 'w') as config:
+            json.dump({'rules': [{'ignore_params': ['cb'],
+                'wildcard_params': ['token']}]}, config)
+        rules = get_rules(self.folder)
+        first = build_filename('/a', {'cb': '1', 'token': 'x'},
+            hostname='foo.com', rules=rules)
+        second = build_filename('/a', {'cb': '2', 'token': 'y'},
+            hostname='foo.com', rules=rules)
+        self.assertEqual(first, second)
+        self.assertEqual(first[1], '/a?token=%2A')
+        self.assertNotEqual(first, build_filename('/a', {'cb': '2'},
+            hostname='foo.com', rules=rules))
+
+    def test_dropped_headers_should_be_left_out_of_the_key(self):
+        engine = KeyEngine(headers=['accept', 'x-request-id'])
+        rules = RuleSet([{'drop_headers': ['x-request-id']}])
+        path, vals, headers = rules.apply('foo.com', '/a', None,
+            {'X-Request-Id': '1', 'Accept': 'text/html'})
+        self.assertEqual(engine.key(path, vals, headers=headers),
+            engine.key('/a', None, headers={'Accept': 'text/html'}))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import signal
+import socket
+import threading
+import time
+import unittest
+import urllib2
+
+from hulk.server import PooledWSGIServer, run_prefork
+
+
+def slow_app(environ, start_response):
+    time.sleep(0.3)
+    start_response('200 OK', [('Content-type', 'text/plain')])
+    return ['done']
+
+
+class TestPooledWSGIServer(unittest.TestCase):
+
+    def setUp(self):
+        self.server = PooledWSGIServer('127.0.0.1', 0, slow_app, workers=4)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.port)
+
+    def test_should_start_the_requested_number_of_workers(self):
+        self.assertEqual(len(self.server.pool), 4)
+
+    def test_should_serve_requests_concurrently(self):
+        results = []
+
+        def fetch():
+            results.append(urllib2.urlopen(self.url).read())
+
+        started = time.time()
+        clients = [threading.Thread(target=fetch) for _ in range(4)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        # four 300ms requests on four workers should overlap
+        self.assertEqual(results, ['done'] * 4)
+        self.assertLess(time.time() - started, 1.0)
+
+
+class TestRunPrefork(unittest.TestCase):
+
+    def setUp(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        self.url = 'http://127.0.0.1:{}/'.format(port)
+
+        warmed = []
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-type', 'text/plain')])
+            return ['{} {}'.format(os.getpid(), warmed[0])]
+
+        self.runner = os.fork()
+        if self.runner == 0:
+            try:
+                run_prefork(app, '127.0.0.1', port, 2, workers=2,
+                    before_fork=lambda: warmed.append(os.getpid()))
+            finally:
+                os._exit(0)
+        self.addCleanup(os.waitpid, self.runner, 0)
+        self.addCleanup(os.kill, self.runner, signal.SIGTERM)
+
+    def fetch(self):
+        deadline = time.time() + 10
+        while True:
+            try:
+                return map(int, urllib2.urlopen(self.url).read().split())
+            except urllib2.URLError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def test_should_serve_from_children_sharing_the_parents_state(self):
+        served_by, warmed_by = self.fetch()
+        self.assertEqual(warmed_by, self.runner)
+        self.assertNotIn(served_by, (self.runner, os.getpid()))
+
+    def test_should_replace_processes_that_die(self):
+        served_by, _ = self.fetch()
+        os.kill(served_by, signal.SIGKILL)
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            try:
+                os.kill(served_by, 0)
+            except OSError:
+                break
+            time.sleep(0.05)
+        time.sleep(1.5)
+        pids = set(self.fetch()[0] for _ in range(20))
+        self.assertNotIn(served_by, pids)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import unittest
+
+from hulk.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def test_should_return_function_result(self):
+        flights = SingleFlight()
+        self.assertEqual(flights.do('key', lambda x: x * 2, 21), 42)
+        self.assertEqual(flights.stats()['calls'], 1)
+        self.assertEqual(flights.stats()['in_flight'], 0)
+
+    def test_should_coalesce_concurrent_calls_for_the_same_key(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        calls = []
+        results = []
+
+        def fetch():
+            calls.append(1)
+            release.wait()
+            return 'content'
+
+        def client():
+            results.append(flights.do('key', fetch))
+
+        clients = [threading.Thread(target=client) for _ in range(5)]
+        for thread in clients:
+            thread.start()
+        while flights.stats()['coalesced'] < 4:
+            time.sleep(0.01)
+        release.set()
+        for thread in clients:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['content'] * 5)
+        self.assertEqual(flights.stats()['coalesced'], 4)
+
+    def test_should_share_the_leaders_exception(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        errors = []
+
+        def fetch():
+            release.wait()
+            raise ValueError('origin down')
+
+        def client():
+            try:
+                flights.do('key', fetch)
+            except ValueError as e:
+                errors.append(e)
+
+        clients = [threading.Thread(target=client) for _ in range(3)]
+        for thread in clients:
+            thread.start()
+        while flights.stats()['coalesced'] < 2:
+            time.sleep(0.01)
+        release.set()
+        for thread in clients:
+            thread.join()
+
+        self.assertEqual(len(errors), 3)
+
+    def test_should_not_coalesce_different_keys(self):
+        flights = SingleFlight()
+        flights.do('a', lambda: 1)
+        flights.do('b', lambda: 2)
+        self.assertEqual(flights.stats()['calls'], 2)
+        self.assertEqual(flights.stats()['coalesced'], 0)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from hulk.codec import decode, detect, get_codec
+from hulk.stream import RecordingStream
+
+
+class FakeUpstream(object):
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class TestRecordingStream(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.path = os.path.join(self.folder, 'hash')
+        self.completed = []
+
+    def on_complete(self, error=None):
+        self.completed.append(error)
+
+    def test_should_pass_chunks_through_and_save_them(self):
+        upstream = FakeUpstream(['a' * 10, 'b' * 10])
+        stream = RecordingStream(upstream, self.path, self.on_complete)
+
+        self.assertEqual(list(stream), ['a' * 10, 'b' * 10])
+        stream.close()
+        with open(self.path) as saved:
+            self.assertEqual(saved.read(), 'a' * 10 + 'b' * 10)
+        self.assertEqual(self.completed, [None])
+        self.assertTrue(upstream.closed)
+
+    def test_should_not_create_the_file_until_complete(self):
+        stream = RecordingStream(FakeUpstream(['a', 'b']), self.path,
+            self.on_complete)
+        next(iter(stream))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_should_finish_recording_when_client_goes_away(self):
+        stream = RecordingStream(FakeUpstream(['a', 'b', 'c']), self.path,
+            self.on_complete)
+        chunks = iter(stream)
+        next(chunks)
+        chunks.close()
+        stream.close()
+
+        with open(self.path) as saved:
+            self.assertEqual(saved.read(), 'abc')
+        self.assertEqual(self.completed, [None])
+
+    def test_should_discard_temp_file_on_origin_error(self):
+        error = IOError('connection reset')
+        stream = RecordingStream(FakeUpstream(['a', error]), self.path,
+            self.on_complete)
+
+        with self.assertRaises(IOError):
+            list(stream)
+        stream.close()
+        self.assertEqual(os.listdir(self.folder), [])
+        self.assertEqual(self.completed, [error])
+
+    def test_should_compress_the_file_but_not_the_client_copy(self):
+        stream = RecordingStream(FakeUpstream(['a' * 100, 'b' * 100]),
+            self.path, self.on_complete, codec=get_codec('gzip', self.folder))
+
+        self.assertEqual(''.join(stream), 'a' * 100 + 'b' * 100)
+        stream.close()
+        with open(self.path, 'rb') as saved:
+            stored = saved.read()
+        self.assertEqual(detect(stored), 'gzip')
+        self.assertEqual(decode(stored, self.folder), 'a' * 100 + 'b' * 100)
@@ -7,19 +7,21 @@ import md5
 import mock
 import os
 import requests
+import shutil
+import tempfile
 import unittest
 import hulk.utils
 import hulk.application
 
 from hulk.utils import build_filename, create_dataset_folder, load_original, \
-    save_original, serve_file, record_file, get_dataset_folder
+    save_original, serve_file, record_file, stream_original
 from hulk.exceptions import IFuckedUpException
 
 
 class TestLoadOriginal(unittest.TestCase):
 
     def test_should_return_response_text_on_get_request(self):
-        with mock.patch('requests.get') as patched_get:
+        with mock.patch('hulk.utils.origin_pool.request') as patched_get:
             # fudge a requests.Response object
             class FakeResponse(object):
                 status_code = 200
@@ -34,7 +36,7 @@ class TestLoadOriginal(unittest.TestCase):
             self.assertEqual(response, 'foo bar')
 
     def test_should_raise_exception_on_get_non_200(self):
-        with mock.patch('requests.get') as patched_get:
+        with mock.patch('hulk.utils.origin_pool.request') as patched_get:
             # fudge a requests.Response object
             class FakeResponse(object):
                 status_code = 500
@@ -49,7 +51,7 @@ class TestLoadOriginal(unittest.TestCase):
                 load_original(FakeRequest())
 
     def test_post_should_process_both_params_and_form_data(self):
-        with mock.patch('requests.post') as patched_post:
+        with mock.patch('hulk.utils.origin_pool.request') as patched_post:
             # fudge a requests.Response object
             class FakeResponse(object):
                 status_code = 200
@@ -69,14 +71,14 @@ class TestLoadOriginal(unittest.TestCase):
             response = load_original(FakeRequest())
 
             # check the params and data are passed properly to requests
-            patched_post.assert_called_with('http://foo/baz',
+            patched_post.assert_called_with('POST', 'http://foo/baz',
                 data={'form':'mock'},params={'args':'mock'})
 
             # check our response value
             self.assertEqual(response, 'foo bar')
 
     def test_should_raise_exception_on_post_non_200(self):
-        with mock.patch('requests.post') as patched_post:
+        with mock.patch('hulk.utils.origin_pool.request') as patched_post:
             # fudge a requests.Response object
             class FakeResponse(object):
                 status_code = 500
@@ -97,7 +99,7 @@ class TestLoadOriginal(unittest.TestCase):
                 response = load_original(FakeRequest()) 
 
     def test_put_should_process_both_params_and_form_data(self):
-        with mock.patch('requests.put') as patched_put:
+        with mock.patch('hulk.utils.origin_pool.request') as patched_put:
             # fudge a requests.Response object
             class FakeResponse(object):
                 status_code = 200
@@ -117,14 +119,14 @@ class TestLoadOriginal(unittest.TestCase):
             response = load_original(FakeRequest())
 
             # check the params and data are passed properly to requests
-            patched_put.assert_called_with('http://foo/baz',
+            patched_put.assert_called_with('PUT', 'http://foo/baz',
                 data={'form':'mock'},params={'args':'mock'})
 
             # check our response value
             self.assertEqual(response, 'foo bar')
 
     def test_should_raise_exception_on_put_non_200(self):
-        with mock.patch('requests.put') as patched_put:
+        with mock.patch('hulk.utils.origin_pool.request') as patched_put:
             # fudge a requests.Response object
             class FakeResponse(object):
                 status_code = 500
@@ -145,7 +147,61 @@ class TestLoadOriginal(unittest.TestCase):
                 response = load_original(FakeRequest()) 
 
 
+class TestStreamOriginal(unittest.TestCase):
+
+    def test_should_request_the_original_as_a_stream(self):
+        with mock.patch('hulk.utils.origin_pool.request') as patched_request:
+            patched_request.return_value = mock.Mock(status_code=200)
+
+            class FakeRequest(object):
+                url = 'http://foo/baz'
+                method = 'GET'
+            response = stream_original(FakeRequest())
+
+            patched_request.assert_called_with('GET', 'http://foo/baz',
+                stream=True, allow_redirects=False)
+            self.assertIs(response, patched_request.return_value)
+
+    def test_should_return_redirects_and_client_errors(self):
+        with mock.patch('hulk.utils.origin_pool.request') as patched_request:
+            for status in (301, 404):
+                patched_request.return_value = mock.Mock(status_code=status)
+
+                class FakeRequest(object):
+                    url = 'http://foo/baz'
+                    method = 'GET'
+                response = stream_original(FakeRequest())
+                self.assertEqual(response.status_code, status)
+                self.assertFalse(response.close.called)
+
+    def test_should_close_and_raise_exception_on_server_errors(self):
+        with mock.patch('hulk.utils.origin_pool.request') as patched_request:
+            patched_request.return_value = mock.Mock(status_code=500)
+
+            class FakeRequest(object):
+                url = 'http://foo/baz'
+                method = 'PUT'
+                args = mock.Mock()
+                form = mock.Mock()
+                def __init__(self):
+                    self.args.to_dict = mock.Mock(return_value={'args':'mock'})
+                    self.form.to_dict = mock.Mock(return_value={'form':'mock'})
+
+            with self.assertRaises(IFuckedUpException):
+                stream_original(FakeRequest())
+            patched_request.assert_called_with('PUT', 'http://foo/baz',
+                stream=True, allow_redirects=False, data={'form':'mock'},
+                params={'args':'mock'})
+            self.assertTrue(patched_request.return_value.close.called)
+
+
 class TestSaveOriginal(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('os.rename')
+        self.addCleanup(patcher.stop)
+        self.mock_os_rename = patcher.start()
+
     def test_should_write_file_to_disk(self):
         mock_open = mock.mock_open()
 
@@ -153,10 +209,19 @@ class TestSaveOriginal(unittest.TestCase):
         # that you call it in (as a builtin)
         with mock.patch('hulk.utils.open', mock_open, create=True):
             save_original('foo/path', 'Some foo content.')
-            mock_open.assert_called_once_with('foo/path', 'w')
+            temp_path = mock_open.call_args[0][0]
+            self.assertTrue(temp_path.startswith('foo/path.'))
+            mock_open.assert_called_once_with(temp_path, 'w')
             handle = mock_open()
             handle.write.assert_called_once_with('Some foo content.')
 
+    def test_should_rename_temp_file_into_place(self):
+        mock_open = mock.mock_open()
+        with mock.patch('hulk.utils.open', mock_open, create=True):
+            save_original('foo/path', 'Some foo content.')
+            temp_path = mock_open.call_args[0][0]
+            self.mock_os_rename.assert_called_once_with(temp_path, 'foo/path')
+
     def test_should_encode_unicode_content_to_utf8(self):
         mock_open = mock.mock_open()
 
@@ -164,7 +229,6 @@ class TestSaveOriginal(unittest.TestCase):
         # that you call it in (as a builtin)
         with mock.patch('hulk.utils.open', mock_open, create=True):
             save_original('foo/path', u'y\u00f4')
-            mock_open.assert_called_once_with('foo/path', 'w')
             handle = mock_open()
             handle.write.assert_called_once_with('y\xc3\xb4')
 
@@ -191,27 +255,31 @@ class TestServeFile(unittest.TestCase):
 
 class TestRecordFile(unittest.TestCase):
 
-    def test_should_create_dataset_file_when_missing(self):
-        mock_open = mock.mock_open()
-        with mock.patch('hulk.utils.open', mock_open, create=True):
-            with mock.patch('os.path.exists') as exists:
-                exists.return_value = False
-
-                # excercise code
-                record_file('foo-dataset', 'asdf', 'text/foo', 'http://foo')
-                file_path = get_dataset_folder() + '/foo-dataset/dataset.json'
-
-                # verify the test, would confirm the filename structure
-                exists.assert_called_with(file_path)
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        os.makedirs(os.path.join(self.folder, 'foo-dataset'))
 
-                # yucky to bind to the inner functionality, but reliable
-                mock_open.assert_any_call(file_path, 'w')
-                mock_open.assert_any_call(file_path, 'r+')
+        patcher = mock.patch('hulk.utils.dataset_folder', self.folder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
-                # prove that file.write() was called with the proper structure
-                instance = mock_open()
-                instance.write.assert_called_once_with(
-                    '{"asdf": {"url": "http://foo", "content-type": "text/foo"}}')
+    def test_should_append_record_to_manifest_log(self):
+        record_file('foo-dataset', 'asdf', 'text/foo', 'http://foo')
+        record_file('foo-dataset', 'qwer', 'text/bar', 'http://bar')
+
+        file_path = os.path.join(self.folder, 'foo-dataset', 'dataset.jsonl')
+        with open(file_path) as log:
+            self.assertEqual(log.read(),
+                '{"content-type": "text/foo", "hash": "asdf", '
+                '"url": "http://foo"}\n'
+                '{"content-type": "text/bar", "hash": "qwer", '
+                '"url": "http://bar"}\n')
+
+    def test_should_not_rewrite_the_manifest_snapshot(self):
+        record_file('foo-dataset', 'asdf', 'text/foo', 'http://foo')
+        self.assertFalse(os.path.exists(
+            os.path.join(self.folder, 'foo-dataset', 'dataset.json')))
 
 
 class TestBuildFilename(unittest.TestCase):